@@ -1,9 +1,80 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
+
+from event_exim.models import EventSource, SyncRun
+
+# how many recent runs EventSourceAdmin shows trends for
+RUN_TREND_SIZE = 10
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+def sparkline(values):
+    """e.g. [1, 5, 10] => '▁▄█'"""
+    if not values:
+        return ''
+    top = max(values) or 1
+    return ''.join(SPARKS[int(round(v / top * (len(SPARKS) - 1)))] for v in values)
 
-from event_exim.models import EventSource
 
 @admin.register(EventSource)
 class EventSourceAdmin(admin.ModelAdmin):
 
     list_display = ('name', 'origin_organization', 'crm_type',
-                    'update_style', 'allows_updates', 'last_update')
+                    'update_style', 'allows_updates', 'last_update',
+                    'last_run', 'run_trend')
+
+    def _recent_runs(self, obj):
+        if not hasattr(obj, '_recent_runs'):
+            obj._recent_runs = list(obj.sync_runs.exclude(status='running')[:RUN_TREND_SIZE])
+        return obj._recent_runs
+
+    def last_run(self, obj):
+        runs = self._recent_runs(obj)
+        if runs:
+            return format_html('<a href="{}?source__id__exact={}">{} {}s, {} fetched</a>',
+                               reverse('admin:event_exim_syncrun_changelist'), obj.id,
+                               runs[0].status, runs[0].duration, runs[0].fetched)
+
+    def run_trend(self, obj):
+        """Durations of recent runs (oldest first), and the latest vs. their average"""
+        runs = self._recent_runs(obj)
+        durations = [r.duration or 0 for r in reversed(runs)]
+        if not durations:
+            return ''
+        average = sum(durations) / len(durations)
+        memory = max(r.peak_memory_kb or 0 for r in runs)
+        return '{} {}s avg, latest {:+.0%}, {} MB peak'.format(
+            sparkline(durations), round(average, 1),
+            (durations[-1] - average) / average if average else 0,
+            memory // 1024)
+    run_trend.short_description = 'recent runs'
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+
+    list_display = ('source', 'started_at', 'status', 'duration',
+                    'fetched', 'inserted', 'updated', 'unchanged', 'failed',
+                    'remote_requests', 'remote_bytes', 'peak_memory_kb', 'phase_summary',
+                    'stage_summary')
+    list_filter = ('source', 'status')
+    date_hierarchy = 'started_at'
+    readonly_fields = [f.name for f in SyncRun._meta.fields] + ['duration']
+
+    def phase_summary(self, obj):
+        return ', '.join('{} {}s'.format(phase, seconds)
+                         for phase, seconds in sorted(obj.phases.items(),
+                                                      key=lambda p: -p[1]))
+    phase_summary.short_description = 'seconds per phase'
+
+    def stage_summary(self, obj):
+        busy = ', '.join('{} {:.0%}'.format(stage, fraction)
+                         for stage, fraction in obj.stage_utilization.items())
+        queues = ', '.join('{} {}/{}'.format(name, d['mean'], d['size'])
+                           for name, d in sorted(obj.depths.items()))
+        return '; '.join(filter(None, [busy, queues]))
+    stage_summary.short_description = 'stages busy; mean queue depths'
+
+    def has_add_permission(self, request):
+        return False
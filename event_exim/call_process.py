@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 
 import boto3
 import django
@@ -15,36 +16,62 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "eventroller.settings")
 django.setup()
 
 
-def run_daily(event, context):
+def run_sources(update_style, workers=None, timeout=None):
+    """
+    Syncs all EventSources with update_style concurrently (see event_exim.runner)
+    and then (without EVENT_EXIM_DUPE_INDEX) looks for duplicates among the new events
+    """
     from event_exim.models import EventSource
-    last_update = None
-    for source in EventSource.objects.filter(update_style=3):  # 3=daily
-        if last_update is None:
-            last_update = source.last_update
-        else:
-            last_update = min(source.last_update, last_update)
-        source.update_events()
-
-    from event_exim.models import EventDupeGuesses
+    from event_exim.runner import min_last_update, sync_sources
+    sources = list(EventSource.objects.filter(update_style=update_style))
+    last_update = min_last_update(sources)
+    summary = sync_sources(sources, workers=workers, timeout=timeout)
+    for result in summary['sources']:
+        print(result)
+
+    from event_exim.dupe_matching import DUPE_INDEX
+    if DUPE_INDEX:
+        # dupe guesses were already made as the events were saved
+        return summary
+    from event_exim.models import EventDupeGuesses, SyncRun
+    started = time.time()
     dupes = EventDupeGuesses.get_potential_dupes(last_update)
     if dupes:
         EventDupeGuesses.record_potential_dupes(dupes)
     else:
         print("no new suspected duplicated events")
+    SyncRun.add_phase([r['run'] for r in summary['sources'] if r.get('run')],
+                      'dupes', time.time() - started)
+    return summary
+
+
+def run_refresh_queue(event, context):
+    """Refreshes events queued by the refresh_event pixel -- schedule this every minute or so"""
+    from event_exim.refresh_queue import drain_refresh_queue
+    counts = drain_refresh_queue()
+    print(counts)
+    return counts
+
+
+def run_mail_spool(event, context):
+    """Sends messages queued by the reviewer admin -- schedule this every minute or so"""
+    from reviewer.mail_spool import send_spooled
+    counts = send_spooled()
+    print(counts)
+    return counts
+
+
+def run_bulk_jobs(event, context):
+    """Does bulk notes/messages queued from the reviewer admin -- schedule this every minute or so"""
+    from reviewer.bulk_jobs import run_bulk_jobs as run_jobs
+    results = run_jobs()
+    print(results)
+    return results
+
+
+def run_daily(event, context):
+    return run_sources(3)  # 3=daily
 
 
 def run_hourly(event, context):
-    from event_exim.models import EventSource
-    last_update = None
-    for source in EventSource.objects.filter(update_style=4):  # 4=hourly
-        if last_update is None:
-            last_update = source.last_update
-        else:
-            last_update = min(source.last_update, last_update)
-        source.update_events()
-    from event_exim.models import EventDupeGuesses
-    dupes = EventDupeGuesses.get_potential_dupes(last_update)
-    if dupes:
-        EventDupeGuesses.record_potential_dupes(dupes)
-    else:
-        print("no new suspected duplicated events")
+    return run_sources(4)  # 4=hourly
@@ -1,14 +1,25 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import datetime
-from itertools import chain
+from itertools import chain, islice
+from operator import attrgetter
 import json
+import logging
+import math
 import re
 from urllib.parse import quote as urlquote
 
+from django.conf import settings
 from django.utils.html import format_html, mark_safe
+import requests
 
 from actionkit.api.event import AKEventAPI
 from actionkit.api.user import AKUserAPI
 from actionkit.utils import generate_akid
+from event_exim.connectors import base_connector
+from event_exim.connectors.base_connector import event_batches
+from event_exim.connectors.http_client import mount_pooled_adapter
+from event_exim.connectors.token_cache import TokenCache
 from event_store.models import Activist, Event, CHOICES
 
 """
@@ -24,10 +35,23 @@ Non-standard use in ActionKit:
 
 """
 
+logger = logging.getLogger(__name__)
+
 #MYSQL 2016-12-12 18:00:00
 DATE_FMT = '%Y-%m-%d %H:%M:%S'
 
-_LOGIN_TOKENS = {}
+# seconds ActionKit auto-login tokens are good for, unless a source says otherwise
+LOGIN_TOKEN_LIFETIME = getattr(settings, 'EVENT_EXIM_AK_LOGIN_TOKEN_LIFETIME', 24 * 60 * 60)
+
+# how many distinct date strings to keep parsed
+DATE_CACHE_SIZE = getattr(settings, 'EVENT_EXIM_AK_DATE_CACHE_SIZE', 50000)
+# most cohost signups to create after a sync (the rest wait for the next one)
+COHOST_SIGNUP_BATCH = getattr(settings, 'EVENT_EXIM_AK_COHOST_SIGNUP_BATCH', 1000)
+_DATE_CACHE = {}
+_STATE_RE = re.compile(r'^[A-Z][A-Z]$')
+
+_AKAPIS = {}  # shared clients by credentials
+_LOGIN_TOKEN_CACHES = {}  # by base_url
 
 
 class AKAPI(AKUserAPI, AKEventAPI):
@@ -35,7 +59,103 @@ class AKAPI(AKUserAPI, AKEventAPI):
     pass
 
 
-class Connector:
+def parse_date(value):
+    """DATE_FMT string to datetime -- cached, since many events share start times"""
+    parsed = _DATE_CACHE.get(value)
+    if parsed is None:
+        if len(_DATE_CACHE) >= DATE_CACHE_SIZE:
+            _DATE_CACHE.clear()
+        if len(value) == 19 and value[4] == '-' and value[13] == ':':
+            # DATE_FMT, without strptime's overhead
+            parsed = datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                       int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        else:
+            parsed = datetime.datetime.strptime(value, DATE_FMT)
+        _DATE_CACHE[value] = parsed
+    return parsed
+
+
+class RowDecoder:
+    """
+    Decodes rows from Connector.sql_query. It is built once per column layout:
+    * record(row) wraps a row as a compact record with a name for each column
+      ('ee.id' is record.ee_id), instead of looking up field_indexes by name
+    * common(row) cleans the event's own columns with one check for the whole
+      row, and parses the date columns
+    """
+
+    def __init__(self, common_fields, other_fields, event_fields, date_fields):
+        columns = (list(common_fields)
+                   + list(other_fields)
+                   # this looks complicated, but just alternates between <field>, <field>_id for the eventfield id
+                   + list(chain(*[(ef, '%s_id' % ef) for ef in event_fields])))
+        self.field_indexes = {k: i for i, k in enumerate(columns)}
+        self.record_class = namedtuple('AKEventRow', [re.sub(r'\W', '_', c) for c in columns])
+        self.record = self.record_class._make
+        self.common_fields = tuple(common_fields)
+        self.state_index = self.common_fields.index('state')
+        self.date_indexes = [self.common_fields.index(f) for f in date_fields]
+
+    def common(self, row):
+        """
+        Returns ({common field: value}, whether the values looked like a hack attempt)
+        """
+        values = list(row[:len(self.common_fields)])
+        hackattempt = False
+        if '\x00' in ''.join([v for v in values if v.__class__ is str]):
+            hackattempt = True
+            # it would be nice to have a longer in-place message,
+            # but we don't want to break char-count maximums
+            values = [v.replace('\x00', 'X') if isinstance(v, str) else v for v in values]
+        state = values[self.state_index]
+        if isinstance(state, str):
+            state = state.upper()  # tx => TX
+            if not _STATE_RE.match(state):
+                # indication of corrupted state
+                hackattempt = True
+                state = 'XX'
+            values[self.state_index] = state
+        for i in self.date_indexes:
+            if values[i]:
+                values[i] = parse_date(values[i])
+        return dict(zip(self.common_fields, values)), hackattempt
+
+
+def shared_akapi(data):
+    """
+    One AKAPI client per ActionKit instance+credentials in the process,
+    using the shared connection pool for its host
+    """
+    key = (data['base_url'], data['api_user'], data['api_password'], data.get('ak_secret'))
+    akapi = _AKAPIS.get(key)
+    if akapi is None:
+        class aksettings:
+            AK_BASEURL = data['base_url']
+            AK_USER = data['api_user']
+            AK_PASSWORD = data['api_password']
+            AK_SECRET = data.get('ak_secret')
+        akapi = AKAPI(aksettings)
+        if hasattr(getattr(akapi, 'client', None), 'mount'):
+            mount_pooled_adapter(akapi.client, data['base_url'])
+        akapi = _AKAPIS.setdefault(key, akapi)
+    return akapi
+
+
+def login_token_cache(base_url, lifetime):
+    """
+    Shared cache of login tokens for one ActionKit instance.
+    Tokens are only kept for half their lifetime, so the ones we
+    hand out (e.g. in emails) still have a while to go.
+    """
+    cache = _LOGIN_TOKEN_CACHES.get(base_url)
+    if cache is None:
+        cache = _LOGIN_TOKEN_CACHES.setdefault(
+            base_url, TokenCache('ak_login_{}'.format(base_url.split('/')[2]),
+                                 ttl=max(int(lifetime) // 2, 1)))
+    return cache
+
+
+class Connector(base_connector.Connector):
     """
     This connects to ActionKit with the rest api -- queries are done through
     ad-hoc report queries: https://roboticdogs.actionkit.com/docs/manual/api/rest/reports.html#running-an-ad-hoc-query
@@ -71,13 +191,9 @@ class Connector:
     event_fields = ['review_status', 'prep_status',
                     'needs_organizer_help', 'political_scope', 'public_phone', 'venue_category']
 
+    decoder = RowDecoder(common_fields, other_fields, event_fields, date_fields)
     #column indexes for the above fields
-    field_indexes = {k: i for i, k in enumerate(
-        common_fields
-        + other_fields
-        # this looks complicated, but just alternates between <field>, <field>_id for the eventfield id
-        + list(chain(*[(ef, '%s_id' % ef) for ef in event_fields]))
-    )}
+    field_indexes = decoder.field_indexes
 
     sql_query = (
         "SELECT %(commonfields)s, %(otherfields)s, %(eventfields)s"
@@ -99,7 +215,7 @@ class Connector:
         " xxADDITIONAL_WHERExx "  # will be replaced with text or empty string on run
         # we need to include hostcreateaction in group by so it doesn't get squashed with first match
         " GROUP BY ee.id, host.id, hostcreateaction.action_ptr_id"
-        " ORDER BY {{ ordering }} DESC"
+        " ORDER BY xxORDERINGxx"  # e.g. 'ee.updated_at DESC, ee.id DESC' so an event's rows are together
         " LIMIT {{ max_results }}"
         " OFFSET {{ offset }}"
     ) % {'commonfields': ','.join(['ee.{}'.format(f) for f in common_fields]),
@@ -126,6 +242,15 @@ class Connector:
                                                  ' the database. (if not set, then it will go'
                                                  'all the way back)'),
                                    'required': False},
+                'pagination': {'help_text': ('"cursor" (default) pages through events by (updated_at, id),'
+                                             ' so every page costs the same. "offset" uses LIMIT/OFFSET'),
+                               'required': False},
+                'backfill_parallelism': {'help_text': ('When loading all events (e.g. --from_start), how many'
+                                                       ' ranges of event ids to load at the same time (default 4)'),
+                                         'required': False},
+                'backfill_shard_size': {'help_text': ('About how many events each range of event ids'
+                                                      ' should have when backfilling (default 5000)'),
+                                        'required': False},
                 'base_url': {'help_text': 'base url like "https://roboticdocs.actionkit.com"',
                              'required': True},
                 'allowed_hosts': {'help_text': ('defaults to base_url host, but if you have other'
@@ -133,6 +258,9 @@ class Connector:
                                   'required': False},
                 'ak_secret': {'help_text': 'actionkit "Secret" needed for auto-login tokens',
                               'required': False},
+                'login_token_lifetime': {'help_text': ('Seconds an auto-login token is good for (default'
+                                                       ' one day). Tokens are cached for half that.'),
+                                         'required': False},
                 'ignore_host_ids': {'help_text': ('if you want to ignore certain hosts'
                                                   ' (due to automation/admin status) add'
                                                   ' them as a json list of integers'),
@@ -152,20 +280,17 @@ class Connector:
         data = event_source.data
 
         self.base_url = data['base_url']
-
-        class aksettings:
-            AK_BASEURL = data['base_url']
-            AK_USER = data['api_user']
-            AK_PASSWORD = data['api_password']
-            AK_SECRET = data.get('ak_secret')
-        self.akapi = AKAPI(aksettings)
+        self.akapi = shared_akapi(data)
         self.ignore_hosts = set()
         if 'ignore_host_ids' in data:
             self.ignore_hosts = set([int(h) for h in data['ignore_host_ids'].split(',')
                                      if re.match(r'^\d+$', h)
                                      ])
+        self.login_tokens = login_token_cache(
+            data['base_url'], data.get('login_token_lifetime') or LOGIN_TOKEN_LIFETIME)
         self.cohost_id = data.get('cohost_id')
         self.cohost_autocreate_page_id = data.get('cohost_autocreate_page_id')
+        self._slug_prefix = re.sub(r'\W', '', self.base_url.split('://')[1])
         self._allowed_hosts = set(data['base_url'].split('/')[2])
         if data.get('allowed_hosts'):
             self._allowed_hosts.update(data['allowed_hosts'].split(','))
@@ -173,7 +298,7 @@ class Connector:
     def allowed_hosts(self):
         return self._allowed_hosts
 
-    def _load_events_from_sql(self, ordering='ee.updated_at', max_results=10000, offset=0,
+    def _load_events_from_sql(self, ordering='ee.updated_at DESC, ee.id DESC', max_results=10000, offset=0,
                               additional_where=[], additional_params={}):
         """
         With appropriate sql query gets all the events via report/run/sql api
@@ -182,40 +307,40 @@ class Connector:
         """
         if max_results > 10000:
             raise Exception("ActionKit doesn't permit adhoc sql queries > 10000 results")
+        if not re.match(r'^[\w., ]+$', ordering):
+            raise Exception("Invalid ordering: %s" % ordering)
         where_clause = ''
         if additional_where:
             where_clause = ' WHERE %s' % ' AND '.join(additional_where)
-        query = {'query': self.sql_query.replace('xxADDITIONAL_WHERExx', where_clause),
-                 'ordering': ordering,
+        query = {'query': (self.sql_query
+                           .replace('xxADDITIONAL_WHERExx', where_clause)
+                           .replace('xxORDERINGxx', ordering)),
                  'max_results': max_results,
                  'refresh': True,
                  'offset': offset}
         query.update(additional_params)
-        res = self.akapi.client.post('{}/rest/v1/report/run/sql/'.format(self.base_url),
-                                     json=query)
+        res = self.http.post('{}/rest/v1/report/run/sql/'.format(self.base_url),
+                             session=self.akapi.client, json=query)
         if res.status_code == 200:
             return res.json()
 
-    def _host2activist(self, host):
-        """from dict out of _convert_host, into an activist model"""
-        args = host.copy()
-        args.pop('create_action')
-        return Activist(member_system=self.source, **args)
-
-    def _convert_host(self, event_row):
-        fi = self.field_indexes
-        return dict(member_system_pk=str(event_row[fi['u.id']]),
-                    name='{} {}'.format(event_row[fi['u.first_name']], event_row[fi['u.last_name']]),
-                    email=event_row[fi['u.email']],
-                    hashed_email=Activist.hash(event_row[fi['u.email']]),
-                    phone=event_row[fi['recentphone.value']],
+    def _convert_host(self, record):
+        """
+        Host fields from a RowDecoder record -- a dict, not an Activist:
+        EventSource.update_events_from_dicts saves hosts all together
+        """
+        return dict(member_system_pk=str(record.u_id),
+                    name='{} {}'.format(record.u_first_name, record.u_last_name),
+                    email=record.u_email,
+                    hashed_email=Activist.hash(record.u_email),
+                    phone=record.recentphone_value,
                     #non Activist fields:
                     # we try hostaction2 -- a signup instead of create, first,
                     # because if there's a signup, there won't be a create
                     # however the create action will join on all events
                     # since the create action is just based on event_id, not the user
-                    create_action=(event_row[fi['hostaction2.action_ptr_id']]
-                                   or event_row[fi['hostaction.id']])
+                    create_action=(record.hostaction2_action_ptr_id
+                                   or record.hostaction_id)
                     )
 
     def _convert_event(self, event_rows):
@@ -223,28 +348,13 @@ class Connector:
         Based on a row from self.sql_query, returns a
         dict of fields that correspond directly to an event_store.models.Event object
         """
-        event_row = event_rows[0]
-        fi = self.field_indexes
-        hackattempt = False
-
-        def cleanchars(val, key):
-            if isinstance(val, str):
-                if key == 'state':
-                    if not re.match(r'^[A-Z][A-Z]$', val.upper()):
-                        # indication of corrupted state
-                        hackattempt = True
-                        return 'XX'
-                    return val.upper()  # tx => TX
-                if '\x00' in val:
-                    hackattempt = True
-                    # it would be nice to have a longer in-place message,
-                    # but we don't want to break char-count maximums
-                    return val.replace('\x00', 'X')
-            return val
-        event_fields = {k: cleanchars(event_row[fi[k]], k) for k in self.common_fields}
-        signuppage = event_row[fi['signuppage.name']]
-        campaign_slug = event_row[fi['ec.name']]
-        e_id = event_row[fi['ee.id']]
+        decoder = self.decoder
+        records = [decoder.record(row) for row in event_rows]
+        first = records[0]
+        event_fields, hackattempt = decoder.common(event_rows[0])
+        signuppage = first.signuppage_name
+        campaign_slug = first.ec_name
+        e_id = first.ee_id
         rsvp_url = (
             '{base}/event/{attend_page}/{event_id}/'.format(
                 base=self.base_url, attend_page=signuppage, event_id=e_id)
@@ -253,8 +363,8 @@ class Connector:
             '{base}/event/{attend_page}/search/'.format(
                 base=self.base_url, attend_page=signuppage)
             if signuppage else None)
-        slug = '{}-{}'.format(re.sub(r'\W', '', self.base_url.split('://')[1]), e_id)
-        state, district = (event_row[fi['ee.us_district']] or '_').split('_')
+        slug = '{}-{}'.format(self._slug_prefix, e_id)
+        state, district = (first.ee_us_district or '_').split('_')
         ocdep_location = ('ocd-division/country:us/state:{}/cd:{}'.format(state.lower(), district)
                           if state and district else None)
 
@@ -262,8 +372,8 @@ class Connector:
         hosts = {}
         main_host_id = None
         cohost_create_action = None
-        for row in sorted(event_rows, key=lambda r: r[fi['host.id']]):
-            host = self._convert_host(row)
+        for record in sorted(records, key=attrgetter('host_id')):
+            host = self._convert_host(record)
             hostpk = int(host['member_system_pk'])
             if not main_host_id and hostpk not in self.ignore_hosts:
                 main_host_id = hostpk
@@ -273,59 +383,54 @@ class Connector:
                 hosts[hostpk] = host
             if hostpk == self.cohost_id:
                 cohost_create_action = host['create_action']
+        json_data = {
+            # other random data to keep around
+            'campaign_id': first.ee_campaign_id,
+            'create_page': first.createpage_name,
+            'create_action_id': cohost_create_action,
+            'hosts': hosts,
+            'hack': hackattempt,
+            'campaign_slug': campaign_slug,
+        }
         if self.cohost_autocreate_page_id \
            and self.cohost_id \
            and not cohost_create_action:
-            # cohost has not been added yet -- let's add it
-            res = self.akapi.create_signup(self.cohost_id,
-                                           e_id,
-                                           self.cohost_autocreate_page_id,
-                                           role='host',
-                                           fields={'source': 'automatic',
-                                                   'provider': 'eventroller'})
-            if res and res.get('id'):
-                cohost_create_action = int(res['id'])
+            # cohost has not been added yet -- create_cohost_signups() adds it after the sync
+            json_data['cohost_signup_pending'] = True
 
+        main_host = None
+        if main_host_id:
+            main_host = hosts[main_host_id].copy()
+            main_host.pop('create_action')
         event_fields.update({'organization_official_event': False,
                              'event_type': 'unknown',
-                             'organization_host': (self._host2activist(hosts[main_host_id])
-                                                   if main_host_id else None),
+                             # saved as an Activist by EventSource.update_events_from_dicts
+                             'organization_host': main_host,
                              'organization_source': self.source,
                              'organization_source_pk': str(e_id),
                              'organization': self.source.origin_organization,
-                             'organization_campaign': event_row[fi['ec.title']],
-                             'is_searchable': (event_row[fi['status']] == 'active'
-                                               and not event_row[fi['is_private']]),
-                             'private_phone': event_row[fi['recentphone.value']] or '',
-                             'phone': event_row[fi['public_phone']] or '',
+                             'organization_campaign': first.ec_title,
+                             'is_searchable': (first.status == 'active'
+                                               and not first.is_private),
+                             'private_phone': first.recentphone_value or '',
+                             'phone': first.public_phone or '',
                              'url': rsvp_url,  # could also link to search page with hash
                              'slug': slug,
                              'osdi_origin_system': self.base_url,
                              'ticket_type': CHOICES['open'],
                              'share_url': search_url,
-                             'internal_notes': event_row[fi['ee.notes']],
+                             'internal_notes': first.ee_notes,
                              #e.g. NC cong district 2 = "ocd-division/country:us/state:nc/cd:2"
-                             'political_scope': (event_row[fi['political_scope']] or ocdep_location),
+                             'political_scope': (first.political_scope or ocdep_location),
                              #'dupe_id': None, #no need to set it
-                             'venue_category': CHOICES[event_row[fi['venue_category']] or 'unknown'],
-                             'needs_organizer_help': event_row[fi['needs_organizer_help']] == 'needs_organizer_help',
+                             'venue_category': CHOICES[first.venue_category or 'unknown'],
+                             'needs_organizer_help': first.needs_organizer_help == 'needs_organizer_help',
                              'rsvp_url': rsvp_url,
                              'event_facebook_url': None,
-                             'organization_status_review': event_row[fi['review_status']],
-                             'organization_status_prep': event_row[fi['prep_status']],
-                             'source_json_data': json.dumps({
-                                 # other random data to keep around
-                                 'campaign_id': event_row[fi['ee.campaign_id']],
-                                 'create_page': event_row[fi['createpage.name']],
-                                 'create_action_id': cohost_create_action,
-                                 'hosts': hosts,
-                                 'hack': hackattempt,
-                                 'campaign_slug': campaign_slug,
-                             }),
+                             'organization_status_review': first.review_status,
+                             'organization_status_prep': first.prep_status,
+                             'source_json_data': json.dumps(json_data, sort_keys=True),
                              })
-        for df in self.date_fields:
-            if event_fields[df]:
-                event_fields[df] = datetime.datetime.strptime(event_fields[df], DATE_FMT)
         return event_fields
 
     def get_event(self, event_id):
@@ -337,7 +442,25 @@ class Connector:
         if events:
             return self._convert_event(events)
 
-    def load_events(self, max_events=None, last_updated=None):
+    # how many event ids to ask for in one query
+    get_events_chunk_size = 500
+
+    def get_events(self, event_ids):
+        """
+        Like get_event, for many events at once, with `ee.id IN (...)` queries
+        of get_events_chunk_size ids.  Ids that aren't numbers are skipped.
+        """
+        event_ids = sorted(set(int(e) for e in event_ids if str(e).strip().isdigit()))
+        events = []
+        for i in range(0, len(event_ids), self.get_events_chunk_size):
+            chunk = event_ids[i:i + self.get_events_chunk_size]
+            # they're all ints, so it's safe to put them straight into the sql
+            event_rows = self._iter_event_rows_by_cursor(
+                additional_where=['ee.id IN ({})'.format(','.join(str(e) for e in chunk))])
+            events.extend(self.converted(event_rows, self._convert_event))
+        return events
+
+    def _load_filters(self, last_updated=None):
         additional_where = []
         additional_params = {}
         campaign = self.source.data.get('campaign')
@@ -347,29 +470,215 @@ class Connector:
         if last_updated:
             additional_where.append('ee.updated_at > {{ last_updated }}')
             additional_params['last_updated'] = last_updated
-        # all_events keyed by id with values as a list of event_rows for the event
-        # there can be multiple rows, at least because there can be multiple hosts
-        all_events = {}
-        max_events = max_events or self.source.data.get('max_event_load')
+        return additional_where, additional_params
+
+    def _iter_event_rows(self, max_events=None, page_size=10000,
+                         additional_where=[], additional_params={}):
+        """
+        Pages through sql_query results, yielding the list of rows for each event.
+        There can be multiple rows per event, at least because there can be multiple hosts.
+        Rows are ordered by event, but the last event on a page can continue
+        onto the next one, so we hold it back until we have seen the next page.
+        """
+        e_id_index = self.field_indexes['ee.id']
         event_count = 0
-        for offset in range(0, max_events, min(10000, max_events)):
-            if event_count > max_events:
-                break
-            events = self._load_events_from_sql(offset=offset,
-                                                additional_where=additional_where,
-                                                additional_params=additional_params,
-                                                max_results=min(10000, max_events))
-            if not events:
-                break
-            for event_row in events:
-                e_id = event_row[self.field_indexes['ee.id']]
-                if e_id in all_events:
-                    all_events[e_id].append(event_row)
-                else:
-                    all_events[e_id] = [event_row]
-                    event_count = event_count + 1
-        return {'events': [self._convert_event(event_rows) for event_rows in all_events.values()],
-                'last_updated': datetime.datetime.utcnow().strftime(DATE_FMT)}
+        offset = 0
+        carry = []
+        while True:
+            rows = self._load_events_from_sql(offset=offset,
+                                              additional_where=additional_where,
+                                              additional_params=additional_params,
+                                              max_results=page_size) or []
+            offset += len(rows)
+            last_page = len(rows) < page_size
+            events = OrderedDict()
+            for event_row in carry + rows:
+                events.setdefault(event_row[e_id_index], []).append(event_row)
+            carry = []
+            if events and not last_page:
+                carry = events.popitem()[1]
+            for event_rows in events.values():
+                yield event_rows
+                event_count += 1
+                if max_events and event_count >= max_events:
+                    return
+            if last_page:
+                return
+
+    def _iter_event_rows_by_cursor(self, max_events=None, page_size=10000,
+                                   additional_where=[], additional_params={},
+                                   cursor=None, descending=False, progress=None):
+        """
+        Like _iter_event_rows, but with keyset pagination: rather than an OFFSET,
+        which makes ActionKit rescan all the earlier rows for every page,
+        each page starts after the (updated_at, id) of the last event on the
+        previous page, so every page costs the same no matter how deep we are.
+        LIMIT counts rows, not events, so a full page's last event may be cut off.
+        We drop it, and the next page starts with all of its rows.
+        `cursor` is an (updated_at, event id) to start after.
+        If passed, progress['after'] is set to the cursor for each event before it is yielded.
+        """
+        fi = self.field_indexes
+        op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+        ordering = 'ee.updated_at {d}, ee.id {d}'.format(d=direction)
+        cursor_where = ('(ee.updated_at ' + op + ' {{ cursor_updated_at }}'
+                        ' OR (ee.updated_at = {{ cursor_updated_at }} AND ee.id ' + op + ' {{ cursor_id }}))')
+        event_count = 0
+        while True:
+            where = list(additional_where)
+            params = dict(additional_params)
+            if cursor:
+                where.append(cursor_where)
+                params.update({'cursor_updated_at': cursor[0], 'cursor_id': cursor[1]})
+            rows = self._load_events_from_sql(ordering=ordering,
+                                              max_results=page_size,
+                                              additional_where=where,
+                                              additional_params=params) or []
+            last_page = len(rows) < page_size
+            events = OrderedDict()
+            for event_row in rows:
+                events.setdefault(event_row[fi['ee.id']], []).append(event_row)
+            if events and not last_page and len(events) > 1:
+                # if a single event fills the whole page, we can't do better than a partial event
+                events.popitem()
+            for event_rows in events.values():
+                cursor = (event_rows[0][fi['updated_at']], event_rows[0][fi['ee.id']])
+                if progress is not None:
+                    progress['after'] = list(cursor)
+                yield event_rows
+                event_count += 1
+                if max_events and event_count >= max_events:
+                    return
+            if last_page or not events:
+                return
+
+    def _event_id_range(self, additional_where=[], additional_params={}):
+        """
+        Returns (min id, max id, count) of events matching additional_where
+        or None if there aren't any (or there's an error)
+        """
+        where_clause = ''
+        if additional_where:
+            where_clause = ' WHERE %s' % ' AND '.join(additional_where)
+        query = {'query': 'SELECT MIN(ee.id), MAX(ee.id), COUNT(*) FROM events_event ee' + where_clause,
+                 'refresh': True}
+        query.update(additional_params)
+        res = self.http.post('{}/rest/v1/report/run/sql/'.format(self.base_url),
+                             session=self.akapi.client, json=query)
+        if res.status_code == 200:
+            rows = res.json()
+            if rows and rows[0][0] is not None:
+                return [int(x) for x in rows[0]]
+
+    @staticmethod
+    def _id_shards(min_id, max_id, count, shard_size):
+        """split min_id..max_id into (start, end) ranges of about shard_size events each"""
+        shard_count = max(1, int(math.ceil(count / float(shard_size))))
+        step = int(math.ceil((max_id - min_id + 1) / float(shard_count)))
+        return [(start, min(start + step - 1, max_id))
+                for start in range(min_id, max_id + 1, step)]
+
+    def _iter_event_rows_sharded(self, shards, parallelism=4, page_size=10000,
+                                 additional_where=[], additional_params={}, progress=None):
+        """
+        Loads ranges of event ids (shards) concurrently, with at most `parallelism`
+        ActionKit queries at a time, and yields each event's rows as its shard arrives.
+        Shards don't overlap, and within a shard we page by cursor, so an event's
+        rows are never split.
+        If passed, progress['shards'] is kept to the shards that aren't all yielded yet.
+        """
+        def load_shard(shard):
+            where = list(additional_where) + ['ee.id BETWEEN {{ shard_start }} AND {{ shard_end }}']
+            params = dict(additional_params, shard_start=shard[0], shard_end=shard[1])
+            return list(self._iter_event_rows_by_cursor(page_size=page_size,
+                                                        additional_where=where,
+                                                        additional_params=params))
+
+        shards = [list(shard) for shard in shards]
+        if progress is not None:
+            progress['shards'] = list(shards)
+        shard_iter = iter(shards)
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            pending = {executor.submit(load_shard, shard): shard
+                       for shard in islice(shard_iter, parallelism)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = pending.pop(future)
+                    # keep loading while the caller converts and saves
+                    next_shard = next(shard_iter, None)
+                    if next_shard:
+                        pending[executor.submit(load_shard, next_shard)] = next_shard
+                    shard_rows = future.result()
+                    for i, event_rows in enumerate(shard_rows):
+                        if progress is not None and i == len(shard_rows) - 1:
+                            progress['shards'].remove(shard)
+                        yield event_rows
+                    if progress is not None and shard in progress['shards']:
+                        # it was empty
+                        progress['shards'].remove(shard)
+
+    def load_event_batches(self, max_events=None, last_updated=None, batch_size=1000, cursor=None):
+        """
+        With cursor paging, batches have a cursor to resume from: the shards
+        left for a full load, or the last (updated_at, id) otherwise.
+        Offset paging can't resume.
+        """
+        additional_where, additional_params = self._load_filters(last_updated)
+        max_events = int(max_events or self.source.data.get('max_event_load') or 0)
+        # take the watermark before loading, so anything updated meanwhile is loaded next time
+        # (when resuming, that's from before the first try)
+        new_last_updated = datetime.datetime.utcnow().strftime(DATE_FMT)
+        if cursor:
+            new_last_updated = cursor['new_last_updated']
+        else:
+            cursor = {}
+        page_size = min(10000, max_events or 10000)
+        cursor_paging = self.source.data.get('pagination', 'cursor') == 'cursor'
+        parallelism = int(self.source.data.get('backfill_parallelism') or 4)
+        progress = {}
+        shards = cursor.get('shards')
+        if shards is None and 'after' not in cursor \
+           and cursor_paging and not last_updated and not max_events and parallelism > 1:
+            # a full (re)load: split it up by event id and load the pieces concurrently
+            id_range = self._event_id_range(additional_where, additional_params)
+            if id_range:
+                shards = self._id_shards(*id_range,
+                                         shard_size=int(self.source.data.get('backfill_shard_size') or 5000))
+        if shards is not None:
+            event_rows = self._iter_event_rows_sharded(shards,
+                                                       parallelism=parallelism,
+                                                       page_size=page_size,
+                                                       additional_where=additional_where,
+                                                       additional_params=additional_params,
+                                                       progress=progress)
+        elif cursor_paging:
+            # with a max, we want the most recently updated events, like offset paging
+            event_rows = self._iter_event_rows_by_cursor(max_events=max_events,
+                                                         page_size=page_size,
+                                                         additional_where=additional_where,
+                                                         additional_params=additional_params,
+                                                         cursor=cursor.get('after'),
+                                                         descending=bool(max_events),
+                                                         progress=progress)
+        else:
+            event_rows = self._iter_event_rows(max_events=max_events,
+                                               page_size=page_size,
+                                               additional_where=additional_where,
+                                               additional_params=additional_params)
+            progress = None
+        # rows are fetched ahead of converting, so batches get where conversion is up to
+        checkpoint = {} if progress is not None else None
+        return event_batches(self.converted(event_rows, self._convert_event,
+                                            progress=progress, checkpoint=checkpoint),
+                             batch_size, last_updated, new_last_updated, progress=checkpoint)
+
+    def load_events(self, max_events=None, last_updated=None):
+        events = []
+        for batch in self.load_event_batches(max_events=max_events, last_updated=last_updated):
+            events.extend(batch['events'])
+        return {'events': events,
+                'last_updated': batch['last_updated']}
 
     def update_review(self, event, reviews, log_message):
         res = self.akapi.get_event(event.organization_source_pk)
@@ -382,6 +691,68 @@ class Connector:
                                                r.key, r.decision,
                                                eventfield_id=eventfields.get(r.key))
 
+    def finish_sync(self):
+        return self.create_cohost_signups()
+
+    def create_cohost_signups(self, limit=COHOST_SIGNUP_BATCH):
+        """
+        With cohost_autocreate_page_id, signs up the cohost as a host of the events
+        that were converted without one (marked cohost_signup_pending), concurrently
+        and rate limited like our other requests ('requests_per_second').
+        Each new signup is saved as the event's create_action_id.  Failures stay
+        pending, to be retried after the next sync.
+        Returns {'created': #, 'failed': #, 'errors': [the first few errors]}
+        """
+        if not (self.cohost_autocreate_page_id and self.cohost_id):
+            return {'created': 0, 'failed': 0, 'errors': []}
+        pending = []
+        # the key narrows it down in SQL; the decoded value decides
+        candidates = Event.objects.filter(
+            organization_source=self.source,
+            source_json_data__contains='cohost_signup_pending'
+        ).values_list('id', 'organization_source_pk', 'source_json_data')
+        for event_id, e_id, jsondata in candidates.iterator():
+            json_data = json.loads(jsondata)
+            if json_data.get('cohost_signup_pending') is True:
+                pending.append((event_id, e_id, json_data))
+                if len(pending) >= limit:
+                    break
+
+        def signup(event):
+            """Returns (create_action_id, None) or (None, error)"""
+            if self.http.rate_limiter:
+                self.http.rate_limiter.acquire()
+            try:
+                res = self.akapi.create_signup(self.cohost_id,
+                                               int(event[1]),
+                                               self.cohost_autocreate_page_id,
+                                               role='host',
+                                               fields={'source': 'automatic',
+                                                       'provider': 'eventroller'})
+            except (requests.RequestException, ValueError) as e:
+                error = 'event {}: {}: {}'.format(event[1], type(e).__name__, e)
+            else:
+                if res and res.get('id'):
+                    return int(res['id']), None
+                error = 'event {}: no signup in response: {}'.format(event[1], res)
+            logger.warning('cohost signup failed for %s', error)
+            return None, error
+
+        with ThreadPoolExecutor(max_workers=self.http_max_concurrency) as executor:
+            results = list(executor.map(signup, pending))
+        created = 0
+        errors = []
+        for (event_id, e_id, json_data), (create_action_id, error) in zip(pending, results):
+            if create_action_id:
+                json_data.pop('cohost_signup_pending', None)
+                json_data['create_action_id'] = create_action_id
+                Event.objects.filter(id=event_id).update(
+                    source_json_data=json.dumps(json_data, sort_keys=True))
+                created += 1
+            else:
+                errors.append(error)
+        return {'created': created, 'failed': len(errors), 'errors': errors[:10]}
+
     def get_admin_event_link(self, event):
         if event.source_json_data:
             cid = json.loads(event.source_json_data).get('campaign_id')
@@ -389,7 +760,26 @@ class Connector:
                 return '{}/admin/events/event/?campaign={cid}&event_id={eid}'.format(
                     self.base_url, cid=cid, eid=event.organization_source_pk)
 
-    def get_host_event_link(self, event, edit_access=False, host_id=None, confirm=False):
+    def get_login_tokens(self, host_ids):
+        """
+        Returns {str(host_id): auto-login token} from the shared cache,
+        fetching any that aren't cached concurrently
+        """
+        if not self.akapi.secret:
+            return {}
+
+        def fetch(missing):
+            with ThreadPoolExecutor(max_workers=self.http_max_concurrency) as executor:
+                return dict(zip(missing, executor.map(self.akapi.login_token, missing)))
+
+        return self.login_tokens.get_many([str(h) for h in host_ids if h], fetch)
+
+    def get_host_event_link(self, event, edit_access=False, host_id=None, confirm=False,
+                            login_tokens=None):
+        """
+        login_tokens can be {str(host id): token} from get_login_tokens(), for
+        making many links without looking up each host's token separately
+        """
         if event.status != 'active':
             return None
         jsondata = event.source_json_data
@@ -414,11 +804,9 @@ class Connector:
             host_link = urlquote(host_link + '?confirmed=1')
 
         if edit_access and host_id and self.akapi.secret:
-            #easy memoization for a single user
-            token = _LOGIN_TOKENS.get(host_id, False)
-            if token is False:
-                token = self.akapi.login_token(host_id)
-                _LOGIN_TOKENS[host_id] = token
+            if login_tokens is None or str(host_id) not in login_tokens:
+                login_tokens = self.get_login_tokens([host_id])
+            token = login_tokens.get(str(host_id))
             if token:
                 host_link = '/login/?i={}&l=1&next={}'.format(token, host_link)
         return '{}{}'.format(self.base_url, host_link)
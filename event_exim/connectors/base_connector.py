@@ -1,8 +1,108 @@
+from collections import deque
+import copy
+from itertools import chain, islice
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import cached_property
+
+from event_exim.connectors.http_client import HttpClient
+from event_exim.pipeline import FETCH_QUEUE_SIZE, SYNC_PIPELINE, pipelined
+from event_exim.timing import PhaseTimer
+from event_store.models import Activist
+
 """
 This is a template for writing a connector.
 We should make documentation for that in docs/ and reference this file.
+
+Connectors can subclass Connector here to get defaults, e.g. self.http
 """
 
+# worker processes for converting events in big loads -- 0 or 1 converts in the syncing process
+CONVERT_PROCESSES = getattr(settings, 'EVENT_EXIM_CONVERT_PROCESSES', 0)
+# items sent to a worker process at a time
+CONVERT_CHUNK_SIZE = getattr(settings, 'EVENT_EXIM_CONVERT_CHUNK_SIZE', 500)
+
+# the connector in a worker process
+_POOL_CONNECTOR = None
+
+
+def _set_pool_connector(connector):
+    # the Pool initializer -- the worker is forked, so it's ours, not a pickled copy
+    global _POOL_CONNECTOR
+    _POOL_CONNECTOR = connector
+
+
+def _convert_chunk(convert_name, items):
+    """Runs in a worker process (see Connector.converted)"""
+    convert = getattr(_POOL_CONNECTOR, convert_name)
+    return [_POOL_CONNECTOR._plain_event(convert(item)) for item in items]
+
+
+def _read_chunks(timer, items, progress):
+    """
+    Yields (chunk of items, copy of `progress` after reading them), timing the reading as 'fetch'
+    """
+    items = iter(items)
+    while True:
+        with timer.phase('fetch'):
+            chunk = list(islice(items, CONVERT_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield chunk, (copy.deepcopy(progress) if progress is not None else None)
+
+
+def _can_fork():
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        return False  # no /dev/shm for multiprocessing on Lambda
+    try:
+        multiprocessing.get_context('fork')
+    except ValueError:
+        return False
+    if threading.active_count() > 1:
+        # a lock another thread holds would be held forever in the children,
+        # e.g. when event_exim.runner syncs sources in threads
+        return False
+    # we close the database connection before forking, which we can't do mid-transaction
+    return not any(conn.in_atomic_block for conn in connections.all())
+
+
+def event_batches(events, batch_size, last_updated, new_last_updated, progress=None):
+    """
+    Chunks an iterable of event dicts into load_event_batches() batches.
+    Only the final batch carries new_last_updated -- earlier ones keep
+    the last_updated we started from.
+    If the connector can resume, `progress` is a dict it keeps up to date as
+    it yields each event (e.g. {'after': <sort key of the last event>}).
+    Each batch but the last gets a copy as its 'cursor' (with new_last_updated),
+    which can be passed back to load_event_batches() to continue after that batch.
+    """
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= batch_size:
+            cursor = None
+            if progress:
+                cursor = dict(copy.deepcopy(progress), new_last_updated=new_last_updated)
+            yield {'events': batch, 'last_updated': last_updated, 'cursor': cursor}
+            batch = []
+    yield {'events': batch, 'last_updated': new_last_updated, 'cursor': None}
+
+
+# stand-ins for model instances in _plain_event()
+_SOURCE = '<event_exim: event source>'
+_ORGANIZATION = '<event_exim: organization>'
+
+
+def _set_progress(checkpoint, progress):
+    # `progress` is already a copy that nothing else changes
+    if checkpoint is not None and progress is not None:
+        checkpoint.clear()
+        checkpoint.update(progress)
+
 
 class Connector:
 
@@ -19,6 +119,9 @@ class Connector:
                 'config_option_2': {'help_text': 'This text describes the option',
                                     'required': False},}
 
+    # default for how many requests to the event system one EventSource can have in flight
+    http_max_concurrency = 4
+
     def __init__(self, event_source):
         # the top event source that is using this connector
         self.source = event_source
@@ -26,6 +129,137 @@ class Connector:
         # and connect to the event system
         self.parameter_data = event_source.data
 
+    @cached_property
+    def http(self):
+        """
+        Pooled HTTP client for this source (see http_client.HttpClient).
+        Make remote calls through this to get keep-alive connections, retries,
+        rate limits and request stats.  Optional source data:
+         * 'max_concurrent_requests': default is http_max_concurrency
+         * 'requests_per_second': rate limit (default: none)
+        """
+        data = self.source.data
+        if not isinstance(data, dict):
+            data = {}
+        return HttpClient(
+            max_concurrency=int(data.get('max_concurrent_requests') or self.http_max_concurrency),
+            rate_limit=(float(data['requests_per_second'])
+                        if data.get('requests_per_second') else None))
+
+    @cached_property
+    def phases(self):
+        """Time spent per phase of the current sync (EventSource.update_events resets it)"""
+        return PhaseTimer()
+
+    # False if converting makes remote calls or uses the database (so can't be in worker processes)
+    convert_in_processes = True
+    _convert_pool = None
+
+    def start_convert_pool(self):
+        """
+        With EVENT_EXIM_CONVERT_PROCESSES > 1, forks that many worker processes
+        for converted() to use, until stop_convert_pool().
+        Each worker is a copy of this process as it is, including any locks
+        another thread is holding, so we only fork when ours is the only thread
+        (and EventSource.update_events calls this before it starts any).
+        Returns the pool, or None for converting in-process.
+        """
+        if CONVERT_PROCESSES > 1 and self.convert_in_processes \
+           and self._convert_pool is None and _can_fork():
+            # workers get a copy of everything, so load anything converting would query for now
+            getattr(self.source, 'origin_organization', None)
+            # they'd share our database connection otherwise; we'll reconnect when we need to
+            connections.close_all()
+            self._convert_pool = multiprocessing.get_context('fork').Pool(
+                CONVERT_PROCESSES, initializer=_set_pool_connector, initargs=(self,))
+        return self._convert_pool
+
+    def stop_convert_pool(self):
+        if self._convert_pool is not None:
+            self._convert_pool.terminate()
+            self._convert_pool = None
+
+    def converted(self, items, convert, progress=None, checkpoint=None):
+        """
+        Yields convert(item) for each of items, timing the 'fetch' of the items
+        (waiting on the remote system) and their 'convert'.
+
+        Items are read a chunk of EVENT_EXIM_CONVERT_CHUNK_SIZE at a time -- ahead,
+        in another thread, with EVENT_EXIM_SYNC_PIPELINE (see event_exim.pipeline).
+        If start_convert_pool() started worker processes, `convert` is one of our methods,
+        and there are more than a couple of chunks, the workers convert the chunks.
+
+        So for resumable loads, pass the `progress` dict the items iterator keeps
+        up to date, and a separate `checkpoint` dict for event_batches(): it is kept
+        to a copy of `progress` from no later than reading the last event yielded.
+        """
+        chunks = _read_chunks(self.phases, items, progress if checkpoint is not None else None)
+        if SYNC_PIPELINE:
+            chunks = pipelined(chunks, FETCH_QUEUE_SIZE, 'fetched', self.phases)
+        if self._convert_pool is not None and getattr(convert, '__self__', None) is self:
+            # only worth sending to the workers if there's more than a couple of chunks
+            first = list(islice(chunks, 2))
+            chunks = chain(first, chunks)
+            if len(first) == 2 and len(first[1][0]) == CONVERT_CHUNK_SIZE:
+                yield from self._converted_in_processes(chunks, convert.__name__, checkpoint)
+                return
+        for chunk, after in chunks:
+            for i, item in enumerate(chunk):
+                with self.phases.phase('convert'):
+                    event = convert(item)
+                if i == len(chunk) - 1:
+                    _set_progress(checkpoint, after)
+                yield event
+
+    def _converted_in_processes(self, chunks, convert_name, checkpoint):
+        """
+        Converts `chunks` (from _read_chunks) with our worker processes, in order,
+        keeping enough chunks in hand to keep them all busy.
+        """
+        pending = deque()
+        while True:
+            while len(pending) < CONVERT_PROCESSES * 2:
+                chunk, after = next(chunks, (None, None))
+                if chunk is None:
+                    break
+                pending.append((self._convert_pool.apply_async(_convert_chunk, (convert_name, chunk)),
+                                after))
+            if not pending:
+                break
+            result, after = pending.popleft()
+            with self.phases.phase('convert'):
+                events = result.get()
+            for i, event in enumerate(events):
+                if i == len(events) - 1:
+                    _set_progress(checkpoint, after)
+                yield self._unplain_event(event)
+
+    def _plain_event(self, event):
+        """
+        Makes an event dict picklable to send back from a worker process:
+        our source and organization are left out (and put back by _unplain_event)
+        and Activists become host dicts
+        """
+        plain = {}
+        for name, val in event.items():
+            if val is self.source:
+                val = _SOURCE
+            elif val is getattr(self.source, 'origin_organization', None):
+                val = _ORGANIZATION
+            elif isinstance(val, Activist):
+                val = {'member_system_pk': val.member_system_pk, 'name': val.name, 'email': val.email,
+                       'hashed_email': val.hashed_email, 'phone': val.phone}
+            plain[name] = val
+        return plain
+
+    def _unplain_event(self, plain):
+        for name, val in plain.items():
+            if val == _SOURCE:
+                plain[name] = self.source
+            elif val == _ORGANIZATION:
+                plain[name] = self.source.origin_organization
+        return plain
+
     def get_event(self, event_id):
         """
         event_id can be a number or a url, etc -- whatever the event system
@@ -38,6 +272,19 @@ class Connector:
             # 'organization_host' should be a dict with the event_store.models.Activist fields
         }
 
+    def get_events(self, event_ids):
+        """
+        Returns a list of event dicts (like get_event returns) for event_ids,
+        leaving out any that aren't found.  Override this if the event system
+        can fetch many events in one request -- by default we get_event() each one.
+        """
+        events = []
+        for event_id in event_ids:
+            event = self.get_event(event_id)
+            if event:
+                events.append(event)
+        return events
+
     def load_events(self, max_events=None, last_updated=None):
         raise NotImplementedError("get_event not implemented")
         return {
@@ -46,6 +293,28 @@ class Connector:
             ],
             'last_updated': 'some string that is useful for tracking the previous last-update moment'}
 
+    def load_event_batches(self, max_events=None, last_updated=None, batch_size=1000, cursor=None):
+        """
+        Yields dicts like load_events() returns, but with at most batch_size events
+        each, so a sync can save each batch as it arrives rather than holding
+        every event in memory.  'last_updated' on each batch is the watermark that
+        is safe to save once that batch (and all before it) are saved.
+        Batches can also have a 'cursor' (json-able): given back as `cursor`,
+        loading picks up after that batch (see event_batches()) -- that's how
+        EventSource.update_events resumes from a SyncCheckpoint.
+        Override this to stream from the event system -- by default we just
+        chunk load_events(), and can't resume (so `cursor` is ignored)
+        """
+        loaded = self.load_events(max_events=max_events, last_updated=last_updated)
+        return event_batches(loaded['events'], batch_size, last_updated, loaded['last_updated'])
+
+    #def finish_sync(self):
+    #    """
+    #    optional: remote calls that shouldn't hold up loading, made after
+    #    EventSource.update_events saves the events.  Return a dict of counts
+    #    (and e.g. 'errors'), which is saved on the SyncRun as finish_results.
+    #    """
+
     #def update_review(self, event, reviews, log_message):
     #    """
     #    optional to be implemented.  If you don't implement it, don't include this function
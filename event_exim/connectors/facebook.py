@@ -1,21 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 from itertools import chain
 import json
+import logging
 import re
 import time
+from urllib.parse import urlencode
 
-import requests
+from event_exim.connectors import base_connector
+from event_exim.connectors.base_connector import event_batches
 from event_store.models import Activist, CHOICES
 
+logger = logging.getLogger(__name__)
+
 #facebook wants php strtotime() format
 # https://secure.php.net/manual/en/function.strtotime.php
 DATE_FMT = '%Y-%m-%dT%H:%M:%S%z'
 
+class GraphError(Exception):
+    """A Graph API call failed (or Facebook had a server error on one request in a batch)"""
+
+
 def strip_tz(datetime):
     """Strip the timezone for USE_TZ=False"""
     return datetime.replace(tzinfo=None)
 
-class Connector:
+class Connector(base_connector.Connector):
     """
 
     """
@@ -70,6 +80,9 @@ class Connector:
                     'ticketing_terms_uri',
                 ]
 
+    # facebook's limit on requests per batch call (and ids per request)
+    GRAPH_BATCH_MAX = 50
+
     PAGE_FIELDS = ['id',
                    'name',
                    'cover.fields(id,source)',
@@ -206,76 +219,141 @@ class Connector:
                           'is_viewer_admin',
                           'can_viewer_post',
                           'owner')
-            }),
+            }, sort_keys=True),
         }
         return event_fields
 
 
-    def _api_load(self, ids, ids_are_events=True,
-                  since_str='', follow_next=None):
+    def _graph_batch(self, requests):
+        """
+        Fetches up to GRAPH_BATCH_MAX (relative_url, ...) `requests` in one Graph API
+        batch call, returning (request, decoded body) pairs.
+        A request Facebook refuses (4xx, e.g. a deleted event or a page we can't see)
+        is logged and comes back with a None body, like an id that isn't there.
+        Raises GraphError if the call fails or a request gets a server (5xx) error
+        or no response, since those should be retried rather than skipped.
+        See https://developers.facebook.com/docs/graph-api/making-multiple-requests
+        """
+        res = self.http.post(self.base_url, data={
+            'access_token': self.auth_token,
+            'include_headers': 'false',
+            'batch': json.dumps([{'method': 'GET', 'relative_url': r[0]} for r in requests])})
+        if res.status_code != 200:
+            raise GraphError('batch call failed with status {}: {}'.format(res.status_code, res.text[:200]))
+        responses = res.json()
+        results = []
+        for i, request in enumerate(requests):
+            response = responses[i] if i < len(responses) else None
+            # no query string: it has the ids, and maybe paging tokens
+            path = request[0].split('?')[0]
+            code = response.get('code') if response else None
+            if code is None or code >= 500:
+                raise GraphError('{} failed: {}'.format(
+                    path, response and response.get('body') or 'no response'))
+            if code != 200 or response.get('body') is None:
+                logger.warning('skipping %s (%s): %s', path, code, response.get('body'))
+                results.append((request, None))
+                continue
+            results.append((request, json.loads(response['body'])))
+        return results
+
+    def _crawl(self, ids, ids_are_events=True, since_str='', max_paging=None):
         """
-        Load a list of events from facebook api.
+        Yields facebook events as they load.
         if `ids` are comma-separated events, then ids_are_events=True
         if `ids` are comma-separated pages, then ids_are_events=False
+        and we follow each page's paging.next link up to max_paging times.
+
+        Each batch call asks for GRAPH_BATCH_MAX requests of up to GRAPH_BATCH_MAX ids,
+        and the batch calls run concurrently (bounded by self.http).  Next links
+        for every page are fetched together, round by round, so a crawl takes
+        as many rounds as the deepest page rather than the sum of all pages.
         """
-        ids = re.sub(r'[^\w,-]', '', ids) # securiteh!
-        if follow_next is None:
-            follow_next = self.max_paging
-        params = {"ids": ids,
-                  "access_token": self.auth_token}
+        ids = [i for i in re.sub(r'[^\w,-]', '', ids).split(',') if i] # securiteh!
+        if max_paging is None:
+            max_paging = int(self.max_paging)
         fieldlist = ','.join(self.EVENT_FIELDS)
+        if not ids_are_events:
+            fieldlist = 'events.fields({0}){1}'.format(fieldlist, since_str)
+        # requests are (relative_url, kind, paging left)
+        requests = [('{}?{}'.format(self.api_version,
+                                    urlencode({'ids': ','.join(ids[i:i + self.GRAPH_BATCH_MAX]),
+                                               'fields': fieldlist})),
+                     'ids', max_paging)
+                    for i in range(0, len(ids), self.GRAPH_BATCH_MAX)]
+        with ThreadPoolExecutor(max_workers=self.http_max_concurrency) as executor:
+            while requests:
+                futures = [executor.submit(self._graph_batch,
+                                           requests[i:i + self.GRAPH_BATCH_MAX])
+                           for i in range(0, len(requests), self.GRAPH_BATCH_MAX)]
+                requests = []
+                for future in as_completed(futures):
+                    for (url, kind, paging_left), body in future.result():
+                        if not body:
+                            continue
+                        # events return the event object directly
+                        # pages return arrays (under events.data), and paged
+                        # results return them under data
+                        # TODO: maybe the PAGE should be campaign or maybe page=owner?
+                        if kind == 'ids' and ids_are_events:
+                            results = [(event, None) for event in body.values()]
+                        elif kind == 'ids':
+                            results = [(page.get('events', {}), True) for page in body.values()]
+                        else:
+                            results = [(body, True)]
+                        for result, paged in results:
+                            if not paged:
+                                yield result
+                                continue
+                            for event in result.get('data', []):
+                                yield event
+                            next_link = result.get('paging', {}).get('next')
+                            if next_link and paging_left > 0:
+                                if next_link.startswith(self.base_url):
+                                    next_link = next_link[len(self.base_url):]
+                                requests.append((next_link, 'next', paging_left - 1))
 
-        if ids_are_events:
-            params['fields'] = fieldlist
-        else: #they must be pages
-            params['fields'] = "events.fields({0}){1}".format(
-                fieldlist, since_str)
-        res = requests.get('{}{}'.format(
-            self.base_url, self.api_version), params=params)
-        events = res.json()
-        # pages return arrays (under events.data)
-        # events return the event object directly
-        # so we homogenize the output to a single list
-        # TODO: maybe the PAGE should be campaign or maybe page=owner?
-        if ids_are_events:
-            return list(events.values())
-        else:
-            fb_events = []
-            for page_id, result in events.items():
-                fb_events.extend(result.get('events',{}).get('data',[]))
-                next_link = result.get('events',{}).get('paging',{}).get('next')
-                while next_link and follow_next > 0:
-                    events = requests.get(next_link).json()
-                    fb_events.extend(events.get('data',[]))
-                    next_link = result.get('paging',{}).get('next')
-                    follow_next = follow_next - 1
-            return fb_events
+    @staticmethod
+    def _event_id(event_id_or_url):
+        is_url = re.match(r'https://www.facebook.com/events/(\d+)', event_id_or_url)
+        if is_url:
+            return is_url.group(1)
+        return event_id_or_url
 
     def get_event(self, event_id_or_url):
         """
         Returns an a dict with all event_store.Event model fields
         """
-        is_url = re.match(r'https://www.facebook.com/events/(\d+)', event_id_or_url)
-        if is_url:
-            event_id_or_url = is_url.group(1)
-        events = self._api_load(event_id_or_url, ids_are_events=True)
+        events = list(self._crawl(self._event_id(event_id_or_url), ids_are_events=True))
         if events:
             return self._convert_event(events[0])
 
-    def load_events(self, max_events=None, last_updated=None):
-        all_events = []
-
-        since_str = ''
-        if last_updated:
-            since_str = '.since({1})'.format(last_updated)
+    def get_events(self, event_ids_or_urls):
+        """Like get_event, with up to GRAPH_BATCH_MAX events per `ids` request"""
+        ids = ','.join(self._event_id(e) for e in event_ids_or_urls)
+        return list(self.converted(self._crawl(ids, ids_are_events=True), self._convert_event))
 
+    def _iter_events(self, since_str=''):
         if self.event_ids:
-            events = self._api_load(self.event_ids, ids_are_events=True)
-            all_events.extend([self._convert_event(e) for e in events])
+            yield from self.converted(self._crawl(self.event_ids, ids_are_events=True),
+                                      self._convert_event)
         if self.page_ids:
-            events = self._api_load(self.page_ids, ids_are_events=False,
-                                    since_str=since_str)
-            all_events.extend([self._convert_event(e) for e in events])
+            yield from self.converted(self._crawl(self.page_ids, ids_are_events=False,
+                                                  since_str=since_str),
+                                      self._convert_event)
 
+    def load_event_batches(self, max_events=None, last_updated=None, batch_size=1000, cursor=None):
+        # crawls finish in any order, so we can't resume them: `cursor` is ignored
+        since_str = ''
+        if last_updated:
+            since_str = '.since({})'.format(last_updated)
+        new_last_updated = datetime.datetime.utcnow().strftime(DATE_FMT)
+        return event_batches(self._iter_events(since_str), batch_size,
+                             last_updated, new_last_updated)
+
+    def load_events(self, max_events=None, last_updated=None):
+        all_events = []
+        for batch in self.load_event_batches(max_events=max_events, last_updated=last_updated):
+            all_events.extend(batch['events'])
         return {'events': all_events,
-                'last_updated': datetime.datetime.utcnow().strftime(DATE_FMT)}
+                'last_updated': batch['last_updated']}
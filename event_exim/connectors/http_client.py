@@ -0,0 +1,171 @@
+from collections import deque
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+Shared HTTP layer for connectors (see base_connector.Connector.http)
+
+* one keep-alive connection pool per remote host, shared by every connector
+  and thread in the process (so we don't redo TLS handshakes per request)
+* per-client (i.e. per-EventSource) bounded concurrency and rate limits
+* retries on 429/5xx and connection errors with jittered exponential backoff
+* counts of requests, retries, bytes and latency, so we can see where sync time goes
+"""
+
+# max keep-alive connections per host
+HTTP_POOL_SIZE = getattr(settings, 'EVENT_EXIM_HTTP_POOL_SIZE', 10)
+HTTP_MAX_RETRIES = getattr(settings, 'EVENT_EXIM_HTTP_MAX_RETRIES', 3)
+# seconds for the first retry -- it doubles each time after that
+HTTP_BACKOFF = getattr(settings, 'EVENT_EXIM_HTTP_BACKOFF', 0.5)
+HTTP_TIMEOUT = getattr(settings, 'EVENT_EXIM_HTTP_TIMEOUT', 120)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_ADAPTERS = {}  # by scheme://host
+_SESSIONS = {}  # by scheme://host
+_POOL_LOCK = threading.Lock()
+
+
+def _host_prefix(url):
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+def pooled_adapter(url):
+    """The connection pool for url's host -- mount it on any Session that talks to that host"""
+    prefix = _host_prefix(url)
+    with _POOL_LOCK:
+        if prefix not in _ADAPTERS:
+            _ADAPTERS[prefix] = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        return _ADAPTERS[prefix]
+
+
+def mount_pooled_adapter(session, url):
+    """Make an existing Session (e.g. a client library's) use the shared pool for url's host"""
+    session.mount(_host_prefix(url), pooled_adapter(url))
+    return session
+
+
+def pooled_session(url):
+    """A Session for url's host, shared process-wide"""
+    prefix = _host_prefix(url)
+    with _POOL_LOCK:
+        session = _SESSIONS.get(prefix)
+    if session is None:
+        session = mount_pooled_adapter(requests.Session(), url)
+        with _POOL_LOCK:
+            session = _SESSIONS.setdefault(prefix, session)
+    return session
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second, with bursts of up to `rate`"""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpClient:
+    """
+    Connectors get one of these per EventSource from base_connector.Connector.http
+    and should make their remote calls through request()/get()/post().
+    """
+
+    def __init__(self, max_concurrency=4, rate_limit=None,
+                 max_retries=HTTP_MAX_RETRIES, backoff=HTTP_BACKOFF, timeout=HTTP_TIMEOUT):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'requests': 0, 'retries': 0, 'failures': 0,
+                           'bytes': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            # the most recent requests: (method, url without query, status, seconds, retries)
+            self._recent = deque(maxlen=100)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['recent'] = list(self._recent)
+        return stats
+
+    def _record(self, method, url, status, seconds, retries, size):
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['retries'] += retries
+            self._stats['bytes'] += size
+            self._stats['seconds'] += seconds
+            self._stats['max_seconds'] = max(self._stats['max_seconds'], seconds)
+            if status is None or status >= 400:
+                self._stats['failures'] += 1
+            # no query string: it can have access tokens in it
+            self._recent.append((method, url.split('?')[0], status, round(seconds, 3), retries))
+
+    def _backoff_seconds(self, attempt, res=None):
+        seconds = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        retry_after = res.headers.get('Retry-After') if res is not None else None
+        if retry_after and retry_after.isdigit():
+            seconds = max(seconds, int(retry_after))
+        return seconds
+
+    def request(self, method, url, session=None, **kwargs):
+        """
+        Like requests.request() -- pass `session` to use one with its own
+        auth/headers (use mount_pooled_adapter() on it to share connections).
+        After max_retries, returns the last response (or raises the last connection error).
+        """
+        if session is None:
+            session = pooled_session(url)
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.time()
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            res = None
+            try:
+                with self.semaphore:
+                    res = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    self._record(method, url, None, time.time() - started, attempt, 0)
+                    raise
+            else:
+                if res.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self._record(method, url, res.status_code, time.time() - started,
+                                 attempt, len(res.content or b''))
+                    return res
+            time.sleep(self._backoff_seconds(attempt, res))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -0,0 +1,178 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+"""
+Cache for short-lived per-user secrets from remote systems, e.g. ActionKit login tokens
+
+* shared by every process (lambda containers, web workers) through redis
+* each entry expires after the cache's ttl -- set it below the remote system's
+  own token lifetime, so a cached token still has time left when it's handed out
+* a small in-process LRU in front of redis, bounded by EVENT_EXIM_TOKEN_CACHE_LOCAL_SIZE
+* get_many() looks up many keys in one redis round trip and fetches
+  all the missing ones with a single call to the caller's fetch function
+* hit/miss counts, for this process and (in redis) for all of them
+
+If redis is unavailable -- down, or REVIEWER_CACHE_KEY isn't a django_redis
+cache -- the in-process cache still works.
+"""
+
+logger = logging.getLogger(__name__)
+
+REDIS_CACHE_KEY = getattr(settings, 'REVIEWER_CACHE_KEY', 'default')
+TOKEN_CACHE_LOCAL_SIZE = getattr(settings, 'EVENT_EXIM_TOKEN_CACHE_LOCAL_SIZE', 1000)
+
+STATS_KEY = 'event_exim_token_cache_stats'
+
+
+class TokenCache:
+
+    def __init__(self, namespace, ttl, local_size=TOKEN_CACHE_LOCAL_SIZE):
+        self.namespace = namespace
+        self.ttl = int(ttl)
+        self.local_size = local_size
+        self.local = OrderedDict()  # key -> (value, expires at)
+        self.lock = threading.Lock()
+        self.counts = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self.shared = True
+
+    def _redis_key(self, key):
+        return 'event_exim_token_{}_{}'.format(self.namespace, key)
+
+    def _redis(self):
+        """The redis connection, or None if the cache can't give us one"""
+        if not self.shared:
+            return None
+        try:
+            return get_redis_connection(REDIS_CACHE_KEY)
+        except Exception as e:
+            # e.g. NotImplementedError from a cache backend that isn't django_redis
+            logger.warning('token cache %s is local only: %s: %s',
+                           self.namespace, type(e).__name__, e)
+            self.shared = False
+            return None
+
+    def _set_local(self, key, value, expires):
+        with self.lock:
+            self.local[key] = (value, expires)
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def get(self, key, fetch=None):
+        """The value for key -- if it isn't cached, fetch(key) gets and caches it"""
+        fetch_many = None
+        if fetch:
+            fetch_many = lambda keys: {k: fetch(k) for k in keys}
+        return self.get_many([key], fetch_many).get(key)
+
+    def get_many(self, keys, fetch=None):
+        """
+        Returns {key: value} for keys that are cached.
+        If given, fetch(missing_keys) should return {key: value} for
+        keys that aren't, and they are cached (unless the value is empty)
+        """
+        now = time.time()
+        found = {}
+        missing = []
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                entry = self.local.get(key)
+                if entry and entry[1] > now:
+                    self.local.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    missing.append(key)
+        local_hits = len(found)
+
+        redis = self._redis()
+        if missing and redis:
+            try:
+                values = redis.mget([self._redis_key(k) for k in missing])
+            except RedisError:
+                values = [None] * len(missing)
+            still_missing = []
+            for key, value in zip(missing, values):
+                try:
+                    if isinstance(value, bytes):
+                        value = value.decode('utf-8')
+                    # stored as '<expires at>:<value>' so we know how long to keep it locally
+                    expires, value = value.split(':', 1)
+                    expires = float(expires)
+                except (AttributeError, ValueError):
+                    # not there (None), or not something we stored
+                    still_missing.append(key)
+                    continue
+                found[key] = value
+                self._set_local(key, value, expires)
+            missing = still_missing
+        shared_hits = len(found) - local_hits
+
+        if missing and fetch:
+            self.set_many({k: v for k, v in fetch(missing).items() if v}, found=found)
+        self._count(local_hits, shared_hits, len(missing))
+        return found
+
+    def set_many(self, values, found=None):
+        """Caches {key: value}, adding them to `found` if given"""
+        if not values:
+            return
+        expires = time.time() + self.ttl
+        redis = self._redis()
+        if redis:
+            try:
+                pipe = redis.pipeline()
+                for key, value in values.items():
+                    pipe.set(self._redis_key(key), '{}:{}'.format(expires, value), ex=self.ttl)
+                pipe.execute()
+            except RedisError:
+                pass
+        for key, value in values.items():
+            self._set_local(key, value, expires)
+            if found is not None:
+                found[key] = value
+
+    def _count(self, local_hits, shared_hits, misses):
+        with self.lock:
+            self.counts['local_hits'] += local_hits
+            self.counts['shared_hits'] += shared_hits
+            self.counts['misses'] += misses
+        redis = self._redis()
+        if not redis:
+            return
+        try:
+            pipe = redis.pipeline()
+            for name, count in (('hits', local_hits + shared_hits), ('misses', misses)):
+                if count:
+                    pipe.hincrby(STATS_KEY, '{}_{}'.format(self.namespace, name), count)
+            pipe.execute()
+        except RedisError:
+            pass
+
+    def stats(self):
+        """
+        {'local_hits', 'shared_hits', 'misses'} for this process, and
+        {'hits', 'misses'} in 'all' across every process using the namespace
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        stats['all'] = {}
+        shared = {}
+        redis = self._redis()
+        if redis:
+            try:
+                shared = redis.hgetall(STATS_KEY)
+            except RedisError:
+                pass
+        prefix = '{}_'.format(self.namespace)
+        for name, count in shared.items():
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            if name.startswith(prefix):
+                stats['all'][name[len(prefix):]] = int(count)
+        return stats
@@ -0,0 +1,280 @@
+import datetime
+import random
+import re
+import zlib
+
+from django.conf import settings
+
+from event_store.models import Event
+
+"""
+Fuzzy duplicate event matching
+
+EventDupeGuesses.get_potential_dupes() only finds events with the same zip and
+the same starts_at_utc. This also finds a typoed zip, a start time a few
+minutes off, or a cross-posted event with no zip -- without comparing every
+pair of events:
+
+1. Blocking: each event goes into a block for each place it could be
+   (its lat/long grid cell, its zip prefix) and time window it starts in.
+   Two events are compared only if they share a block. Events with no location
+   are compared with everything that starts around the same time.
+2. Within a big block (e.g. a national day of action), MinHash signatures of
+   the title/venue/address1 shingles go into LSH bands, so only events whose
+   text is likely similar are compared.
+3. Each candidate pair is scored by the Jaccard similarity of those shingles.
+   Pairs scoring at least EVENT_EXIM_FUZZY_DUPE_THRESHOLD become guesses.
+
+find_fuzzy_dupes() does this for the whole table. With EVENT_EXIM_DUPE_INDEX,
+the blocks are also kept in the EventDupeBlock table: EventSource.update_events_from_dicts
+calls index_events() for each batch of new/changed events, which only compares
+them to the events in their blocks. Then there's no need for a full scan after syncing;
+`./manage.py event_dupe_finder --index` (re)builds the index for existing events.
+"""
+
+# find dupes as events are saved (see index_events), rather than scanning after syncs
+DUPE_INDEX = getattr(settings, 'EVENT_EXIM_DUPE_INDEX', True)
+# seconds apart two events can start and still be duplicates
+FUZZY_DUPE_WINDOW = getattr(settings, 'EVENT_EXIM_FUZZY_DUPE_WINDOW', 30 * 60)
+FUZZY_DUPE_THRESHOLD = getattr(settings, 'EVENT_EXIM_FUZZY_DUPE_THRESHOLD', 0.5)
+# degrees -- 0.05 is about 5km
+FUZZY_DUPE_GRID = getattr(settings, 'EVENT_EXIM_FUZZY_DUPE_GRID', 0.05)
+FUZZY_DUPE_ZIP_PREFIX = getattr(settings, 'EVENT_EXIM_FUZZY_DUPE_ZIP_PREFIX', 3)
+# blocks bigger than this are compared with LSH instead of pair by pair
+SMALL_BLOCK = 20
+
+SHINGLE_SIZE = 3
+LSH_BANDS = 8
+LSH_ROWS = 4  # so similarity ~0.6 has an even chance of being compared
+_MERSENNE = (1 << 61) - 1
+_rand = random.Random(20170401)
+_PERMUTATIONS = [(_rand.randrange(1, _MERSENNE), _rand.randrange(0, _MERSENNE))
+                 for i in range(LSH_BANDS * LSH_ROWS)]
+
+_NOT_WORD = re.compile(r'[\W_]+')
+
+
+def shingles(*texts):
+    """Hashes of the character SHINGLE_SIZE-grams of the normalized texts"""
+    text = ' '.join(filter(None, (_NOT_WORD.sub(' ', t or '').strip().lower() for t in texts)))
+    if len(text) <= SHINGLE_SIZE:
+        return set([zlib.crc32(text.encode('utf-8'))]) if text else set()
+    return set(zlib.crc32(text[i:i + SHINGLE_SIZE].encode('utf-8'))
+               for i in range(len(text) - SHINGLE_SIZE + 1))
+
+
+def minhash(shingle_set):
+    return [min((a * s + b) % _MERSENNE for s in shingle_set) if shingle_set else 0
+            for a, b in _PERMUTATIONS]
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+_ROW_FIELDS = ('id', 'title', 'venue', 'address1', 'zip',
+               'latitude', 'longitude', 'starts_at_utc')
+_EPOCH = datetime.datetime(2000, 1, 1)
+
+
+class _Candidate:
+    __slots__ = ('id', 'zip', 'starts', 'is_new', 'located', 'shingles', '_signature',
+                 'index_keys', 'lookup_keys')
+
+    def __init__(self, row, is_new=True):
+        (self.id, title, venue, address1, zip_code, lat, lng, starts_at_utc) = row
+        self.zip = zip_code or ''
+        self.starts = starts_at_utc
+        self.is_new = is_new
+        self.located = bool(self.zip) or (lat is not None and lng is not None)
+        self.shingles = shingles(title, venue, address1)
+        self._signature = None
+
+        # blocks: a place and time window -- an event goes in its time window
+        # and the next one, so any two events less than a window apart share one
+        places = []
+        if lat is not None and lng is not None:
+            places.append('g:{}:{}'.format(int(lat // FUZZY_DUPE_GRID), int(lng // FUZZY_DUPE_GRID)))
+        if self.zip:
+            places.append('z:{}'.format(self.zip[:FUZZY_DUPE_ZIP_PREFIX]))
+        when = int((self.starts.replace(tzinfo=None) - _EPOCH).total_seconds() // FUZZY_DUPE_WINDOW)
+        self.index_keys = []
+        self.lookup_keys = []
+        for t in (when, when + 1):
+            keys = ['{}:{}'.format(place, t) for place in places]
+            # 'a': everything that starts then, 'u': just events with no location
+            self.index_keys.extend(keys + ['a:{}'.format(t)])
+            if self.located:
+                self.lookup_keys.extend(keys + ['u:{}'.format(t)])
+            else:
+                self.index_keys.append('u:{}'.format(t))
+                self.lookup_keys.append('a:{}'.format(t))
+
+    def signature(self):
+        if self._signature is None:
+            self._signature = minhash(self.shingles)
+        return self._signature
+
+
+def _guess(a, b, threshold, window, exact=False):
+    """A guess for the pair, if they start close enough and are similar enough"""
+    if a.id > b.id:
+        a, b = b, a
+    if abs(a.starts - b.starts) > window:
+        return None
+    # with no zip, the same time alone doesn't make them the same event
+    same_place_time = bool(a.zip) and a.zip == b.zip and a.starts == b.starts
+    if same_place_time and not exact:
+        return None  # exact matches are get_potential_dupes()'s
+    score = jaccard(a.shingles, b.shingles)
+    if score >= threshold or same_place_time:
+        return {'source_event_id': a.id, 'dupe_event_id': b.id, 'score': round(score, 3)}
+    return None
+
+
+def _block_pairs(members, unlocated_only=False):
+    """
+    Candidate pairs within one block -- with unlocated_only,
+    just pairs where at least one of the events has no location
+    """
+    groups = [members]
+    if len(members) > SMALL_BLOCK:
+        groups = []
+        for band in range(LSH_BANDS):
+            buckets = {}
+            for m in members:
+                sig = m.signature()[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+                buckets.setdefault(tuple(sig), []).append(m)
+            groups.extend(b for b in buckets.values() if len(b) > 1)
+    for group in groups:
+        if unlocated_only:
+            for a in group:
+                if not a.located:
+                    for b in group:
+                        if b is not a:
+                            yield a, b
+        else:
+            for i in range(len(group)):
+                for j in range(i + 1, len(group)):
+                    yield group[i], group[j]
+
+
+def _dupe_candidates():
+    return Event.objects.filter(status='active', starts_at_utc__isnull=False,
+                                dupe_id__isnull=True)
+
+
+def find_fuzzy_dupes(last_update=None, threshold=None):
+    """
+    Scans all events (or those updated since last_update) for fuzzy duplicates.
+    Returns [{'source_event_id', 'dupe_event_id', 'score'}] (source_event_id < dupe_event_id),
+    best scores first.
+    """
+    threshold = FUZZY_DUPE_THRESHOLD if threshold is None else threshold
+    window = datetime.timedelta(seconds=FUZZY_DUPE_WINDOW)
+    events = _dupe_candidates()
+    new_ids = None
+    if last_update is not None:
+        # last_update is a source's watermark string, so the database compares it
+        new_events = dict(events.filter(updated_at__gt=last_update).order_by()
+                          .values_list('id', 'starts_at_utc'))
+        if not new_events:
+            return []
+        new_ids = set(new_events)
+        events = events.filter(starts_at_utc__gte=min(new_events.values()) - window,
+                               starts_at_utc__lte=max(new_events.values()) + window)
+
+    blocks = {}
+    for row in events.values_list(*_ROW_FIELDS).iterator():
+        c = _Candidate(row, is_new=(new_ids is None or row[0] in new_ids))
+        for key in c.index_keys:
+            if not key.startswith('u:'):  # those pairs all come from the 'a:' blocks
+                blocks.setdefault(key, []).append(c)
+
+    seen = set()
+    guesses = []
+    for key, members in blocks.items():
+        if len(members) < 2:
+            continue
+        for a, b in _block_pairs(members, unlocated_only=key.startswith('a:')):
+            pair = (min(a.id, b.id), max(a.id, b.id))
+            if pair in seen or a.id == b.id:
+                continue
+            seen.add(pair)
+            if a.is_new or b.is_new:
+                guess = _guess(a, b, threshold, window)
+                if guess:
+                    guesses.append(guess)
+    guesses.sort(key=lambda g: -g['score'])
+    return guesses
+
+
+def _chunks(items, size=500):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def index_events(event_ids, threshold=None):
+    """
+    Updates the EventDupeBlock index for events that were just inserted or changed,
+    and records guesses for them against the events they share a block with.
+    The work is proportional to the events given and their blocks, not the whole table.
+    Returns how many new guesses were recorded.
+    """
+    from event_exim.models import EventDupeBlock, EventDupeGuesses
+    threshold = FUZZY_DUPE_THRESHOLD if threshold is None else threshold
+    window = datetime.timedelta(seconds=FUZZY_DUPE_WINDOW)
+    event_ids = list(event_ids)
+    batch = {}
+    for ids in _chunks(event_ids):
+        for row in _dupe_candidates().filter(id__in=ids).values_list(*_ROW_FIELDS):
+            batch[row[0]] = _Candidate(row)
+        # events no longer active (or marked dupes) drop out of the index
+        EventDupeBlock.objects.filter(event_id__in=ids).delete()
+    EventDupeBlock.objects.bulk_create(
+        [EventDupeBlock(event_id=c.id, key=key)
+         for c in batch.values() for key in c.index_keys],
+        batch_size=500)
+
+    # everyone sharing a block with the batch
+    lookup_keys = list(set(key for c in batch.values() for key in c.lookup_keys))
+    members = {}  # key -> [event id]
+    for keys in _chunks(lookup_keys):
+        for key, event_id in EventDupeBlock.objects.filter(key__in=keys).values_list('key', 'event_id'):
+            members.setdefault(key, []).append(event_id)
+    others = {}
+    other_ids = list(set(i for ids in members.values() for i in ids) - set(batch))
+    for ids in _chunks(other_ids):
+        for row in _dupe_candidates().filter(id__in=ids).values_list(*_ROW_FIELDS):
+            others[row[0]] = _Candidate(row)
+
+    seen = set()
+    guesses = []
+    for c in batch.values():
+        for key in c.lookup_keys:
+            for other_id in members.get(key, ()):
+                other = batch.get(other_id) or others.get(other_id)
+                pair = (min(c.id, other_id), max(c.id, other_id))
+                if other is None or other_id == c.id or pair in seen:
+                    continue
+                seen.add(pair)
+                guess = _guess(c, other, threshold, window, exact=True)
+                if guess:
+                    guesses.append(guess)
+    return EventDupeGuesses.record_fuzzy_dupes(guesses)
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Indexes every event (e.g. after turning on EVENT_EXIM_DUPE_INDEX).
+    Returns (# events indexed, # new guesses)
+    """
+    from event_exim.models import EventDupeBlock
+    EventDupeBlock.objects.all().delete()
+    event_ids = list(_dupe_candidates().order_by('id').values_list('id', flat=True))
+    guesses = 0
+    for ids in _chunks(event_ids, batch_size):
+        guesses += index_events(ids)
+    return len(event_ids), guesses
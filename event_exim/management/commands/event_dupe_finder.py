@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from event_exim.dupe_matching import find_fuzzy_dupes, rebuild_index
 from event_exim.models import EventDupeGuesses
 
 class Command(BaseCommand):
@@ -9,8 +10,30 @@ class Command(BaseCommand):
     help = ('Checks events across all sources for events in the same zip code '
             'at the same UTC start time and marks them as potential dupes for review.')
 
+    def add_arguments(self, parser):
+        parser.add_argument('--fuzzy',
+                            help=('Also look for events that are nearby, start at about the same time'
+                                  ' and have similar titles/venues (see event_exim.dupe_matching)'),
+                            action='store_true', default=False)
+        parser.add_argument('--threshold',
+                            help=('Lowest similarity score for a fuzzy guess.'
+                                  ' Defaults to settings.EVENT_EXIM_FUZZY_DUPE_THRESHOLD'),
+                            type=float)
+
+        parser.add_argument('--index',
+                            help=('(Re)build the index that finds dupes as events are synced'
+                                  ' (settings.EVENT_EXIM_DUPE_INDEX), recording guesses along the way'),
+                            action='store_true', default=False)
+
     def handle(self, *args, **options):
+        if options['index']:
+            print('indexed {} events, {} new guesses'.format(*rebuild_index()))
+            return
         dupes = EventDupeGuesses.get_potential_dupes()
         if dupes:
             log = EventDupeGuesses.record_potential_dupes(dupes)
-            # print(log)
\ No newline at end of file
+            # print(log)
+        if options['fuzzy']:
+            guesses = find_fuzzy_dupes(threshold=options.get('threshold'))
+            print('{} fuzzy guesses, {} new'.format(
+                len(guesses), EventDupeGuesses.record_fuzzy_dupes(guesses)))
@@ -0,0 +1,100 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from event_exim.connectors import base_connector
+from event_exim.models import EventSource
+from event_store.models import Organization
+
+
+class Command(BaseCommand):
+
+    help = ('Times converting synthetic ActionKit event rows into event dicts'
+            ' (the actionkit_api connector\'s row decoding), in rows/sec.'
+            ' Nothing is loaded from ActionKit or saved.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows',
+                            help='How many rows to convert (default 100000)',
+                            default=100000,
+                            type=int)
+        parser.add_argument('--hosts',
+                            help='Rows (hosts) per event (default 2)',
+                            default=2,
+                            type=int)
+        parser.add_argument('--repeat',
+                            help='Best of this many runs (default 3)',
+                            default=3,
+                            type=int)
+        parser.add_argument('--processes',
+                            help=('Convert in this many worker processes, like'
+                                  ' EVENT_EXIM_CONVERT_PROCESSES (default 0: in this process)'),
+                            default=0,
+                            type=int)
+
+    def fake_rows(self, connector, count, hosts_per_event):
+        fi = connector.field_indexes
+        rnd = random.Random(1)
+        events = []
+        for e_id in range(1, count // hosts_per_event + 1):
+            starts = '2017-{:02d}-{:02d} {:02d}:00:00'.format(
+                rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(8, 20))
+            rows = []
+            for h in range(hosts_per_event):
+                row = [None] * len(fi)
+                host_id = e_id * 10 + h
+                row[fi['ee.id']] = e_id
+                for field in ('address1', 'city', 'title', 'venue', 'public_description',
+                              'directions', 'note_to_attendees'):
+                    row[fi[field]] = '{} {}'.format(field, rnd.randint(1, 100000))
+                row[fi['state']] = rnd.choice(['ny', 'CA', 'tx', 'Fl'])
+                row[fi['zip']] = '{:05d}'.format(rnd.randint(1000, 99999))
+                row[fi['country']] = 'United States'
+                row[fi['latitude']] = rnd.uniform(25, 48)
+                row[fi['longitude']] = rnd.uniform(-124, -67)
+                row[fi['status']] = 'active'
+                row[fi['is_private']] = 0
+                row[fi['attendee_count']] = rnd.randint(0, 50)
+                for field in ('starts_at', 'ends_at', 'starts_at_utc', 'ends_at_utc'):
+                    row[fi[field]] = starts
+                row[fi['updated_at']] = '2017-06-{:02d} {:02d}:{:02d}:{:02d}'.format(
+                    rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59))
+                row[fi['ee.us_district']] = 'NY_10'
+                row[fi['ec.name']] = 'campaign'
+                row[fi['ec.title']] = 'Campaign'
+                row[fi['signuppage.name']] = 'signup'
+                row[fi['host.id']] = host_id
+                row[fi['hostaction.id']] = host_id * 3
+                row[fi['u.id']] = host_id
+                row[fi['u.first_name']] = 'First{}'.format(host_id)
+                row[fi['u.last_name']] = 'Last'
+                row[fi['u.email']] = 'host{}@example.com'.format(host_id)
+                row[fi['recentphone.value']] = '555-0100'
+                rows.append(row)
+            events.append(rows)
+        return events
+
+    def handle(self, *args, **options):
+        # never saved
+        source = EventSource(name='benchmark', crm_type='actionkit_api', update_style=0,
+                             origin_organization=Organization(title='Benchmark', slug='benchmark'),
+                             crm_data={'base_url': 'https://benchmark.example.com',
+                                       'api_user': 'benchmark', 'api_password': 'benchmark'})
+        connector = source.api
+        events = self.fake_rows(connector, options['rows'], options['hosts'])
+        rows = sum(len(e) for e in events)
+        base_connector.CONVERT_PROCESSES = options['processes']
+        connector.start_convert_pool()
+        best = None
+        try:
+            for i in range(options['repeat']):
+                started = time.perf_counter()
+                for event in connector.converted(events, connector._convert_event):
+                    pass
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+        finally:
+            connector.stop_convert_pool()
+        print('{} rows ({} events) in {:.2f}s: {:,.0f} rows/sec'.format(
+            rows, len(events), best, rows / best))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from event_exim.refresh_queue import drain_refresh_queue, pending_count
+
+
+class Command(BaseCommand):
+
+    help = ('Refreshes events queued by the refresh_event pixel from their sources.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size',
+                            help=('How many queued events to take at a time.'
+                                  ' Defaults to settings.EVENT_EXIM_REFRESH_BATCH_SIZE'),
+                            type=int)
+        parser.add_argument('--loop',
+                            help=('Keep draining the queue every LOOP seconds, rather than once'),
+                            type=int)
+
+    def handle(self, *args, **options):
+        while True:
+            print('{} queued'.format(pending_count()))
+            print(drain_refresh_queue(batch_size=options.get('batch_size')))
+            if not options.get('loop'):
+                break
+            time.sleep(options['loop'])
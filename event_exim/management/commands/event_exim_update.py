@@ -4,7 +4,8 @@ from django.core.management.base import BaseCommand
 
 from optparse import make_option
 
-from event_exim.models import EventSource
+from event_exim.models import EventSource, SyncCheckpoint
+from event_exim.runner import sync_sources
 from event_store.models import Event
 
 class Command(BaseCommand):
@@ -14,7 +15,7 @@ class Command(BaseCommand):
                             help='event source name',
                             type=str)
         parser.add_argument('--event_pk',
-                            help='event source system pk of the event',
+                            help='event source system pk of the event (comma-separated for several)',
                             type=str)
         parser.add_argument('--update_style',
                             help="\n".join(['which event sources should be updated?',
@@ -31,6 +32,21 @@ class Command(BaseCommand):
                             help=('Do not use last_update from database -- load from beginning again'),
                             default=False,
                             type=bool)
+        resume = parser.add_mutually_exclusive_group()
+        resume.add_argument('--resume',
+                            help=('Continue unfinished syncs from their last checkpoint (the default)'),
+                            dest='resume', action='store_true', default=True)
+        resume.add_argument('--restart',
+                            help=('Discard checkpoints from unfinished syncs and start them over'),
+                            dest='resume', action='store_false')
+        parser.add_argument('--workers',
+                            help=('How many sources to sync at the same time.'
+                                  ' Defaults to settings.EVENT_EXIM_SYNC_WORKERS'),
+                            type=int)
+        parser.add_argument('--timeout',
+                            help=('Seconds each source has before it stops loading more events.'
+                                  ' Defaults to settings.EVENT_EXIM_SYNC_SOURCE_TIMEOUT'),
+                            type=int)
 
     def handle(self, *args, **options):
         sources = []
@@ -41,14 +57,24 @@ class Command(BaseCommand):
             style = options.get('update_style')
             if style:
                 sources = EventSource.objects.filter(update_style=style)
-        for s in sources:
-            kwargs = {}
-            if options['last_update'] is not None:
-                kwargs['last_update'] = options['last_update']
-            if options['from_start']:
-                kwargs['last_update'] = ''
-            if options['event_pk']:
-                print(s.update_event(options['event_pk']))
-            else:
-                print('updating', s, options['last_update'] or '')
-                s.update_events(**kwargs)
+        kwargs = {}
+        if options['last_update'] is not None:
+            kwargs['last_update'] = options['last_update']
+        if options['from_start']:
+            kwargs['last_update'] = ''
+        kwargs['resume'] = options['resume']
+        if options['event_pk']:
+            for s in sources:
+                print(s.update_events_by_ids(options['event_pk'].split(',')))
+        else:
+            print('updating', ', '.join([str(s) for s in sources]), options['last_update'] or '')
+            if options['resume'] and 'last_update' not in kwargs:
+                for checkpoint in SyncCheckpoint.objects.filter(source__in=sources):
+                    print('resuming', checkpoint)
+            summary = sync_sources(sources,
+                                   workers=options.get('workers'),
+                                   timeout=options.get('timeout'),
+                                   **kwargs)
+            for result in summary['sources']:
+                print(result)
+            print('finished in {} seconds'.format(summary['duration']))
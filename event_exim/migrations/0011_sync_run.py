@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_exim', '0010_merge_20170614_2305'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('running', 'running'), ('ok', 'ok'), ('timeout', 'timed out'), ('failed', 'failed')], default='running', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('last_update', models.CharField(blank=True, help_text='what we loaded events updated since', max_length=128, null=True)),
+                ('fetched', models.IntegerField(default=0)),
+                ('inserted', models.IntegerField(default=0, verbose_name='new')),
+                ('updated', models.IntegerField(default=0, verbose_name='changed')),
+                ('unchanged', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0, help_text='fetched but not saved')),
+                ('remote_requests', models.IntegerField(default=0)),
+                ('remote_retries', models.IntegerField(default=0)),
+                ('remote_bytes', models.BigIntegerField(default=0)),
+                ('peak_memory_kb', models.IntegerField(blank=True, help_text='for the whole process, which may sync other sources at the same time', null=True)),
+                ('phase_seconds', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='syncrun',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='event_exim.EventSource'),
+        ),
+    ]
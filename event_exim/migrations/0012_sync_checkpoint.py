@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_exim', '0011_sync_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_update', models.CharField(blank=True, help_text='the watermark the unfinished sync started from', max_length=128, null=True)),
+                ('cursor', models.TextField()),
+                ('events', models.IntegerField(default=0, help_text='events saved so far')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='synccheckpoint',
+            name='source',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sync_checkpoint', to='event_exim.EventSource'),
+        ),
+    ]
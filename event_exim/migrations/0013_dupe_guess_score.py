@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_exim', '0012_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventdupeguesses',
+            name='score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
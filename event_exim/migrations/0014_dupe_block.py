@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_store', '0012_event_source_hash'),
+        ('event_exim', '0013_dupe_guess_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventDupeBlock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=64)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dupe_blocks', to='event_store.Event')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventdupeblock',
+            unique_together=set([('key', 'event')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_exim', '0015_sync_run_queue_depths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='finish_results',
+            field=models.TextField(blank=True),
+        ),
+    ]
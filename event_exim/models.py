@@ -1,18 +1,22 @@
 import datetime
 import importlib
+import json
 import time
 
 from django.conf import settings
 from django.contrib.auth.models import User, Group, Permission
-from django.db import models
+from django.db import models, transaction
 from django.utils.functional import cached_property
-from django.db.models import Count
 from django.dispatch import Signal
 # from django.db.models.signals import post_save
 # from django.dispatch import receiver
 
 from event_store.models import Activist, Event, Organization
 from event_exim import connectors
+from event_exim.dupe_matching import DUPE_INDEX, index_events
+from event_exim.pipeline import PERSIST_QUEUE_SIZE, SYNC_PIPELINE, pipelined
+from event_exim.timing import PhaseTimer, peak_memory_kb
+from event_exim.upsert import event_fingerprint, stored_hashes, upsert_activists, upsert_events
 
 CRM_TYPES = {
     #'actionkit_db': lambda: connectors.ActionKitDBWrapper,
@@ -27,6 +31,19 @@ CRM_TYPES = {
 
 event_source_updated = Signal(providing_args=["event_data", "last_update"])
 
+# how many events EventSource.update_events loads and saves at a time
+SYNC_BATCH_SIZE = getattr(settings, 'EVENT_EXIM_SYNC_BATCH_SIZE', 1000)
+# SyncRun phases that are saving events
+PERSIST_PHASES = ('hash', 'hosts', 'events', 'dupes')
+
+
+class SyncTimeout(Exception):
+    """An EventSource sync stopped early because it ran out of time"""
+
+    def __init__(self, source, counts):
+        super().__init__('{} sync timed out'.format(source))
+        self.counts = counts
+
 
 class EventSource(models.Model):
 
@@ -79,71 +96,157 @@ class EventSource(models.Model):
             self.update_events_from_dicts([event_dict])
         return event_dict
 
-    def update_events(self, last_update=None):
+    def update_events_by_ids(self, source_pks):
+        """
+        Re-loads specific events (by organization_source_pk) with the connector's get_events().
+        Returns counts like update_events_from_dicts, and how many weren't found as 'missing'
         """
-        Sync events from source to local database
+        source_pks = set(str(pk) for pk in source_pks)
+        event_dicts = self.api.get_events(sorted(source_pks))
+        counts = self.update_events_from_dicts(event_dicts)
+        counts['missing'] = len(source_pks - set(str(e['organization_source_pk'])
+                                                 for e in event_dicts))
+        return counts
+
+    def update_events(self, last_update=None, deadline=None, resume=True):
         """
+        Sync events from source to local database, saving each batch
+        from the connector as it arrives, so memory use depends on
+        EVENT_EXIM_SYNC_BATCH_SIZE rather than how many events the source has.
+        event_source_updated is sent after each batch is saved.
+        If time.time() passes `deadline`, we stop after the current batch,
+        save the watermark we got to, and raise SyncTimeout.
+        Each call is recorded as a SyncRun (also set as self.sync_run).
+
+        If the connector can resume, each batch is saved in the same transaction
+        as a SyncCheckpoint of where it got to.  Unless `resume` is False (or
+        last_update is passed), a sync left unfinished -- timed out, or killed
+        by e.g. a lambda time limit -- continues from its checkpoint.
+        """
+        checkpoint = SyncCheckpoint.objects.filter(source=self).first()
+        cursor = None
+        if checkpoint and resume and last_update is None:
+            last_update = checkpoint.last_update
+            cursor = checkpoint.cursor_data
+        elif checkpoint:
+            checkpoint.delete()
+            checkpoint = None
         # load events from our connector
         if last_update is None:
             last_update = self.last_update
-        event_data = self.api.load_events(last_updated=last_update)
-        self.update_events_from_dicts(event_data['events'])
+        self.sync_run = run = SyncRun.objects.create(source=self, last_update=last_update)
+        phases = self.api.phases
+        phases.reset()
+        self.api.http.reset_stats()
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        new_last_update = last_update
+        timed_out = False
+        # worker processes (with EVENT_EXIM_CONVERT_PROCESSES) are forked before we start any threads
+        self.api.start_convert_pool()
+        try:
+            batches = self.api.load_event_batches(last_updated=last_update,
+                                                  batch_size=SYNC_BATCH_SIZE,
+                                                  cursor=cursor)
+            if SYNC_PIPELINE:
+                # converting happens in another thread (with its own database connection),
+                # so load what it uses from the database here
+                self.origin_organization
+                batches = pipelined(batches, PERSIST_QUEUE_SIZE, 'converted', phases)
+            batches = iter(batches)
+            try:
+                while True:
+                    with phases.phase('load'):
+                        event_data = next(batches, None)
+                    if event_data is None:
+                        break
+                    run.fetched += len(event_data['events'])
+                    with transaction.atomic():
+                        batch_counts = self.update_events_from_dicts(event_data['events'], phases=phases)
+                        if event_data.get('cursor'):
+                            checkpoint = SyncCheckpoint.save_progress(
+                                self, checkpoint, last_update, event_data['cursor'],
+                                len(event_data['events']))
+                    for k, v in batch_counts.items():
+                        counts[k] += v
+                    new_last_update = event_data['last_updated']
+                    event_source_updated.send(self, event_data=event_data, last_update=new_last_update)
+                    if deadline and time.time() > deadline:
+                        timed_out = True
+                        break
+            finally:
+                # stops the stages still fetching/converting
+                if hasattr(batches, 'close'):
+                    batches.close()
+        except Exception as e:
+            run.finish('failed', counts, phases, self.api.http.stats(),
+                       error='{}: {}'.format(type(e).__name__, e))
+            raise
+        finally:
+            self.api.stop_convert_pool()
         # now that we've updated things, save this EventSource record with last_updated
-        self.last_update = event_data['last_updated']
-        self.save()
-        event_source_updated.send(self, event_data=event_data, last_update=self.last_update)
-
-    def update_events_from_dicts(self, event_dicts):
+        with transaction.atomic():
+            self.last_update = new_last_update
+            self.save()
+            if checkpoint and not timed_out:
+                checkpoint.delete()
+        # the events are saved, so this failing shouldn't fail the sync
+        error = ''
+        finish_results = None
+        if not timed_out and hasattr(self.api, 'finish_sync'):
+            with phases.phase('finish'):
+                try:
+                    finish_results = self.api.finish_sync()
+                except Exception as e:
+                    error = 'finish_sync {}: {}'.format(type(e).__name__, e)
+        run.finish('timeout' if timed_out else 'ok', counts, phases, self.api.http.stats(),
+                   error=error, finish_results=finish_results)
+        if timed_out:
+            raise SyncTimeout(self, counts)
+        return counts
+
+    def update_events_from_dicts(self, event_dicts, phases=None):
+        """
+        Saves hosts and upserts events from connector event dicts
+        (and with EVENT_EXIM_DUPE_INDEX, records dupe guesses for them).
+        Returns counts of {'inserted': #, 'updated': #, 'unchanged': #} events
+        Pass a PhaseTimer as `phases` to time each step.
+        """
+        if phases is None:
+            phases = PhaseTimer()
         all_events = {str(e['organization_source_pk']): e for e in event_dicts}
-        new_host_ids = set([e['organization_host'].member_system_pk
-                            for e in all_events.values()
-                            if e['organization_host']])
-        existing = list(Event.objects.filter(organization_source_pk__in=all_events.keys(),
-                                             organization_source=self))
+        # 1. drop events that hash the same as what we saved last time
+        with phases.phase('hash'):
+            hashes = {pk: event_fingerprint(e) for pk, e in all_events.items()}
+            unchanged = stored_hashes(self, hashes.values())
+            changed_events = [dict(e, source_hash=hashes[pk]) for pk, e in all_events.items()
+                              if hashes[pk] not in unchanged]
+
         # 2. save hosts, new and existing Activist records
-        host_update_fields = ('hashed_email', 'email', 'name', 'phone')
-        existing_hosts = {a.member_system_pk: a
-                          for a in Activist.objects.filter(member_system=self,
-                                                           member_system_pk__in=new_host_ids)}
-        for e in all_events.values():
-            ehost = e.get('organization_host')
-            if ehost:
-                host_by_pk = existing_hosts.get(ehost.member_system_pk)
-                if host_by_pk:
-                    ehost.id = host_by_pk.id
-                    for hf in host_update_fields:
-                        if getattr(host_by_pk, hf) != getattr(ehost, hf):
-                            ehost.save()
-                            existing_hosts[ehost.member_system_pk] = ehost
-                            break  # inner loop
-                else:
-                    ehost.save()
-                    existing_hosts[ehost.member_system_pk] = ehost
-
-        # 3. bulk-create all new events not in the system yet
-        existing_ids = set([e.organization_source_pk for e in existing])
-        new_events = [Event(**e) for e in all_events.values()
-                      if e['organization_source_pk'] not in existing_ids]
-        Event.objects.bulk_create(new_events)
-
-        # 4. save any changes to existing events
-        for e in existing:
-            self.update_event_from_dict(e, all_events[e.organization_source_pk])
-
-    def update_event_from_dict(self, event, new_event_dict):
-        changed = False
-        for k, v in new_event_dict.items():
-            if k == 'organization_host' and event.organization_host:
-                if not event.organization_host.likely_same(v):
-                    event.organization_host = v
-                    changed = True
-            else:
-                if getattr(event, k) != v:
-                    setattr(event, k, v)
-                    changed = True
-        if changed:
-            event.save()
-        return changed
+        with phases.phase('hosts'):
+            host_ids = upsert_activists(self, [e['organization_host'] for e in changed_events
+                                               if e.get('organization_host')])
+            for e in changed_events:
+                # connectors can send hosts as dicts -- now they are saved, point at them
+                if isinstance(e.get('organization_host'), dict):
+                    e['organization_host'] = host_ids.get(str(e['organization_host']['member_system_pk']))
+
+        # 3. insert new events and write only the changed columns of existing ones
+        with phases.phase('events'):
+            counts = upsert_events(self, changed_events)
+        counts['unchanged'] += len(all_events) - len(changed_events)
+
+        # 4. compare new/changed events to the ones they could be duplicates of
+        if DUPE_INDEX and changed_events:
+            with phases.phase('dupes'):
+                changed_pks = [str(e['organization_source_pk']) for e in changed_events]
+                event_ids = []
+                for i in range(0, len(changed_pks), 500):
+                    event_ids.extend(Event.objects.filter(
+                        organization_source=self,
+                        organization_source_pk__in=changed_pks[i:i + 500]
+                    ).values_list('id', flat=True))
+                index_events(event_ids)
+        return counts
 
     @classmethod
     def autocreate_from_settings(cls, source=None, possible_sources=None):
@@ -224,6 +327,167 @@ class EventSource(models.Model):
         return results
 
 
+class SyncRun(models.Model):
+    """
+    One EventSource.update_events() call: how long each phase took,
+    how many events it touched and how much it asked of the remote system.
+    Phases (in seconds) are:
+     * fetch: waiting on the remote system
+     * convert: turning remote data into event dicts
+     * wait: saving waiting on the events to save
+     * hash, hosts, events, dupes: saving (see EventSource.update_events_from_dicts) --
+       without EVENT_EXIM_DUPE_INDEX, dupes is after the run, shared by all sources run together
+     * finish: the connector's finish_sync(), e.g. ActionKit cohost signups
+    With EVENT_EXIM_SYNC_PIPELINE, fetching, converting and saving overlap (see event_exim.pipeline),
+    so stage_utilization (a stage's seconds / the run's) shows the bottleneck: the stage near 100%.
+    queue_depths are how full the queues between stages were: 'fetched' into converting,
+    'converted' into saving.
+    """
+    source = models.ForeignKey(EventSource, related_name='sync_runs', on_delete=models.CASCADE)
+    started_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=16, default='running',
+                              choices=(('running', 'running'),
+                                       ('ok', 'ok'),
+                                       ('timeout', 'timed out'),
+                                       ('failed', 'failed')))
+    error = models.TextField(blank=True)
+    last_update = models.CharField(max_length=128, null=True, blank=True,
+                                   help_text='what we loaded events updated since')
+
+    fetched = models.IntegerField(default=0)
+    inserted = models.IntegerField(default=0, verbose_name='new')
+    updated = models.IntegerField(default=0, verbose_name='changed')
+    unchanged = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0, help_text='fetched but not saved')
+
+    remote_requests = models.IntegerField(default=0)
+    remote_retries = models.IntegerField(default=0)
+    remote_bytes = models.BigIntegerField(default=0)
+    peak_memory_kb = models.IntegerField(null=True, blank=True,
+                                         help_text='for the whole process, which may sync other sources at the same time')
+    # json of {phase: seconds}
+    phase_seconds = models.TextField(blank=True)
+    # json of {queue: {'mean': #, 'max': #, 'size': #}}
+    queue_depths = models.TextField(blank=True)
+    # json of what the connector's finish_sync() returned, e.g. {'created': #, 'failed': #, 'errors': [...]}
+    finish_results = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('-started_at',)
+
+    def __str__(self):
+        return '{} {} {}'.format(self.source, self.started_at, self.status)
+
+    @property
+    def duration(self):
+        if self.finished_at:
+            return round((self.finished_at - self.started_at).total_seconds(), 3)
+
+    @property
+    def phases(self):
+        return json.loads(self.phase_seconds) if self.phase_seconds else {}
+
+    @property
+    def depths(self):
+        return json.loads(self.queue_depths) if self.queue_depths else {}
+
+    @property
+    def finish_summary(self):
+        return json.loads(self.finish_results) if self.finish_results else {}
+
+    @property
+    def stage_utilization(self):
+        """{stage: fraction of the run it was busy} for fetch, convert and persist"""
+        duration = self.duration
+        if not duration:
+            return {}
+        phases = self.phases
+        busy = {'fetch': phases.get('fetch', 0),
+                'convert': phases.get('convert', 0),
+                'persist': sum(phases.get(p, 0) for p in PERSIST_PHASES)}
+        return {stage: round(min(seconds / duration, 1), 2) for stage, seconds in busy.items()}
+
+    def finish(self, status, counts, phases, http_stats, error='', finish_results=None):
+        seconds = phases.totals()
+        if 'load' in seconds:
+            if 'fetch' in seconds:
+                seconds['wait'] = seconds.pop('load')
+            else:
+                # the connector didn't time fetching: waiting on it includes its conversion time
+                seconds['fetch'] = round(max(seconds.pop('load') - seconds.get('convert', 0), 0), 3)
+        self.status = status
+        self.error = error
+        self.finished_at = datetime.datetime.now()
+        self.inserted = counts.get('inserted', 0)
+        self.updated = counts.get('updated', 0)
+        self.unchanged = counts.get('unchanged', 0)
+        self.failed = max(self.fetched - self.inserted - self.updated - self.unchanged, 0)
+        self.remote_requests = http_stats['requests']
+        self.remote_retries = http_stats['retries']
+        self.remote_bytes = http_stats['bytes']
+        self.peak_memory_kb = peak_memory_kb()
+        self.phase_seconds = json.dumps(seconds, sort_keys=True)
+        self.queue_depths = json.dumps(phases.queue_depths(), sort_keys=True)
+        self.finish_results = json.dumps(finish_results, sort_keys=True) if finish_results else ''
+        self.save()
+
+    @classmethod
+    def add_phase(cls, run_ids, phase, seconds):
+        """Records a phase that happened after these runs, e.g. dupe detection"""
+        for run in cls.objects.filter(id__in=run_ids):
+            phases = run.phases
+            phases[phase] = round(seconds, 3)
+            run.phase_seconds = json.dumps(phases, sort_keys=True)
+            run.save(update_fields=['phase_seconds'])
+
+
+class SyncCheckpoint(models.Model):
+    """
+    Where an unfinished EventSource.update_events() got to, saved with each
+    batch, so the next sync can pick up after it rather than starting over.
+    Deleted when the sync finishes.
+    """
+    source = models.OneToOneField(EventSource, related_name='sync_checkpoint',
+                                  on_delete=models.CASCADE)
+    last_update = models.CharField(max_length=128, null=True, blank=True,
+                                   help_text='the watermark the unfinished sync started from')
+    # json from the connector's batches, see base_connector.event_batches
+    cursor = models.TextField()
+    events = models.IntegerField(default=0, help_text='events saved so far')
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} ({} events)'.format(self.source, self.events)
+
+    @property
+    def cursor_data(self):
+        return json.loads(self.cursor)
+
+    @classmethod
+    def save_progress(cls, source, checkpoint, last_update, cursor, event_count):
+        if checkpoint is None:
+            checkpoint = cls(source=source, last_update=last_update)
+        checkpoint.cursor = json.dumps(cursor, sort_keys=True)
+        checkpoint.events += event_count
+        checkpoint.save()
+        return checkpoint
+
+
+class EventDupeBlock(models.Model):
+    """
+    Index of which events could be duplicates of each other:
+    events that share a key (a place and time window) get compared.
+    Kept up to date as events are saved -- see event_exim.dupe_matching.index_events
+    """
+    event = models.ForeignKey(Event, related_name='dupe_blocks')
+    key = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        unique_together = (('key', 'event'),)
+
+
 class EventDupeManager(models.Manager):
     def create_event_dupe(self, source_event, dupe_event):
         event_dupe = self.create(source_event=source_event, dupe_event=dupe_event, decision=0)
@@ -242,6 +506,8 @@ class EventDupeGuesses(models.Model):
                                    null=True,
                                    blank=True
                                    )
+    # similarity, for guesses from the fuzzy matcher (event_exim.dupe_matching)
+    score = models.FloatField(null=True, blank=True)
 
     class Meta:
         unique_together = (('source_event', 'dupe_event'),)
@@ -252,70 +518,107 @@ class EventDupeGuesses(models.Model):
             Things that will muddle screening for duplicates:
             * Bad data, e.g. zip code typos, errors converting local time to starts_at_utc.
             * Missing data, e.g. virtual events with no zip code/location data
-            Returns a QuerySet of zip + starts_at_utc pairs which match more than one event.
+            Returns a list of {'zip', 'starts_at_utc', 'count', 'event_ids'} for
+            each zip + starts_at_utc pair which matches more than one event.
+            With last_update, only pairs matching events updated since then.
         """
-        if last_update is None:
-            return (
-                Event.objects.values('zip', 'starts_at_utc')
-                .annotate(count=Count('id'))
-                .order_by()
-                .filter(
-                    count__gt=1,
-                    zip__isnull=False,
-                    starts_at_utc__isnull=False,
-                    status='active'
-                )
-                .exclude(zip='')
-            )
-        # For ONLY new events, compare to all events to check for duplicates
-        new_events = Event.objects.values('zip', 'starts_at_utc').order_by().filter(
-                dupe_id__isnull=True,
-                zip__isnull=False,
-                starts_at_utc__isnull=False,
-                updated_at__gt=last_update,
-                status='active'
-            ).exclude(zip='')
-        dupe_events = Event.objects.values('zip', 'starts_at_utc').annotate(count=Count('id')).none()
-        for new_event in new_events:
-            dupes = Event.objects.values('zip', 'starts_at_utc').annotate(count=Count('id')).filter(
-                zip=new_event['zip'], starts_at_utc=new_event['starts_at_utc'],
-                count__gt=1,
-                dupe_id__isnull=True,
-                status='active'
-            )
-            dupe_events = dupe_events | dupes
-        return dupe_events
-
-    @ staticmethod
+        candidates = Event.objects.filter(
+            zip__isnull=False,
+            starts_at_utc__isnull=False,
+            status='active'
+        ).exclude(zip='')
+        is_new = set()
+        if last_update is not None:
+            # For ONLY new events, compare to all events to check for duplicates
+            candidates = candidates.filter(dupe_id__isnull=True)
+            # last_update is a source's watermark string, so the database compares it
+            new_events = candidates.filter(updated_at__gt=last_update).order_by()
+            is_new = set(new_events.values_list('zip', 'starts_at_utc'))
+            if not is_new:
+                return []
+            # a superset of the pairs -- the grouping below sorts them out
+            candidates = candidates.filter(zip__in=new_events.values('zip'),
+                                           starts_at_utc__in=new_events.values('starts_at_utc'))
+        # grouped by a hash on (zip, starts_at_utc)
+        groups = {}
+        for event_id, zip_code, starts_at_utc in (
+                candidates.order_by('id')
+                .values_list('id', 'zip', 'starts_at_utc').iterator()):
+            groups.setdefault((zip_code, starts_at_utc), []).append(event_id)
+        return [{'zip': key[0], 'starts_at_utc': key[1],
+                 'count': len(event_ids), 'event_ids': event_ids}
+                for key, event_ids in groups.items()
+                if len(event_ids) > 1 and (last_update is None or key in is_new)]
+
+    @staticmethod
     def record_potential_dupes(potential_dupes):
+        """
+        Records each group from get_potential_dupes() as a cluster: the first
+        (lowest id) event is the source_event of a guess for each of the others.
+        All the new guesses are saved with one bulk insert.
+        """
         message = 'Recording new potential duplicate events: \n'
+        pairs = []
         for dupe in potential_dupes:
-            events = (
-                Event.objects
-                .filter(zip=dupe['zip'], starts_at_utc=dupe['starts_at_utc'])
-                .order_by('id')
-            )
-            for x in range(dupe['count']):
-                for y in range(x+1, dupe['count']):
-                    source_event = events[x]
-                    dupe_event = events[y]
-                    answer = EventDupeGuesses.objects.get_or_create(
-                        source_event=source_event,
-                        dupe_event=dupe_event,
-                        decision=0
-                    )
-                    if not answer[1]:
-                        message += (
-                            "Duplicate event guess for {} and {} already recorded \n"
-                            .format(source_event.id, dupe_event.id)
-                        )
-                    else:
-                        message += (
-                            "Recorded duplicate guess: Events {} and {} \n"
-                            .format(source_event.id, dupe_event.id)
-                        )
+            event_ids = dupe.get('event_ids')
+            if event_ids is None:
+                event_ids = list(Event.objects.filter(
+                    zip=dupe['zip'], starts_at_utc=dupe['starts_at_utc']
+                ).order_by('id').values_list('id', flat=True))
+            pairs.extend((event_ids[0], dupe_id) for dupe_id in event_ids[1:])
+        existing = set()
+        anchors = list(set(source_id for source_id, dupe_id in pairs))
+        for i in range(0, len(anchors), 500):
+            existing.update(EventDupeGuesses.objects.filter(
+                source_event_id__in=anchors[i:i + 500]
+            ).values_list('source_event_id', 'dupe_event_id'))
+        new_guesses = []
+        for source_id, dupe_id in pairs:
+            if (source_id, dupe_id) in existing:
+                message += (
+                    "Duplicate event guess for {} and {} already recorded \n"
+                    .format(source_id, dupe_id)
+                )
+            else:
+                existing.add((source_id, dupe_id))
+                new_guesses.append(EventDupeGuesses(source_event_id=source_id,
+                                                    dupe_event_id=dupe_id,
+                                                    decision=0))
+                message += (
+                    "Recorded duplicate guess: Events {} and {} \n"
+                    .format(source_id, dupe_id)
+                )
+        EventDupeGuesses.objects.bulk_create(new_guesses, batch_size=500)
         return message
 
+    @staticmethod
+    def record_fuzzy_dupes(guesses):
+        """
+        Saves guesses from event_exim.dupe_matching.find_fuzzy_dupes()
+        that aren't already recorded (either way around). Returns how many were new.
+        """
+        ids = list(set([g['source_event_id'] for g in guesses]
+                       + [g['dupe_event_id'] for g in guesses]))
+        existing = set()
+        for i in range(0, len(ids), 500):
+            for pair in EventDupeGuesses.objects.filter(
+                    source_event_id__in=ids[i:i + 500]
+            ).values_list('source_event_id', 'dupe_event_id'):
+                existing.add(pair)
+                existing.add(pair[::-1])
+        new_guesses = []
+        for g in guesses:
+            pair = (g['source_event_id'], g['dupe_event_id'])
+            if pair not in existing:
+                existing.add(pair)
+                existing.add(pair[::-1])
+                new_guesses.append(EventDupeGuesses(source_event_id=pair[0],
+                                                    dupe_event_id=pair[1],
+                                                    score=g['score'],
+                                                    decision=0))
+        EventDupeGuesses.objects.bulk_create(new_guesses, batch_size=500)
+        return len(new_guesses)
+
     # Currently doesn't handle the case where an event has more than one duplicate.
     # Implementing this should wait until we have a clear use case for dupe_id on events
     # @receiver(post_save, sender = EventDupeGuesses, dispatch_uid = 'update_event_dupe')
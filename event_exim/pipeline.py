@@ -0,0 +1,81 @@
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+"""
+Syncing as stages that run at the same time:
+
+  fetch (remote system) -> convert (to event dicts, in batches) -> persist (database)
+
+Each stage runs in its own thread, handing on to the next through a bounded queue,
+so page N+1 downloads while page N converts and batch N-1 commits. A full queue
+blocks the stage before it, so memory stays at about a queue's worth per stage
+however many events a source has.
+
+Connector.converted() reads the remote items ahead in a fetch thread, and
+EventSource.update_events() converts batches ahead of saving them in a convert
+thread, while it saves in the calling thread (which keeps the transactions there).
+Each queue's depth is sampled as items are taken off it: a queue that is usually
+full means the stage after it is the bottleneck, usually empty the stage before it.
+"""
+
+# run the sync stages concurrently (False: one after the other, in the syncing thread)
+SYNC_PIPELINE = getattr(settings, 'EVENT_EXIM_SYNC_PIPELINE', True)
+# chunks of EVENT_EXIM_CONVERT_CHUNK_SIZE remote items fetched ahead of converting
+FETCH_QUEUE_SIZE = getattr(settings, 'EVENT_EXIM_FETCH_QUEUE_SIZE', 4)
+# batches of EVENT_EXIM_SYNC_BATCH_SIZE events converted ahead of saving
+PERSIST_QUEUE_SIZE = getattr(settings, 'EVENT_EXIM_PERSIST_QUEUE_SIZE', 2)
+
+_DONE = object()
+
+
+def pipelined(items, size, name, timer):
+    """
+    Iterates over `items` in a new thread, up to `size` items ahead of the caller.
+    An exception from `items` is raised in the caller, after the items before it.
+    If the caller stops early, the thread stops (and closes `items`) too.
+    `timer` (a PhaseTimer) gets the depth of the queue, as `name`, for each item taken.
+    """
+    handoff = queue.Queue(size)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                handoff.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        items_iter = iter(items)
+        try:
+            for item in items_iter:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except Exception as e:
+            put((_DONE, e))
+        finally:
+            close = getattr(items_iter, 'close', None)
+            if close:
+                close()
+            connection.close()
+
+    thread = threading.Thread(target=produce, name='{} stage'.format(name), daemon=True)
+    thread.start()
+    try:
+        while True:
+            timer.sample(name, handoff.qsize(), size)
+            item, error = handoff.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,146 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+
+"""
+Queue behind the refresh_event 'pixel'
+
+The pixel can be hit thousands of times for the same event (e.g. from a popular
+event's thank-you page), so rather than fetching the event from its source on
+each hit, the view adds '<source name>/<event pk>' to a redis set and returns.
+Repeat hits while it is in the set are free.
+
+drain_refresh_queue() (from the event_exim_refresh command or
+call_process.run_refresh_queue) takes events off the set in batches and
+refreshes them -- but at most once per event per EVENT_EXIM_REFRESH_WINDOW:
+an event refreshed more recently than that goes back on the set for a later drain,
+so the last change in a burst is still picked up. An event that fails to refresh
+goes back on the set too, and can be tried again on the next drain -- until it
+has failed EVENT_EXIM_REFRESH_MAX_ATTEMPTS times in a row, when it is dropped
+(a later hit gets it one more try).
+"""
+
+REDIS_CACHE_KEY = getattr(settings, 'REVIEWER_CACHE_KEY', 'default')
+# False to refresh events from the pixel request itself
+REFRESH_QUEUE = getattr(settings, 'EVENT_EXIM_REFRESH_QUEUE', True)
+# seconds: fetch an event from its source at most once in this long
+REFRESH_WINDOW = getattr(settings, 'EVENT_EXIM_REFRESH_WINDOW', 60)
+REFRESH_BATCH_SIZE = getattr(settings, 'EVENT_EXIM_REFRESH_BATCH_SIZE', 100)
+# failed refreshes of an event before it is taken off the queue
+REFRESH_MAX_ATTEMPTS = getattr(settings, 'EVENT_EXIM_REFRESH_MAX_ATTEMPTS', 5)
+# seconds to remember failed attempts since the last one
+ATTEMPTS_EXPIRE = 24 * 60 * 60
+
+PENDING_KEY = 'event_exim_refresh_pending'
+
+
+def _recent_key(member):
+    return 'event_exim_refresh_recent_{}'.format(member)
+
+
+def _attempts_key(member):
+    return 'event_exim_refresh_attempts_{}'.format(member)
+
+
+def _count_failures(redis, members):
+    """Counts a failed attempt for each member and returns those to retry"""
+    pipe = redis.pipeline()
+    for member in members:
+        pipe.incr(_attempts_key(member))
+        pipe.expire(_attempts_key(member), ATTEMPTS_EXPIRE)
+    attempts = pipe.execute()[::2]
+    return [member for member, tries in zip(members, attempts)
+            if int(tries) < REFRESH_MAX_ATTEMPTS]
+
+
+def enqueue_refresh(eventsource_name, organization_source_pk):
+    redis = get_redis_connection(REDIS_CACHE_KEY)
+    redis.sadd(PENDING_KEY, '{}/{}'.format(eventsource_name, organization_source_pk))
+
+
+def pending_count():
+    return get_redis_connection(REDIS_CACHE_KEY).scard(PENDING_KEY)
+
+
+def _claim(redis, batch_size):
+    """Pops up to batch_size members off the pending set"""
+    pipe = redis.pipeline()
+    for i in range(batch_size):
+        pipe.spop(PENDING_KEY)
+    return [m.decode('utf-8') if isinstance(m, bytes) else m
+            for m in pipe.execute() if m]
+
+
+def _refresh(members):
+    """
+    Refreshes '<source name>/<pk>' members, with one get_events() per source.
+    Returns (# refreshed, [failed members], # for unknown sources)
+    """
+    from event_exim.models import EventSource
+    by_source = {}
+    for member in members:
+        name, pk = member.split('/', 1)
+        by_source.setdefault(name, []).append(pk)
+    refreshed = 0
+    failed = []
+    sources = EventSource.objects.filter(name__in=list(by_source))
+    for source in sources:
+        pks = by_source.pop(source.name)
+        try:
+            source.update_events_by_ids(pks)
+            refreshed += len(pks)
+        except Exception as e:
+            print('refresh of {} {} failed: {}'.format(source.name, ','.join(pks), e))
+            failed.extend('{}/{}'.format(source.name, pk) for pk in pks)
+    unknown = sum(len(pks) for pks in by_source.values())
+    return refreshed, failed, unknown
+
+
+def drain_refresh_queue(batch_size=None, window=None):
+    """
+    Refreshes everything on the queue, batch_size events at a time.
+    Returns counts: {'refreshed', 'deferred', 'failed', 'dropped', 'unknown'}
+    (failed events are put back on the queue for the next drain, unless
+    they have failed REFRESH_MAX_ATTEMPTS times, and are dropped)
+    """
+    batch_size = batch_size or REFRESH_BATCH_SIZE
+    window = window or REFRESH_WINDOW
+    redis = get_redis_connection(REDIS_CACHE_KEY)
+    counts = {'refreshed': 0, 'deferred': 0, 'failed': 0, 'dropped': 0, 'unknown': 0}
+    deferred = set()
+    failed = set()
+    try:
+        while True:
+            members = _claim(redis, batch_size)
+            if not members or all(m in deferred or m in failed for m in members):
+                # empty, or only events we've already put off (re-added by new hits)
+                break
+            # the first to set the marker gets to fetch the event this window
+            pipe = redis.pipeline()
+            for member in members:
+                pipe.set(_recent_key(member), 1, nx=True, ex=window)
+            due = []
+            for member, first in zip(members, pipe.execute()):
+                if first:
+                    due.append(member)
+                else:
+                    deferred.add(member)
+            if due:
+                refreshed, batch_failed, unknown = _refresh(due)
+                counts['refreshed'] += refreshed
+                counts['unknown'] += unknown
+                succeeded = set(due).difference(batch_failed)
+                if succeeded:
+                    redis.delete(*[_attempts_key(member) for member in succeeded])
+                if batch_failed:
+                    retry = _count_failures(redis, batch_failed)
+                    counts['dropped'] += len(batch_failed) - len(retry)
+                    if retry:
+                        # so the retry isn't put off for the window
+                        redis.delete(*[_recent_key(member) for member in retry])
+                        failed.update(retry)
+    finally:
+        if deferred or failed:
+            redis.sadd(PENDING_KEY, *(deferred | failed))
+    counts['deferred'] = len(deferred)
+    counts['failed'] = len(failed)
+    return counts
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from event_exim.models import SyncTimeout
+
+"""
+Runs EventSource.update_events() for many sources at once, so that a
+daily/hourly run takes about as long as the slowest source, rather than the
+sum of every remote system's latency.
+
+Each source syncs in its own thread -- and so on its own database connection,
+which we close when it is done.  A source failing or timing out does not
+stop the others.
+"""
+
+# how many sources to sync at the same time
+SYNC_WORKERS = getattr(settings, 'EVENT_EXIM_SYNC_WORKERS', 4)
+# seconds before a source stops loading new batches (None for no limit)
+SYNC_SOURCE_TIMEOUT = getattr(settings, 'EVENT_EXIM_SYNC_SOURCE_TIMEOUT', None)
+
+
+def _sync_source(source, timeout=None, **update_kwargs):
+    started = time.time()
+    result = {'source': source.name, 'status': 'ok'}
+    try:
+        result['counts'] = source.update_events(
+            deadline=(started + timeout if timeout else None), **update_kwargs)
+    except SyncTimeout as e:
+        result['status'] = 'timeout'
+        result['counts'] = e.counts
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        result['duration'] = round(time.time() - started, 3)
+        run = getattr(source, 'sync_run', None)
+        if run is not None:
+            result['run'] = run.id
+        connection.close()
+    return result
+
+
+def sync_sources(sources, workers=None, timeout=None, **update_kwargs):
+    """
+    Syncs sources concurrently with up to `workers` threads and returns
+    a summary like:
+      {'duration': <seconds>,
+       'sources': [{'source': <name>, 'status': 'ok'|'failed'|'timeout',
+                    'duration': <seconds>, 'counts': {...}, 'error': ...,
+                    'run': <SyncRun id>}, ...]}
+    `timeout` is per-source, in seconds: a source stops after the batch it is
+    on when it runs out of time (and saves what it has).  We return once every
+    source has stopped.
+    """
+    workers = workers or SYNC_WORKERS
+    timeout = timeout or SYNC_SOURCE_TIMEOUT
+    sources = list(sources)
+    started = time.time()
+    results = []
+    if sources:
+        # a source past its deadline stops between batches, so we wait for every
+        # thread rather than leave one writing after the run is reported
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_sync_source, source, timeout, **update_kwargs)
+                       for source in sources]
+            results = [future.result() for future in futures]
+    return {'duration': round(time.time() - started, 3),
+            'sources': results}
+
+
+def min_last_update(sources):
+    """
+    The earliest last_update among sources, for looking for dupes among
+    new events -- or None (look at everything) if a source was never synced
+    """
+    last_updates = [source.last_update for source in sources]
+    if not last_updates or not all(last_updates):
+        return None
+    return min(last_updates)
@@ -1,7 +1,7 @@
 import datetime
 import re
 
-from django.test import Client, TestCase, override_settings
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 
 """
 >>> response = c.post('/login/', {'username': 'john', 'password': 'smith'})
@@ -34,3 +34,769 @@ class SmokeTestCase(TestCase):
         response = self.c.get('/api/v1/events/')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['content-type'], 'application/json')
+
+
+def _event_dict(source, pk, **kw):
+    event = {'title': 'Event {}'.format(pk),
+             'starts_at': datetime.datetime(2017, 4, 1, 10),
+             'starts_at_utc': datetime.datetime(2017, 4, 1, 14),
+             'zip': '10001',
+             'status': 'active',
+             'host_is_confirmed': 1,
+             'is_private': 0,
+             'is_approved': 1,
+             'attendee_count': 0,
+             'organization_host': None,
+             'organization_source': source,
+             'organization_source_pk': str(pk),
+             'organization': source.origin_organization,
+             'organization_campaign': 'campaign',
+             'is_searchable': 1,
+             'osdi_origin_system': 'test',
+             'ticket_type': 0,
+             'venue_category': 0}
+    event.update(kw)
+    return event
+
+
+class EventUpsertTestCase(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        from event_exim.models import EventSource
+        from event_store.models import Organization
+        org = Organization.objects.create(title='Org', slug='org', osdi_source_id='org',
+                                          group=Group.objects.create(name='org'))
+        self.source = EventSource.objects.create(name='src', origin_organization=org,
+                                                 osdi_name='src', crm_type='', update_style=0)
+
+    def test_insert_update_unchanged_counts(self):
+        from event_store.models import Event
+        counts = self.source.update_events_from_dicts(
+            [_event_dict(self.source, i) for i in range(5)])
+        self.assertEqual(counts, {'inserted': 5, 'updated': 0, 'unchanged': 0})
+        counts = self.source.update_events_from_dicts(
+            [_event_dict(self.source, i, attendee_count=(10 if i < 2 else 0))
+             for i in range(6)])
+        self.assertEqual(counts, {'inserted': 1, 'updated': 2, 'unchanged': 3})
+        self.assertEqual(Event.objects.filter(attendee_count=10).count(), 2)
+        self.assertEqual(Event.objects.count(), 6)
+
+    def test_unchanged_events_skipped_by_hash(self):
+        from event_store.models import Event
+        events = [_event_dict(self.source, i) for i in range(5)]
+        self.source.update_events_from_dicts(events)
+        self.assertEqual(Event.objects.filter(source_hash__isnull=True).count(), 0)
+        with self.assertNumQueries(1):
+            counts = self.source.update_events_from_dicts(events)
+        self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'unchanged': 5})
+
+    def test_update_events_records_sync_run(self):
+        from event_exim.connectors.base_connector import Connector, event_batches
+        source = self.source
+
+        class FakeConnector(Connector):
+            def load_event_batches(self, max_events=None, last_updated=None, batch_size=1000, cursor=None):
+                events = self.converted(range(5), lambda i: _event_dict(source, i))
+                return event_batches(events, 2, last_updated, 'now')
+
+            def finish_sync(self):
+                return {'created': 1, 'failed': 1, 'errors': ['event 2: nope']}
+
+        source.api = FakeConnector(source)
+        counts = source.update_events()
+        self.assertEqual(counts['inserted'], 5)
+        run = source.sync_runs.get()
+        self.assertEqual((run.status, run.fetched, run.inserted, run.failed), ('ok', 5, 5, 0))
+        self.assertEqual(run.last_update, None)
+        self.assertEqual(source.last_update, 'now')
+        self.assertTrue(set(['fetch', 'convert', 'hash', 'hosts', 'events', 'finish']) <= set(run.phases))
+        self.assertEqual(run.finish_summary, {'created': 1, 'failed': 1, 'errors': ['event 2: nope']})
+
+    def test_update_events_pipeline(self):
+        import threading
+        import time
+        from event_exim.connectors.base_connector import Connector, event_batches
+        from event_exim.models import SyncTimeout
+        source = self.source
+
+        class FakeConnector(Connector):
+            def load_event_batches(self, max_events=None, last_updated=None, batch_size=1000, cursor=None):
+                events = self.converted(range(7), lambda i: _event_dict(source, i))
+                return event_batches(events, 2, last_updated, 'now')
+
+        source.api = FakeConnector(source)
+        threads = threading.active_count()
+        source.update_events()
+        run = source.sync_runs.get()
+        self.assertEqual(set(run.depths), set(['fetched', 'converted']))
+        self.assertEqual(set(run.stage_utilization), set(['fetch', 'convert', 'persist']))
+        # stopping early stops the stages too
+        self.assertRaises(SyncTimeout, source.update_events, deadline=time.time() - 1)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_cohost_signups_after_sync(self):
+        import json
+        from unittest import mock
+        import requests
+        from event_exim.connectors import actionkit_api
+        from event_exim.connectors.actionkit_api import Connector
+        from event_store.models import Event
+        source = self.source
+        source.crm_data = {'base_url': 'https://act.example.com', 'api_user': 'u', 'api_password': 'p',
+                           'cohost_id': 5, 'cohost_autocreate_page_id': 9}
+        pending = json.dumps({'cohost_signup_pending': True, 'create_action_id': None}, sort_keys=True)
+        source.update_events_from_dicts(
+            [_event_dict(source, i, source_json_data=pending) for i in (1, 2)]
+            # however it was written out
+            + [_event_dict(source, 3, source_json_data=json.dumps({'cohost_signup_pending': True},
+                                                                  separators=(',', ':'))),
+               _event_dict(source, 4, source_json_data=json.dumps({'cohost_signup_pending': False}))])
+
+        def create_signup(user, e_id, page, **kw):
+            if e_id == 3:
+                raise requests.ConnectionError('reset')
+            return {'id': 100 + e_id} if e_id == 1 else None
+
+        connector = Connector(source)
+        with mock.patch.object(connector.akapi, 'create_signup', create=True,
+                               side_effect=create_signup) as signup, \
+                self.assertLogs(actionkit_api.__name__, 'WARNING'):
+            results = connector.create_cohost_signups()
+            self.assertEqual((results['created'], results['failed']), (1, 2))
+            self.assertEqual(len(results['errors']), 2)
+            self.assertIn('ConnectionError', ' '.join(results['errors']))
+            self.assertEqual(sorted(c[0][1] for c in signup.call_args_list), [1, 2, 3])
+            created = json.loads(Event.objects.get(organization_source_pk='1').source_json_data)
+            self.assertEqual(created, {'create_action_id': 101})
+            # the failures are retried next time
+            results = connector.create_cohost_signups()
+            self.assertEqual((results['created'], results['failed']), (0, 2))
+            self.assertEqual(sorted(c[0][1] for c in signup.call_args_list[3:]), [2, 3])
+
+    def test_update_events_resumes_from_checkpoint(self):
+        from event_exim.connectors.base_connector import Connector, event_batches
+        from event_exim.models import SyncCheckpoint
+        source = self.source
+        loaded = []
+
+        class FakeConnector(Connector):
+            fail_after = None
+
+            def _events(self, start, progress):
+                for i in range(start, 7):
+                    if i == self.fail_after:
+                        raise Exception('lambda time limit')
+                    loaded.append(i)
+                    progress['after'] = i
+                    yield _event_dict(source, i)
+
+            def load_event_batches(self, max_events=None, last_updated=None, batch_size=1000, cursor=None):
+                progress = {}
+                start = cursor['after'] + 1 if cursor else 0
+                new_last_updated = cursor['new_last_updated'] if cursor else 'first try'
+                return event_batches(self._events(start, progress), 2,
+                                     last_updated, new_last_updated, progress=progress)
+
+        source.api = FakeConnector(source)
+        source.api.fail_after = 5
+        self.assertRaises(Exception, source.update_events)
+        checkpoint = SyncCheckpoint.objects.get(source=source)
+        self.assertEqual((checkpoint.events, checkpoint.cursor_data['after']), (4, 3))
+        self.assertEqual(source.sync_runs.get().status, 'failed')
+
+        source.api.fail_after = None
+        del loaded[:]
+        counts = source.update_events()
+        self.assertEqual(loaded, [4, 5, 6])
+        self.assertEqual(counts['inserted'], 3)
+        self.assertEqual(source.last_update, 'first try')
+        self.assertFalse(SyncCheckpoint.objects.filter(source=source).exists())
+
+    def test_update_events_by_ids(self):
+        from event_exim.connectors.base_connector import Connector
+        source = self.source
+
+        class FakeConnector(Connector):
+            def get_event(self, event_id):
+                if int(event_id) < 3:
+                    return _event_dict(source, event_id, title='refreshed')
+
+        source.api = FakeConnector(source)
+        counts = source.update_events_by_ids(['1', '2', '7'])
+        self.assertEqual((counts['inserted'], counts['missing']), (2, 1))
+
+    def test_host_upsert_and_identity(self):
+        from event_store.models import Activist, ActivistIdentity, Event
+
+        def host(pk, name, email):
+            return Activist(member_system=self.source, member_system_pk=str(pk),
+                            name=name, email=email, hashed_email=Activist.hash(email))
+
+        self.source.update_events_from_dicts(
+            [_event_dict(self.source, i, organization_host=host(i % 2, 'Host', 'h%s@example.com' % (i % 2)))
+             for i in range(4)])
+        self.assertEqual(Activist.objects.count(), 2)
+        self.assertEqual(ActivistIdentity.objects.count(), 2)
+        self.assertEqual(Event.objects.filter(organization_host__member_system_pk='1').count(), 2)
+
+        counts = self.source.update_events_from_dicts(
+            [_event_dict(self.source, i, organization_host=host(i % 2, 'Renamed', 'h%s@example.com' % (i % 2)))
+             for i in range(4)])
+        # host changes change the events' fingerprints, too
+        self.assertEqual(counts['updated'], 4)
+        self.assertEqual(Activist.objects.filter(name='Renamed').count(), 2)
+        self.assertEqual(Activist.objects.filter(identity__isnull=False).count(), 2)
+
+    def test_host_dicts(self):
+        from event_store.models import Activist, Event
+        host = {'member_system_pk': '7', 'name': 'Dict Host', 'email': 'dict@example.com',
+                'hashed_email': Activist.hash('dict@example.com'), 'phone': None}
+        counts = self.source.update_events_from_dicts(
+            [_event_dict(self.source, i, organization_host=dict(host)) for i in range(2)])
+        self.assertEqual(counts['inserted'], 2)
+        activist = Activist.objects.get()
+        self.assertEqual((activist.member_system_pk, activist.name), ('7', 'Dict Host'))
+        self.assertEqual(Event.objects.filter(organization_host=activist).count(), 2)
+        # the same host as an Activist fingerprints the same
+        counts = self.source.update_events_from_dicts(
+            [_event_dict(self.source, i, organization_host=Activist(member_system=self.source, **host))
+             for i in range(2)])
+        self.assertEqual(counts['unchanged'], 2)
+
+
+class ActionKitDecoderTestCase(TestCase):
+
+    def test_decoder(self):
+        from event_exim.connectors.actionkit_api import Connector
+        decoder = Connector.decoder
+        row = [None] * len(Connector.field_indexes)
+        fi = Connector.field_indexes
+        row[fi['ee.id']] = 5
+        row[fi['state']] = 'ny'
+        row[fi['title']] = 'Rally'
+        row[fi['starts_at']] = '2017-04-01 10:30:00'
+        self.assertEqual(decoder.record(row).ee_id, 5)
+        fields, hack = decoder.common(row)
+        self.assertEqual((fields['state'], fields['title'], hack), ('NY', 'Rally', False))
+        self.assertEqual(fields['starts_at'], datetime.datetime(2017, 4, 1, 10, 30))
+        row[fi['title']] = 'Rally\x00'
+        row[fi['state']] = 'N.Y'
+        fields, hack = decoder.common(row)
+        self.assertEqual((fields['state'], fields['title'], hack), ('XX', 'RallyX', True))
+
+
+class ConvertProcessesTestCase(SimpleTestCase):
+    # not a TestCase: we can't fork worker processes inside its transaction
+
+    def test_converted_in_processes(self):
+        import os
+        import threading
+        from unittest import mock
+        from event_exim.connectors import base_connector
+        from event_exim.models import EventSource
+        from event_store.models import Activist, Organization
+
+        class FakeConnector(base_connector.Connector):
+            def __init__(self, source):
+                self.source = source
+
+            def convert(self, item):
+                return {'id': item, 'pid': os.getpid(), 'organization_source': self.source,
+                        'organization_host': Activist(member_system_pk=str(item),
+                                                      name='Host {}'.format(item))}
+
+        source = EventSource(name='src', origin_organization=Organization(title='Org', slug='org'))
+        connector = FakeConnector(source)
+        progress = {}
+
+        fetching = []
+
+        def items():
+            # the pool was forked before the pipeline's fetch thread started
+            fetching.append((threading.current_thread() is threading.main_thread(),
+                             connector._convert_pool is not None))
+            for i in range(50):
+                progress['after'] = i
+                yield i
+
+        checkpoint = {}
+        checkpoints = []
+        with mock.patch.object(base_connector, 'CONVERT_PROCESSES', 2), \
+                mock.patch.object(base_connector, 'CONVERT_CHUNK_SIZE', 7), \
+                mock.patch.object(base_connector, 'SYNC_PIPELINE', True):
+            self.assertIsNotNone(connector.start_convert_pool())
+            try:
+                events = []
+                for event in connector.converted(items(), connector.convert,
+                                                 progress=progress, checkpoint=checkpoint):
+                    events.append(event)
+                    checkpoints.append(checkpoint.get('after'))
+            finally:
+                connector.stop_convert_pool()
+        self.assertEqual(fetching, [(False, True)])
+        self.assertNotIn(os.getpid(), set(e['pid'] for e in events))
+        self.assertEqual([e['id'] for e in events], list(range(50)))
+        self.assertIs(events[0]['organization_source'], source)
+        self.assertEqual(events[3]['organization_host']['name'], 'Host 3')
+        # a checkpoint is never past the event just yielded, and catches up at each chunk's end
+        for event, after in zip(events, checkpoints):
+            self.assertTrue(after is None or after <= event['id'])
+        self.assertEqual(checkpoints[6], 6)
+        self.assertEqual(checkpoints[-1], 49)
+
+    def test_no_fork_with_other_threads(self):
+        import threading
+        from unittest import mock
+        from event_exim.connectors import base_connector
+        from event_exim.models import EventSource
+
+        class FakeConnector(base_connector.Connector):
+            def __init__(self, source):
+                self.source = source
+
+        connector = FakeConnector(EventSource(name='src'))
+        pools = []
+        with mock.patch.object(base_connector, 'CONVERT_PROCESSES', 2):
+            # like event_exim.runner's threads
+            thread = threading.Thread(target=lambda: pools.append(connector.start_convert_pool()))
+            thread.start()
+            thread.join()
+        self.assertEqual(pools, [None])
+
+
+class SyncRunnerTestCase(TestCase):
+
+    class FakeSource:
+        def __init__(self, name, error=None, last_update=None, batches=0):
+            self.name = name
+            self.error = error
+            self.last_update = last_update
+            self.batches = batches
+            self.loaded = 0
+
+        def update_events(self, deadline=None, **kwargs):
+            import time
+            from event_exim.models import SyncTimeout
+            if self.error:
+                raise self.error
+            for _ in range(self.batches):
+                time.sleep(0.05)
+                self.loaded += 1
+                if deadline and time.time() > deadline:
+                    raise SyncTimeout(self, {'inserted': self.loaded, 'updated': 0, 'unchanged': 0})
+            return {'inserted': 1, 'updated': 0, 'unchanged': 0}
+
+    def test_failures_are_isolated(self):
+        from event_exim.runner import sync_sources
+        summary = sync_sources([self.FakeSource('a'),
+                                self.FakeSource('b', error=ValueError('boom')),
+                                self.FakeSource('c')], workers=2)
+        statuses = {r['source']: r['status'] for r in summary['sources']}
+        self.assertEqual(statuses, {'a': 'ok', 'b': 'failed', 'c': 'ok'})
+        self.assertIn('boom', summary['sources'][1]['error'])
+
+    def test_timeout_waits_for_the_current_batch(self):
+        from event_exim.runner import sync_sources
+        slow = self.FakeSource('slow', batches=100)
+        summary = sync_sources([slow, self.FakeSource('fast')], workers=2, timeout=0.1)
+        results = {r['source']: r for r in summary['sources']}
+        self.assertEqual(results['fast']['status'], 'ok')
+        self.assertEqual(results['slow']['status'], 'timeout')
+        # the slow source stopped itself, and was done by the time we returned
+        self.assertEqual(results['slow']['counts']['inserted'], slow.loaded)
+        self.assertLess(slow.loaded, 100)
+
+    def test_min_last_update(self):
+        from event_exim.runner import min_last_update
+        self.assertEqual(min_last_update([self.FakeSource('a', last_update='2017-02-01 00:00:00'),
+                                          self.FakeSource('b', last_update='2017-01-01 00:00:00')]),
+                         '2017-01-01 00:00:00')
+        self.assertIsNone(min_last_update([self.FakeSource('a', last_update='2017-02-01 00:00:00'),
+                                           self.FakeSource('b')]))
+
+
+class HttpClientTestCase(TestCase):
+
+    class FakeSession:
+        def __init__(self, statuses):
+            self.statuses = list(statuses)
+
+        def request(self, method, url, **kwargs):
+            from requests.models import Response
+            res = Response()
+            res.status_code = self.statuses.pop(0)
+            res._content = b'{}'
+            return res
+
+    def test_retries_and_stats(self):
+        from event_exim.connectors.http_client import HttpClient
+        client = HttpClient(backoff=0)
+        res = client.get('https://example.com/x?access_token=secret',
+                         session=self.FakeSession([503, 429, 200]))
+        self.assertEqual(res.status_code, 200)
+        stats = client.stats()
+        self.assertEqual((stats['requests'], stats['retries'], stats['failures']), (1, 2, 0))
+        self.assertEqual(stats['recent'][0][1], 'https://example.com/x')
+
+        res = client.get('https://example.com/x', session=self.FakeSession([500] * 4))
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(client.stats()['failures'], 1)
+
+
+class FacebookCrawlTestCase(TestCase):
+
+    class FakeGraph:
+        """Answers batch calls for pages with events p1-0,p1-1,... two to a page"""
+        def __init__(self, pages, failing=None):
+            self.pages = pages  # page id -> number of events
+            self.failing = failing or {}  # page id -> error code for its next links
+            self.calls = 0
+
+        def _events(self, page_id, after):
+            count = self.pages[page_id]
+            result = {'data': [{'id': '{}-{}'.format(page_id, i)}
+                               for i in range(after, min(after + 2, count))]}
+            if after + 2 < count:
+                result['paging'] = {'next': 'https://graph.facebook.com/v2.9/{}/events?after={}'.format(
+                    page_id, after + 2)}
+            return result
+
+        def post(self, url, data=None, **kwargs):
+            import json
+            from urllib.parse import parse_qs, urlsplit
+            from requests.models import Response
+            self.calls += 1
+            responses = []
+            for request in json.loads(data['batch']):
+                parts = urlsplit(request['relative_url'])
+                query = parse_qs(parts.query)
+                if 'ids' not in query and parts.path.split('/')[1] in self.failing:
+                    responses.append({'code': self.failing[parts.path.split('/')[1]],
+                                      'body': json.dumps({'error': {'message': 'oops'}})})
+                    continue
+                if 'ids' in query:
+                    body = {page_id: {'events': self._events(page_id, 0)}
+                            for page_id in query['ids'][0].split(',')}
+                else:
+                    body = self._events(parts.path.split('/')[1], int(query['after'][0]))
+                responses.append({'code': 200, 'body': json.dumps(body)})
+            res = Response()
+            res.status_code = 200
+            res._content = json.dumps(responses).encode('utf-8')
+            return res
+
+    def test_crawl_follows_paging_per_page(self):
+        from event_exim.connectors.facebook import Connector
+        from event_exim.models import EventSource
+        source = EventSource(name='fb', crm_type='facebook', crm_data={'max_paging': 1})
+        connector = Connector(source)
+        connector.http = graph = self.FakeGraph({'p1': 7, 'p2': 3, 'p3': 1})
+        event_ids = [e['id'] for e in connector._crawl('p1,p2,p3', ids_are_events=False)]
+        # p1 stops after one next link; p2 gets all of its events
+        self.assertEqual(sorted(event_ids), ['p1-0', 'p1-1', 'p1-2', 'p1-3',
+                                             'p2-0', 'p2-1', 'p2-2', 'p3-0'])
+        # one call for the pages and one for all their next links
+        self.assertEqual(graph.calls, 2)
+
+    def test_crawl_fails_on_failed_request(self):
+        from event_exim.connectors.facebook import Connector, GraphError
+        from event_exim.models import EventSource
+        source = EventSource(name='fb', crm_type='facebook', crm_data={'max_paging': 1})
+        connector = Connector(source)
+        connector.http = self.FakeGraph({'p1': 7, 'p2': 3}, failing={'p2': 500})
+        with self.assertRaises(GraphError):
+            list(connector._crawl('p1,p2', ids_are_events=False))
+
+    def test_crawl_skips_refused_request(self):
+        from event_exim.connectors.facebook import Connector
+        from event_exim.models import EventSource
+        source = EventSource(name='fb', crm_type='facebook', crm_data={'max_paging': 1})
+        connector = Connector(source)
+        connector.http = self.FakeGraph({'p1': 7, 'p2': 3}, failing={'p2': 400})
+        event_ids = [e['id'] for e in connector._crawl('p1,p2', ids_are_events=False)]
+        self.assertEqual(sorted(event_ids), ['p1-0', 'p1-1', 'p1-2', 'p1-3', 'p2-0', 'p2-1'])
+
+
+class RefreshQueueTestCase(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        from django_redis import get_redis_connection
+        from event_exim.models import EventSource
+        from event_exim.refresh_queue import REDIS_CACHE_KEY
+        from event_store.models import Organization
+        self.redis = get_redis_connection(REDIS_CACHE_KEY)
+        self.redis.flushdb()
+        org = Organization.objects.create(title='Org', slug='org', osdi_source_id='org',
+                                          group=Group.objects.create(name='org'))
+        EventSource.objects.create(name='src', origin_organization=org,
+                                   osdi_name='src', crm_type='', update_style=0)
+
+    def test_repeat_hits_coalesce_within_window(self):
+        from unittest import mock
+        from event_exim.refresh_queue import drain_refresh_queue, enqueue_refresh, pending_count
+        for i in range(3):
+            enqueue_refresh('src', '123')
+        enqueue_refresh('nosuchsource', '1')
+        self.assertEqual(pending_count(), 2)
+        with mock.patch('event_exim.models.EventSource.update_events_by_ids') as update_event:
+            counts = drain_refresh_queue()
+            self.assertEqual(update_event.call_count, 1)
+            self.assertEqual((counts['refreshed'], counts['unknown']), (1, 1))
+            self.assertEqual(pending_count(), 0)
+
+            # hit again inside the window: it waits for a later drain
+            enqueue_refresh('src', '123')
+            counts = drain_refresh_queue()
+            self.assertEqual(update_event.call_count, 1)
+            self.assertEqual(counts['deferred'], 1)
+            self.assertEqual(pending_count(), 1)
+
+    def test_failed_refresh_is_retried(self):
+        from unittest import mock
+        from event_exim.refresh_queue import drain_refresh_queue, enqueue_refresh, pending_count
+        enqueue_refresh('src', '123')
+        with mock.patch('event_exim.models.EventSource.update_events_by_ids',
+                        side_effect=Exception('source is down')) as update_event:
+            counts = drain_refresh_queue()
+        self.assertEqual((counts['refreshed'], counts['failed']), (0, 1))
+        self.assertEqual(pending_count(), 1)
+        # and isn't held back by the window
+        with mock.patch('event_exim.models.EventSource.update_events_by_ids') as update_event:
+            counts = drain_refresh_queue()
+            self.assertEqual(update_event.call_count, 1)
+        self.assertEqual((counts['refreshed'], counts['deferred']), (1, 0))
+
+    def test_failing_refresh_is_dropped(self):
+        from unittest import mock
+        from event_exim import refresh_queue
+        from event_exim.refresh_queue import drain_refresh_queue, enqueue_refresh, pending_count
+        enqueue_refresh('src', '123')
+        with mock.patch.object(refresh_queue, 'REFRESH_MAX_ATTEMPTS', 3), \
+                mock.patch('event_exim.models.EventSource.update_events_by_ids',
+                           side_effect=Exception('no such event')) as update_event:
+            for i in range(3):
+                counts = drain_refresh_queue()
+            self.assertEqual(update_event.call_count, 3)
+            self.assertEqual((counts['failed'], counts['dropped']), (0, 1))
+            self.assertEqual(pending_count(), 0)
+            # a new hit after the window gets one more try
+            self.redis.delete(refresh_queue._recent_key('src/123'))
+            enqueue_refresh('src', '123')
+            counts = drain_refresh_queue()
+            self.assertEqual(update_event.call_count, 4)
+            self.assertEqual(counts['dropped'], 1)
+
+    def test_pixel_for_unknown_source_is_404(self):
+        from django.http import Http404
+        from django.test import RequestFactory
+        from event_exim.refresh_queue import pending_count
+        from event_exim.views import refresh_event
+        request = RequestFactory().get('/')
+        self.assertEqual(refresh_event(request, 'src', '123').status_code, 200)
+        self.assertRaises(Http404, refresh_event, request, 'nosuchsource', '123')
+        self.assertEqual(pending_count(), 1)
+
+
+class TokenCacheTestCase(TestCase):
+
+    def setUp(self):
+        from django_redis import get_redis_connection
+        from event_exim.connectors.token_cache import REDIS_CACHE_KEY
+        get_redis_connection(REDIS_CACHE_KEY).flushdb()
+
+    def test_bulk_fetch_shared_and_lru(self):
+        from event_exim.connectors.token_cache import TokenCache
+        fetched = []
+
+        def fetch(keys):
+            fetched.append(sorted(keys))
+            return {k: 'token{}'.format(k) for k in keys if k != '3'}
+
+        cache = TokenCache('test', ttl=60, local_size=2)
+        self.assertEqual(cache.get_many(['1', '2', '3'], fetch),
+                         {'1': 'token1', '2': 'token2'})
+        self.assertEqual(cache.get_many(['1', '2'], fetch), {'1': 'token1', '2': 'token2'})
+        self.assertEqual(fetched, [['1', '2', '3']])
+
+        # another process only has redis
+        other = TokenCache('test', ttl=60)
+        self.assertEqual(other.get('1', lambda k: 'new'), 'token1')
+        self.assertEqual(other.stats()['shared_hits'], 1)
+
+        cache.get('4', lambda k: 'token4')
+        self.assertEqual(list(cache.local), ['2', '4'])
+        stats = cache.stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (2, 4))
+        self.assertEqual(stats['all'], {'hits': 3, 'misses': 4})
+
+    def test_local_only_without_redis(self):
+        from unittest import mock
+        from event_exim.connectors import token_cache
+        from event_exim.connectors.token_cache import TokenCache
+        cache = TokenCache('test', ttl=60)
+        with mock.patch.object(token_cache, 'get_redis_connection',
+                               side_effect=NotImplementedError('not django_redis')) as get_redis:
+            with self.assertLogs(token_cache.__name__, 'WARNING'):
+                self.assertEqual(cache.get('1', lambda k: 'token1'), 'token1')
+            self.assertEqual(cache.get('1', lambda k: 'new'), 'token1')
+            self.assertEqual(cache.stats()['all'], {})
+        # we stop asking once the cache said no
+        self.assertEqual(get_redis.call_count, 1)
+        self.assertEqual(cache.stats()['local_hits'], 1)
+
+
+class EventDupeGuessesTestCase(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        from event_exim.models import EventDupeGuesses, EventSource
+        from event_store.models import Event, Organization
+        org = Organization.objects.create(title='Org', slug='org', osdi_source_id='org',
+                                          group=Group.objects.create(name='org'))
+        self.source = EventSource.objects.create(name='src', origin_organization=org,
+                                                 osdi_name='src', crm_type='', update_style=0)
+        self.source.update_events_from_dicts(
+            [_event_dict(self.source, i) for i in range(3)]  # same zip and time
+            + [_event_dict(self.source, 3, zip='10002'),
+               _event_dict(self.source, 4, zip='10002'),
+               _event_dict(self.source, 5, zip='10003')])
+        Event.objects.update(updated_at=datetime.datetime(2017, 1, 1))
+        # made as they were saved (see test_guesses_made_as_events_are_saved)
+        EventDupeGuesses.objects.all().delete()
+
+    def test_groups_recorded_as_clusters(self):
+        from event_exim.models import EventDupeGuesses
+        from event_store.models import Event
+        with self.assertNumQueries(1):
+            groups = EventDupeGuesses.get_potential_dupes()
+        self.assertEqual(sorted((g['zip'], g['count']) for g in groups),
+                         [('10001', 3), ('10002', 2)])
+        with self.assertNumQueries(2):
+            EventDupeGuesses.record_potential_dupes(groups)
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        self.assertEqual(
+            set(EventDupeGuesses.objects.values_list('source_event_id', 'dupe_event_id')),
+            set([(ids['0'], ids['1']), (ids['0'], ids['2']), (ids['3'], ids['4'])]))
+        # already recorded ones aren't added again
+        EventDupeGuesses.record_potential_dupes(EventDupeGuesses.get_potential_dupes())
+        self.assertEqual(EventDupeGuesses.objects.count(), 3)
+
+    def test_only_groups_with_new_events(self):
+        from event_exim.models import EventDupeGuesses
+        from event_store.models import Event
+        Event.objects.filter(organization_source_pk='4').update(
+            updated_at=datetime.datetime(2017, 2, 1))
+        # a source's last_update, as call_process.run_sources passes it
+        with self.assertNumQueries(2):
+            groups = EventDupeGuesses.get_potential_dupes('2017-01-15 00:00:00')
+        self.assertEqual([(g['zip'], g['count']) for g in groups], [('10002', 2)])
+        self.assertEqual(EventDupeGuesses.get_potential_dupes('2017-03-01 00:00:00'), [])
+
+    def test_fuzzy_dupes(self):
+        from event_exim.dupe_matching import find_fuzzy_dupes
+        from event_exim.models import EventDupeGuesses
+        from event_store.models import Event
+        Event.objects.all().delete()
+        starts = datetime.datetime(2017, 4, 1, 14)
+        self.source.update_events_from_dicts([
+            _event_dict(self.source, 10, title='Town Hall with Senator Smith',
+                        venue='Main Street Library', zip='20001'),
+            # typoed zip and 15 minutes later
+            _event_dict(self.source, 11, title='Town hall w/ Senator Smith!',
+                        venue='Main St Library', zip='20010',
+                        starts_at_utc=starts + datetime.timedelta(minutes=15)),
+            # cross-posted with no location
+            _event_dict(self.source, 12, title='Town Hall with Senator Smith',
+                        venue='Main Street Library', zip=''),
+            # nearby, same time, different event
+            _event_dict(self.source, 13, title='Canvass for clean water',
+                        venue='Union Hall', zip='20002'),
+            # same title, hours later
+            _event_dict(self.source, 14, title='Town Hall with Senator Smith',
+                        venue='Main Street Library', zip='20001',
+                        starts_at_utc=starts + datetime.timedelta(hours=5)),
+        ])
+        EventDupeGuesses.objects.all().delete()
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        guesses = find_fuzzy_dupes()
+        self.assertEqual(set((g['source_event_id'], g['dupe_event_id']) for g in guesses),
+                         set([(ids['10'], ids['11']), (ids['10'], ids['12']), (ids['11'], ids['12'])]))
+        self.assertEqual(EventDupeGuesses.record_fuzzy_dupes(guesses), 3)
+        self.assertEqual(EventDupeGuesses.record_fuzzy_dupes(find_fuzzy_dupes()), 0)
+        self.assertTrue(all(0.5 <= g.score <= 1 for g in EventDupeGuesses.objects.all()))
+
+    def test_fuzzy_dupes_without_zip(self):
+        from event_exim.dupe_matching import find_fuzzy_dupes
+        from event_store.models import Event
+        Event.objects.all().delete()
+        # cross-posted, with no location -- get_potential_dupes() skips these
+        self.source.update_events_from_dicts([
+            _event_dict(self.source, i, title='Vigil for peace', zip='') for i in (20, 21)])
+        Event.objects.update(updated_at=datetime.datetime(2017, 1, 1))
+        Event.objects.filter(organization_source_pk='21').update(
+            updated_at=datetime.datetime(2017, 2, 1))
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        # a source's last_update, as call_process.run_sources passes it
+        guesses = find_fuzzy_dupes('2017-01-15 00:00:00')
+        self.assertEqual([(g['source_event_id'], g['dupe_event_id'], g['score']) for g in guesses],
+                         [(ids['20'], ids['21'], 1.0)])
+        self.assertEqual(find_fuzzy_dupes('2017-03-01 00:00:00'), [])
+
+    def test_fuzzy_dupes_in_big_block(self):
+        from event_exim import dupe_matching
+        from event_store.models import Event
+        Event.objects.all().delete()
+        # a national day of action: the same time everywhere in a zip prefix
+        self.source.update_events_from_dicts(
+            [_event_dict(self.source, i, title='{0} {0}'.format(word),
+                         zip='100{:02d}'.format(i))
+             for i, word in enumerate(['Alder', 'Birch', 'Cedar', 'Dogwood', 'Elm', 'Fir',
+                                       'Ginkgo', 'Hawthorn', 'Ironwood', 'Juniper', 'Kapok',
+                                       'Larch', 'Maple', 'Nutmeg', 'Oak', 'Pine', 'Quince',
+                                       'Redwood', 'Spruce', 'Teak', 'Upas', 'Willow'])]
+            + [_event_dict(self.source, 99, title='Birch, birch!', zip='10098')])
+        self.assertGreater(Event.objects.count(), dupe_matching.SMALL_BLOCK)
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        guesses = dupe_matching.find_fuzzy_dupes()
+        self.assertEqual([(g['source_event_id'], g['dupe_event_id']) for g in guesses],
+                         [(ids['1'], ids['99'])])
+
+    def test_guesses_made_as_events_are_saved(self):
+        from event_exim.models import EventDupeBlock, EventDupeGuesses
+        from event_store.models import Event
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        self.assertEqual(EventDupeBlock.objects.filter(event_id=ids['0']).count(), 4)
+        new_events = [
+            # typoed zip, 15 minutes later
+            _event_dict(self.source, 6, zip='10010',
+                        starts_at_utc=datetime.datetime(2017, 4, 1, 14, 15)),
+            _event_dict(self.source, 7, zip='10003', title='Something else entirely'),
+        ]
+        # the same number of queries however many events there are
+        with self.assertNumQueries(11):
+            self.source.update_events_from_dicts(new_events)
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        guesses = set(EventDupeGuesses.objects.values_list('source_event_id', 'dupe_event_id'))
+        self.assertIn((ids['0'], ids['6']), guesses)
+        # same zip and time
+        self.assertIn((ids['5'], ids['7']), guesses)
+        self.assertNotIn((ids['0'], ids['7']), guesses)
+        # cancelled events leave the index
+        self.source.update_events_from_dicts([dict(new_events[0], status='cancelled')])
+        self.assertEqual(EventDupeBlock.objects.filter(event_id=ids['6']).count(), 0)
+
+    def test_no_zip_is_not_the_same_place(self):
+        from event_exim.models import EventDupeBlock, EventDupeGuesses
+        from event_store.models import Event
+        EventDupeBlock.objects.all().delete()
+        self.source.update_events_from_dicts([
+            # no location, at the same time as the others, but nothing like them
+            _event_dict(self.source, 7, zip='', title='Potluck and letter writing'),
+            _event_dict(self.source, 8, zip='', title='Phone bank for the senate race')])
+        ids = dict(Event.objects.values_list('organization_source_pk', 'id'))
+        # only the events given are indexed (see event_dupe_finder --index for the rest)
+        self.assertEqual(EventDupeBlock.objects.filter(event_id=ids['0']).count(), 0)
+        guesses = set(EventDupeGuesses.objects.values_list('source_event_id', 'dupe_event_id'))
+        self.assertNotIn((ids['7'], ids['8']), guesses)
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not on windows
+    resource = None
+
+"""
+Small helpers for measuring where sync time goes -- see event_exim.models.SyncRun
+"""
+
+
+class PhaseTimer:
+    """
+    Adds up seconds spent in named phases, e.g.
+      with timer.phase('hosts'):
+          upsert_activists(...)
+    A phase can be entered many times (once per batch) and from several threads.
+    It also keeps how full the queues between pipelined stages were (see event_exim.pipeline).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seconds = {}
+            self.depths = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - started)
+
+    def totals(self):
+        with self.lock:
+            return {name: round(seconds, 3) for name, seconds in self.seconds.items()}
+
+    def sample(self, name, depth, size):
+        """Records that queue `name` (of up to `size` items) had `depth` items"""
+        with self.lock:
+            count, total, top, size = self.depths.get(name, (0, 0, 0, size))
+            self.depths[name] = (count + 1, total + depth, max(top, depth), size)
+
+    def queue_depths(self):
+        """{queue name: {'mean': #, 'max': #, 'size': #}}"""
+        with self.lock:
+            return {name: {'mean': round(total / count, 2), 'max': top, 'size': size}
+                    for name, (count, total, top, size) in self.depths.items()}
+
+
+def peak_memory_kb():
+    """This process's peak resident memory so far, in KB (None if we can't tell)"""
+    if resource is None:
+        return None
+    # kilobytes on linux (where we run, including lambda)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
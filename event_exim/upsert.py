@@ -0,0 +1,295 @@
+"""
+Set-based writes for syncing events from an EventSource.
+
+Instead of save()ing each changed event or host (which rewrites every column),
+we diff incoming event dicts and hosts against the stored rows in memory and
+only write the columns that changed, in batches.  For events:
+ * postgres: INSERT ... ON CONFLICT (organization_source_id, organization_source_pk) DO UPDATE
+ * elsewhere: bulk_create() for new rows and chunked CASE/WHEN UPDATEs
+   grouped by the set of columns that changed
+
+Before any of that, events whose source payload hashes the same as last time
+(Event.source_hash, see event_fingerprint()) are dropped with one lookup.
+
+This depends on the unique constraint on Event (organization_source, organization_source_pk).
+Hosts are looked up by the (member_system, member_system_pk) index and
+linked to an ActivistIdentity by hashed_email.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Value, When
+
+from event_store.models import Activist, ActivistIdentity, Event
+
+UPSERT_BATCH_SIZE = getattr(settings, 'EVENT_EXIM_UPSERT_BATCH_SIZE', 500)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def event_values(event_dict):
+    """
+    From a connector event dict (keyed by field name with model instances
+    for foreign keys) returns {attname: value} normalized like a value loaded
+    from the database, so it can be compared with stored events
+    """
+    values = {}
+    for name, val in event_dict.items():
+        field = Event._meta.get_field(name)
+        if field.is_relation:
+            val = getattr(val, 'pk', val)
+        elif val is not None:
+            val = field.to_python(val)
+        values[field.attname] = val
+    return values
+
+
+def event_fingerprint(event_dict):
+    """
+    sha256 hex digest of a connector event dict (with its host's fields),
+    serialized with sorted keys so the same payload always hashes the same
+    """
+    normalized = {}
+    for name, val in event_dict.items():
+        if name == 'source_hash':
+            continue
+        if name == 'source_json_data' and val:
+            val = json.loads(val)
+        elif isinstance(val, Activist):
+            val = [val.member_system_pk, val.hashed_email, val.email, val.name, val.phone]
+        elif name == 'organization_host' and isinstance(val, dict):
+            val = [val.get('member_system_pk'), val.get('hashed_email'), val.get('email'),
+                   val.get('name'), val.get('phone')]
+        elif isinstance(val, models.Model):
+            val = val.pk
+        normalized[name] = val
+    return hashlib.sha256(
+        json.dumps(normalized, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def stored_hashes(source, hashes, using=None):
+    """Which of `hashes` (Event.source_hash values) are already saved for source"""
+    using = using or router.db_for_read(Event)
+    hashes = list(hashes)
+    batch_size = connections[using].ops.bulk_batch_size(['source_hash'], hashes) or len(hashes)
+    found = set()
+    for chunk in _chunks(hashes, max(batch_size, 1)):
+        found.update(Event.objects.using(using)
+                     .filter(organization_source=source, source_hash__in=chunk)
+                     .values_list('source_hash', flat=True))
+    return found
+
+
+def changed_fields(event, values):
+    """attnames in values that differ from the stored event"""
+    return [k for k, v in values.items() if getattr(event, k) != v]
+
+
+def _pg_upsert(connection, events, update_fields):
+    """
+    One INSERT ... ON CONFLICT statement for events, which can be a mix of
+    new (unsaved) and changed (loaded, then modified) Event objects.
+    On conflict, only update_fields (and updated_at) are rewritten.
+    """
+    qn = connection.ops.quote_name
+    fields = [f for f in Event._meta.concrete_fields if not f.primary_key]
+    params = []
+    for event in events:
+        params.extend(f.get_db_prep_save(f.pre_save(event, event.pk is None), connection)
+                      for f in fields)
+    sql = 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({source}, {source_pk}) DO {action}'.format(
+        table=qn(Event._meta.db_table),
+        columns=', '.join(qn(f.column) for f in fields),
+        values=', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(events)),
+        source=qn(Event._meta.get_field('organization_source').column),
+        source_pk=qn(Event._meta.get_field('organization_source_pk').column),
+        action='UPDATE SET {}'.format(', '.join(
+            '{col} = EXCLUDED.{col}'.format(col=qn(Event._meta.get_field(f).column))
+            for f in sorted(set(update_fields) | set(['updated_at'])))))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def bulk_update_fields(objs, fields, using='default'):
+    """
+    Writes just `fields` (attnames) for already-saved model objects with
+    UPDATE ... SET col = CASE id WHEN ... END WHERE id IN (...),
+    in chunks small enough for the database's parameter limits.
+    auto_now fields (e.g. Event.updated_at) are bumped as save() would.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    connection = connections[using]
+    auto_now = [f for f in model._meta.concrete_fields
+                if getattr(f, 'auto_now', False) and f.attname not in fields]
+    batch_size = connection.ops.bulk_batch_size(['pk', 'pk'] + list(fields), objs) or len(objs)
+    for chunk in _chunks(objs, max(batch_size, 1)):
+        updates = {}
+        for attname in fields:
+            field = model._meta.get_field(attname)
+            updates[attname] = Case(*[When(pk=o.pk, then=Value(getattr(o, attname)))
+                                      for o in chunk],
+                                    output_field=field)
+        for field in auto_now:
+            updates[field.attname] = field.pre_save(chunk[0], False)
+        model.objects.using(using).filter(pk__in=[o.pk for o in chunk]).update(**updates)
+
+
+def _identities(hashed_emails, using='default'):
+    """
+    Returns {hashed_email: ActivistIdentity.id}, creating missing identities
+    """
+    identities = {}
+    hashed_emails = sorted(set(hashed_emails))
+    for chunk in _chunks(hashed_emails, UPSERT_BATCH_SIZE):
+        identities.update(ActivistIdentity.objects.using(using)
+                          .filter(hashed_email__in=chunk)
+                          .values_list('hashed_email', 'id'))
+    missing = [h for h in hashed_emails if h not in identities]
+    if missing:
+        try:
+            with transaction.atomic(using=using):
+                ActivistIdentity.objects.using(using).bulk_create(
+                    [ActivistIdentity(hashed_email=h) for h in missing],
+                    batch_size=UPSERT_BATCH_SIZE)
+        except IntegrityError:
+            # another sync created some of them first
+            for h in missing:
+                ActivistIdentity.objects.using(using).get_or_create(hashed_email=h)
+        for chunk in _chunks(missing, UPSERT_BATCH_SIZE):
+            identities.update(ActivistIdentity.objects.using(using)
+                              .filter(hashed_email__in=chunk)
+                              .values_list('hashed_email', 'id'))
+    return identities
+
+
+class _HostFields:
+    """Attribute access to a connector's host dict, like an Activist's"""
+    __slots__ = ('member_system_pk', 'hashed_email', 'email', 'name', 'phone', 'id', 'identity_id')
+
+    def __init__(self, host):
+        for name in ('member_system_pk', 'hashed_email', 'email', 'name', 'phone'):
+            setattr(self, name, host.get(name))
+        if self.hashed_email is None and self.email:
+            self.hashed_email = Activist.hash(self.email)
+        self.id = self.identity_id = None
+
+
+def upsert_activists(source, activists, batch_size=None):
+    """
+    Saves new and changed hosts for `source` in a few statements.
+    `activists` are host dicts (with the Activist fields) or (usually unsaved)
+    Activist objects from a connector -- the same member_system_pk can appear more than once.
+    Activist objects get their ids (and identity ids) set in-place, and we return
+    {member_system_pk: Activist.id}
+    """
+    batch_size = batch_size or UPSERT_BATCH_SIZE
+    using = router.db_for_write(Activist)
+    activists = [a if isinstance(a, Activist) else _HostFields(a) for a in activists]
+    by_pk = {}
+    for activist in activists:
+        by_pk.setdefault(str(activist.member_system_pk), []).append(activist)
+    identities = _identities([a.hashed_email for a in activists if a.hashed_email], using=using)
+
+    ids = {}
+    for pks in _chunks(list(by_pk.keys()), batch_size):
+        existing = {a.member_system_pk: a
+                    for a in Activist.objects.using(using).filter(member_system=source,
+                                                                  member_system_pk__in=pks)}
+        new_activists = []
+        changes = {}  # changed attnames -> activists
+        for pk in pks:
+            # last one wins, like successive save()s would
+            incoming = by_pk[pk][-1]
+            values = {'hashed_email': incoming.hashed_email,
+                      'email': incoming.email,
+                      'name': incoming.name,
+                      'phone': incoming.phone,
+                      'identity_id': identities.get(incoming.hashed_email)}
+            activist = existing.get(pk)
+            if activist is None:
+                new_activists.append(Activist(member_system=source, member_system_pk=pk, **values))
+                continue
+            changed = changed_fields(activist, values)
+            for attname in changed:
+                setattr(activist, attname, values[attname])
+            if changed:
+                changes.setdefault(tuple(sorted(changed)), []).append(activist)
+            ids[pk] = activist.id
+
+        if new_activists:
+            Activist.objects.using(using).bulk_create(new_activists)
+            if any(a.id is None for a in new_activists):
+                # only some databases (postgres) return ids from bulk inserts
+                for a_id, a_pk in (Activist.objects.using(using)
+                                   .filter(member_system=source,
+                                           member_system_pk__in=[a.member_system_pk
+                                                                 for a in new_activists])
+                                   .order_by('id').values_list('id', 'member_system_pk')):
+                    ids.setdefault(a_pk, a_id)
+            else:
+                ids.update((a.member_system_pk, a.id) for a in new_activists)
+        for fields, changed_activists in changes.items():
+            bulk_update_fields(changed_activists, fields, using=using)
+
+    for pk, pk_activists in by_pk.items():
+        for activist in pk_activists:
+            activist.id = ids.get(pk)
+            activist.identity_id = identities.get(activist.hashed_email)
+    return ids
+
+
+def upsert_events(source, event_dicts, batch_size=None):
+    """
+    Inserts new events and writes changed columns of existing ones for `source`.
+    Hosts (organization_host) should already be saved.
+    Returns counts: {'inserted': #, 'updated': #, 'unchanged': #}
+    """
+    batch_size = batch_size or UPSERT_BATCH_SIZE
+    using = router.db_for_write(Event)
+    connection = connections[using]
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    incoming = {str(e['organization_source_pk']): event_values(e) for e in event_dicts}
+    for pks in _chunks(list(incoming.keys()), batch_size):
+        existing = {e.organization_source_pk: e
+                    for e in Event.objects.using(using).filter(organization_source=source,
+                                                               organization_source_pk__in=pks)}
+        new_events = []
+        changed_events = []
+        changes = {}  # changed attnames -> events
+        for pk in pks:
+            values = incoming[pk]
+            event = existing.get(pk)
+            if event is None:
+                new_events.append(Event(**values))
+                continue
+            changed = changed_fields(event, values)
+            if not changed:
+                counts['unchanged'] += 1
+                continue
+            for attname in changed:
+                setattr(event, attname, values[attname])
+            changed_events.append(event)
+            changes.setdefault(tuple(sorted(changed)), []).append(event)
+
+        if connection.vendor == 'postgresql':
+            if new_events or changed_events:
+                update_fields = set()
+                for fields in changes:
+                    update_fields.update(fields)
+                _pg_upsert(connection, new_events + changed_events, update_fields)
+        else:
+            if new_events:
+                Event.objects.using(using).bulk_create(new_events)
+            for fields, events in changes.items():
+                bulk_update_fields(events, fields, using=using)
+        counts['inserted'] += len(new_events)
+        counts['updated'] += len(changed_events)
+    return counts
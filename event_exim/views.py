@@ -7,6 +7,7 @@ from osdi.pagination import OsdiPagination
 from rest_framework.viewsets import ModelViewSet
 
 from event_exim.models import EventSource
+from event_exim.refresh_queue import REFRESH_QUEUE, enqueue_refresh
 from event_exim.serializers import OsdiEventSerializer
 from event_store.models import Event
 
@@ -23,9 +24,15 @@ def refresh_event(request, eventsource_name, organization_source_pk):
 
     Bytes taken from:
     http://probablyprogramming.com/2009/03/15/the-tiniest-gif-ever
+
+    The event is queued to be refreshed (see event_exim.refresh_queue)
+    unless settings.EVENT_EXIM_REFRESH_QUEUE is False.
     """
     eventsource = get_object_or_404(EventSource, name=eventsource_name)
-    eventsource.update_event(organization_source_pk)
+    if REFRESH_QUEUE:
+        enqueue_refresh(eventsource.name, organization_source_pk)
+    else:
+        eventsource.update_event(organization_source_pk)
 
     return HttpResponse(
         bytes([71,73,70,56,57,97,1,0,1,0,0,255,0,44,0,0,0,0,1,0,1,0,0,2,0,59]),
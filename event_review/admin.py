@@ -205,16 +205,34 @@ class EventAdmin(MessageSendingAdminMixin, admin.ModelAdmin, EventDisplayAdminMi
     def obj_person_noun(self):
         return 'host(s)'
 
-    def message_template(self, message, event, user=None):
+    def message_bulk_context(self, events):
         """
-        NOTE: This takes a while to render, almost entirely because
-          get_host_event_link needs to get a login token by AK API, which takes some time.
-          This will SLOW mass message delivery
+        get_host_event_link needs a login token for each host from the AK API,
+        which takes a while -- so for many events, we get all the hosts' tokens
+        at once (concurrently) per source: {source id: {host pk: token}}
+        """
+        hosts_by_source = {}
+        sources = {}
+        for event in events:
+            src = event.organization_source
+            if src and event.organization_host_id and hasattr(src.api, 'get_login_tokens'):
+                sources.setdefault(src.id, src)
+                hosts_by_source.setdefault(src.id, set()).add(event.organization_host.member_system_pk)
+        return {src_id: sources[src_id].api.get_login_tokens(sorted(host_pks))
+                for src_id, host_pks in hosts_by_source.items()}
+
+    def message_template(self, message, event, user=None, bulk_context=None):
+        """
+        NOTE: Without bulk_context (see message_bulk_context) this takes a while to render,
+          almost entirely because get_host_event_link needs to get a login token by AK API.
         """
         src = event.organization_source
+        link_kwargs = {}
+        if bulk_context and src.id in bulk_context:
+            link_kwargs['login_tokens'] = bulk_context[src.id]
         host_link = src.api.get_host_event_link(event, edit_access=True,
                                                 host_id=event.organization_host.member_system_pk,
-                                                confirm=True)
+                                                confirm=True, **link_kwargs)
         email_subject = 'Regarding your event'#'Regarding your event with %s' % event.organization.title
         message = render_to_string(
             'event_review/message_to_host_email.html',
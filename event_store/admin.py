@@ -9,7 +9,7 @@ admin.site.register(Organization)
 
 @admin.register(EventDupeGuesses)
 class EventDupeGuessesAdmin(admin.ModelAdmin, EventDisplayAdminMixin):
-    list_display = ('source_event_list_display', 'dupe_event_list_display', 'decision')
+    list_display = ('source_event_list_display', 'dupe_event_list_display', 'score', 'decision')
     list_display_links = None
     list_editable = ('decision',)
 
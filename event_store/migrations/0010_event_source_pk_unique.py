@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:39
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_store', '0010_merge_duplicate_events'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='event',
+            unique_together=set([('organization_source', 'organization_source_pk')]),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:39
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_events(apps, schema_editor):
+    """
+    Older syncs could save the same source event more than once.
+    Keep the first (lowest id) of each, point dupe links and reviews at it
+    and delete the rest.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    Event = apps.get_model('event_store', 'Event')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    reviewed = [apps.get_model('reviewer', 'Review'),
+                apps.get_model('reviewer', 'ReviewLog')]
+    event_type = ContentType.objects.filter(app_label='event_store', model='event').first()
+    dupes = (Event.objects.filter(organization_source__isnull=False)
+             .values('organization_source_id', 'organization_source_pk')
+             .annotate(count=Count('id'), keep_id=Min('id'))
+             .filter(count__gt=1))
+    for dupe in dupes:
+        extra_ids = list(Event.objects.filter(
+            organization_source_id=dupe['organization_source_id'],
+            organization_source_pk=dupe['organization_source_pk']
+        ).exclude(id=dupe['keep_id']).values_list('id', flat=True))
+        Event.objects.filter(dupe_id__in=extra_ids).update(dupe_id=dupe['keep_id'])
+        if event_type:
+            for model in reviewed:
+                model.objects.filter(content_type=event_type, object_id__in=extra_ids
+                                     ).update(object_id=dupe['keep_id'])
+        Event.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_exim', '0010_merge_20170614_2305'),
+        ('event_store', '0009_auto_20180718_1739'),
+        ('reviewer', '0007_auto_20180817_1838'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_store', '0010_event_source_pk_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivistIdentity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hashed_email', models.CharField(help_text='sha256 hash hexdigest of the email address', max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='activist',
+            name='hashed_email',
+            field=models.CharField(blank=True, db_index=True, help_text='sha256 hash hexdigest of the email address', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='activist',
+            name='identity',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activists', to='event_store.ActivistIdentity'),
+        ),
+        migrations.AlterIndexTogether(
+            name='activist',
+            index_together=set([('member_system', 'member_system_pk')]),
+        ),
+    ]
@@ -32,14 +32,33 @@ class Organization(models.Model):
         return self.title
 
 
+class ActivistIdentity(models.Model):
+    """
+    One row per person (by hashed email) across member systems, so that
+    the same host coming in through different EventSources resolves to
+    the same identity with a single indexed lookup.
+    """
+    hashed_email = models.CharField(max_length=64, unique=True,
+                                    help_text="sha256 hash hexdigest of the email address")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.hashed_email
+
+
 class Activist(models.Model):
-    hashed_email = models.CharField(max_length=64, null=True, blank=True,
+    hashed_email = models.CharField(max_length=64, null=True, blank=True, db_index=True,
                                     help_text="sha256 hash hexdigest of the email address")
     email = models.CharField(max_length=765, null=True, blank=True)
     name = models.CharField(max_length=765, null=True, blank=True)
     member_system_pk = models.CharField(max_length=765, null=True, blank=True)
     member_system = models.ForeignKey('event_exim.EventSource', blank=True, null=True, db_index=True)
     phone = models.CharField(max_length=75, null=True, blank=True)
+    identity = models.ForeignKey(ActivistIdentity, related_name='activists',
+                                 null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        index_together = (('member_system', 'member_system_pk'),)
 
     def __str__(self):
         return self.name or 'Activist {}:{}'.format(str(self.member_system), self.member_system_pk)
@@ -152,6 +171,9 @@ class Event(models.Model):
     # in this field to resolve additional information.  It can be the original data,
     # but could also be more extended info like social sharing data
     source_json_data = models.TextField(null=True, blank=True)
+    # sha256 of the normalized event the source last sent us (see event_exim.upsert.event_fingerprint)
+    # so syncing can skip unchanged events, and anything else can cheaply tell when an event changed
+    source_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
     #hostId: {type: GraphQLString}, = add primary_host
     #localTimezone: {type: GraphQLString}, #not there, but starts_at + starts_at_utc sorta does that
@@ -200,6 +222,9 @@ class Event(models.Model):
     organization_status_prep = models.CharField(max_length=32, blank=True, null=True, db_index=True,
                                                 choices=EVENT_PREP_CHOICES)
 
+    class Meta:
+        # syncing upserts on this, see event_exim.upsert
+        unique_together = (('organization_source', 'organization_source_pk'),)
 
     def host_edit_url(self, edit_access=False):
         src = self.organization_source
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from reviewer.models import ReviewGroup, ReviewLog
+from reviewer.models import BulkContentJob, OutboundMessage, ReviewGroup, ReviewLog
 
 @admin.register(ReviewGroup)
 class ReviewGroupAdmin(admin.ModelAdmin):
@@ -14,3 +14,23 @@ class ReviewGroupAdmin(admin.ModelAdmin):
                     'visibility_level',
                     'log_type', 'message']
     search_fields = ['subject', 'object_id', 'message']
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'created_at', 'attempts',
+                    'next_attempt_at', 'sent_at', 'last_error']
+    list_filter = ['status']
+    readonly_fields = ['created_at', 'updated_at', 'claim', 'sent_at', 'last_error']
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(BulkContentJob)
+class BulkContentJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'log_type', 'status', 'total', 'processed', 'failed',
+                    'created_at', 'finished_at']
+    list_filter = ['status', 'log_type']
+    readonly_fields = ['started_at', 'finished_at', 'error']
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,106 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F
+
+from reviewer.models import BulkContentJob
+
+"""
+Background bulk notes/messages
+
+MessageSendingAdminMixin.bulk_content_action queues a BulkContentJob and
+returns right away. run_bulk_jobs() (the reviewer_bulk_jobs command, or
+event_exim.call_process.run_bulk_jobs) then calls the admin's deploy_messages()
+REVIEWER_BULK_JOB_CHUNK_SIZE objects at a time, updating the job's counts after
+each chunk so the reviewer_bulk_job endpoint can report progress.
+A chunk that fails is counted as failed and the job moves on to the next one.
+"""
+
+# False to do bulk actions in the admin request, like before
+BULK_JOBS = getattr(settings, 'REVIEWER_BULK_JOBS', True)
+BULK_JOB_CHUNK_SIZE = getattr(settings, 'REVIEWER_BULK_JOB_CHUNK_SIZE', 50)
+
+
+def queue_bulk_job(modeladmin, queryset, message, log_type, visibility, user):
+    return BulkContentJob.objects.create(
+        content_type=ContentType.objects.get_for_model(modeladmin.model),
+        object_ids=json.dumps(list(queryset.values_list('pk', flat=True))),
+        user=user,
+        message=message,
+        log_type=log_type,
+        visibility_level=(int(visibility) if visibility is not None else None),
+        total=queryset.count())
+
+
+def pending_total(user, log_types):
+    """How many objects are in this user's unfinished jobs -- they count towards send limits"""
+    remaining = 0
+    for total, processed, failed in BulkContentJob.objects.filter(
+            user=user, log_type__in=log_types, status__in=('queued', 'running')
+    ).values_list('total', 'processed', 'failed'):
+        remaining += total - processed - failed
+    return remaining
+
+
+def _claim(job):
+    """True if we got to run the job (and not another worker)"""
+    return BulkContentJob.objects.filter(id=job.id, status='queued').update(
+        status='running', started_at=datetime.datetime.now()) == 1
+
+
+def run_bulk_job(job, chunk_size=None):
+    chunk_size = chunk_size or BULK_JOB_CHUNK_SIZE
+    if not _claim(job):
+        return None
+    job.refresh_from_db()
+    model = job.content_type.model_class()
+    modeladmin = admin.site._registry.get(model)
+    try:
+        if modeladmin is None:
+            raise Exception('{} has no admin to send with'.format(model))
+        object_ids = json.loads(job.object_ids)
+        log_type = job.log_type
+        if job.total > 1:
+            # so a last chunk of one is still logged as part of a bulk send
+            log_type = {'message': 'bulkmsg', 'note': 'bulknote'}.get(log_type, log_type)
+        for i in range(0, len(object_ids), chunk_size):
+            chunk_ids = object_ids[i:i + chunk_size]
+            try:
+                objects = list(model.objects.filter(pk__in=chunk_ids))
+                modeladmin.deploy_messages(job.message, objects,
+                                           log_type=log_type,
+                                           visibility=job.visibility_level,
+                                           user=job.user)
+                # missing objects (deleted since the job was queued) are failures
+                BulkContentJob.objects.filter(id=job.id).update(
+                    processed=F('processed') + len(objects),
+                    failed=F('failed') + len(chunk_ids) - len(objects))
+            except Exception as e:
+                BulkContentJob.objects.filter(id=job.id).update(
+                    failed=F('failed') + len(chunk_ids),
+                    error='{}: {}'.format(type(e).__name__, e))
+        status = 'done'
+    except Exception as e:
+        BulkContentJob.objects.filter(id=job.id).update(
+            error='{}: {}'.format(type(e).__name__, e))
+        status = 'failed'
+    BulkContentJob.objects.filter(id=job.id).update(
+        status=status, finished_at=datetime.datetime.now())
+    job.refresh_from_db()
+    return job
+
+
+def run_bulk_jobs(chunk_size=None, max_jobs=None):
+    """Runs queued jobs, oldest first. Returns the progress of each"""
+    results = []
+    while not max_jobs or len(results) < max_jobs:
+        job = BulkContentJob.objects.filter(status='queued').order_by('id').first()
+        if job is None:
+            break
+        job = run_bulk_job(job, chunk_size=chunk_size)
+        if job:
+            results.append(job.progress())
+    return results
@@ -0,0 +1,123 @@
+import datetime
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from reviewer.models import ReviewLog
+
+"""
+How many people each reviewer has messaged recently, for the
+BULK_NOTEMESSAGE_DAY_MAX/WEEK_MAX limits in bulk_content_action.
+
+Rather than counting ReviewLog rows on every check, deploy_messages() adds
+to a per-reviewer, per-hour redis counter that expires after a week.
+The day and week counts are the sum of the last 24 and 168 hourly
+counters, read with one MGET.
+
+Each reviewer's counters are seeded from ReviewLog the first time they are
+read, which sets a per-reviewer 'seeded' key.  If redis is flushed (or evicts
+that key), the next read finds it missing and counts from ReviewLog, reseeding
+the counters as it goes -- rather than reading 0 and letting the limit lapse.
+`./manage.py reviewer_rebuild_contact_counts` reseeds everyone at once.
+If redis is unavailable, the counts come from ReviewLog, like before.
+"""
+
+REDIS_CACHE_KEY = getattr(settings, 'REVIEWER_CACHE_KEY', 'default')
+
+CONTACT_LOG_TYPES = ('message', 'bulkmsg')
+WEEK_HOURS = 24 * 7
+# kept a little longer than a week, so the oldest hour we sum is still there
+BUCKET_EXPIRE = (WEEK_HOURS + 2) * 3600
+
+
+def _bucket_key(user_id, hour):
+    return 'reviewer_contacts_{}_{}'.format(user_id, hour.strftime('%Y%m%d%H'))
+
+
+def _seeded_key(user_id):
+    return 'reviewer_contacts_seeded_{}'.format(user_id)
+
+
+def _hours(now):
+    """The last week of hours, most recent first"""
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    return [hour - datetime.timedelta(hours=i) for i in range(WEEK_HOURS)]
+
+
+def record_contacts(user_id, count, when=None):
+    if not count:
+        return
+    hour = (when or datetime.datetime.now()).replace(minute=0, second=0, microsecond=0)
+    key = _bucket_key(user_id, hour)
+    try:
+        pipe = get_redis_connection(REDIS_CACHE_KEY).pipeline()
+        pipe.incrby(key, count)
+        pipe.expire(key, BUCKET_EXPIRE)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def _db_contact_counts(user, now):
+    howmany = ReviewLog.objects.filter(reviewer=user, log_type__in=CONTACT_LOG_TYPES)
+    return (howmany.filter(created_at__gte=now - datetime.timedelta(days=1)).count(),
+            howmany.filter(created_at__gte=now - datetime.timedelta(days=7)).count())
+
+
+def contact_counts(user):
+    """(# contacted in the last day, # in the last week) by the user"""
+    now = datetime.datetime.now()
+    try:
+        seeded, *values = get_redis_connection(REDIS_CACHE_KEY).mget(
+            [_seeded_key(user.id)] + [_bucket_key(user.id, hour) for hour in _hours(now)])
+    except RedisError:
+        return _db_contact_counts(user, now)
+    if not seeded:
+        try:
+            rebuild_contact_counts([user.id])
+        except RedisError:
+            pass
+        return _db_contact_counts(user, now)
+    counts = [int(v) if v else 0 for v in values]
+    return (sum(counts[:24]), sum(counts))
+
+
+def rebuild_contact_counts(user_ids=None):
+    """
+    Resets the counters from ReviewLog, for user_ids or everyone.
+    Returns how many reviewers have contacts in the last week.
+    """
+    now = datetime.datetime.now()
+    hours = _hours(now)
+    logs = ReviewLog.objects.filter(log_type__in=CONTACT_LOG_TYPES,
+                                    created_at__gte=hours[-1])
+    if user_ids is not None:
+        logs = logs.filter(reviewer_id__in=user_ids)
+    buckets = {}  # user_id -> {hour: count}
+    for user_id, created_at in logs.values_list('reviewer_id', 'created_at').iterator():
+        hour = created_at.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+        user_buckets = buckets.setdefault(user_id, {})
+        user_buckets[hour] = user_buckets.get(hour, 0) + 1
+
+    redis = get_redis_connection(REDIS_CACHE_KEY)
+    pipe = redis.pipeline()
+    if user_ids is None:
+        for key in redis.scan_iter(match='reviewer_contacts_*'):
+            pipe.delete(key)
+        # reviewers with nothing to count are seeded when first read
+        user_ids = list(buckets)
+    else:
+        for user_id in user_ids:
+            for hour in hours:
+                pipe.delete(_bucket_key(user_id, hour))
+    for user_id, user_buckets in buckets.items():
+        for hour, count in user_buckets.items():
+            # expire when it would have if it was counted as it happened
+            expire = BUCKET_EXPIRE - int((now - hour).total_seconds())
+            if expire > 0:
+                pipe.set(_bucket_key(user_id, hour), count, ex=expire)
+    for user_id in user_ids:
+        pipe.set(_seeded_key(user_id), 1)
+    pipe.execute()
+    return len(buckets)
@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+from itertools import chain
+import json
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.mail import get_connection as get_mail_connection
+from django.db import connection
+
+from reviewer.models import OutboundMessage
+
+"""
+Outgoing mail spool
+
+MessageSendingAdminMixin.deploy_messages saves messages here (OutboundMessage)
+rather than talking to the mail server during the admin request.
+send_spooled() (the reviewer_send_mail command, or
+event_exim.call_process.run_mail_spool) sends them:
+ * with REVIEWER_MAIL_WORKERS threads, each keeping one mail server connection
+   open for everything it sends
+ * a message that fails is retried after a backoff that doubles each time,
+   up to REVIEWER_MAIL_MAX_ATTEMPTS, and then marked failed
+ * workers claim messages before sending, so several can run at once
+"""
+
+# False to send from the request, like before
+MAIL_SPOOL = getattr(settings, 'REVIEWER_MAIL_SPOOL', True)
+MAIL_WORKERS = getattr(settings, 'REVIEWER_MAIL_WORKERS', 4)
+MAIL_BATCH_SIZE = getattr(settings, 'REVIEWER_MAIL_BATCH_SIZE', 100)
+MAIL_MAX_ATTEMPTS = getattr(settings, 'REVIEWER_MAIL_MAX_ATTEMPTS', 5)
+# seconds before the first retry
+MAIL_RETRY_BACKOFF = getattr(settings, 'REVIEWER_MAIL_RETRY_BACKOFF', 60)
+# seconds until a message a worker claimed (and maybe died sending) can be sent by another
+MAIL_CLAIM_TIMEOUT = getattr(settings, 'REVIEWER_MAIL_CLAIM_TIMEOUT', 600)
+
+
+def spool_messages(message_dicts):
+    """Queues create_message() argument dicts to be sent"""
+    return OutboundMessage.objects.bulk_create([
+        OutboundMessage(message=json.dumps(m)) for m in message_dicts])
+
+
+def claim_messages(limit):
+    """Marks up to `limit` due messages as ours to send and returns them"""
+    now = datetime.datetime.now()
+    # messages claimed by a worker that never finished
+    OutboundMessage.objects.filter(
+        status='sending',
+        updated_at__lt=now - datetime.timedelta(seconds=MAIL_CLAIM_TIMEOUT)
+    ).update(status='queued', claim=None)
+    ids = list(OutboundMessage.objects.filter(status='queued', next_attempt_at__lte=now)
+               .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    claim = uuid.uuid4().hex
+    OutboundMessage.objects.filter(id__in=ids, status='queued').update(
+        status='sending', claim=claim, updated_at=now)
+    return list(OutboundMessage.objects.filter(claim=claim, status='sending'))
+
+
+class _Sender:
+    """One mail server connection per thread, kept open between messages"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            conn = self.local.connection = get_mail_connection()
+            if hasattr(conn, 'open'):
+                conn.open()
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def reset(self):
+        conn = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def send(self, outbound):
+        from reviewer.message_sending import create_message
+        now = datetime.datetime.now()
+        outbound.attempts += 1
+        try:
+            sent = self.connection().send_messages(
+                [create_message(**json.loads(outbound.message))])
+            if not sent:
+                raise Exception('the mail server did not accept the message')
+        except Exception as e:
+            # start over with a new connection
+            self.reset()
+            outbound.last_error = '{}: {}'.format(type(e).__name__, e)
+            if outbound.attempts >= MAIL_MAX_ATTEMPTS:
+                outbound.status = 'failed'
+            else:
+                outbound.status = 'queued'
+                outbound.next_attempt_at = now + datetime.timedelta(
+                    seconds=MAIL_RETRY_BACKOFF * (2 ** (outbound.attempts - 1)))
+        else:
+            outbound.status = 'sent'
+            outbound.sent_at = now
+        outbound.claim = None
+        outbound.save()
+        return outbound.status
+
+    def send_all(self, outbound):
+        """For a worker thread: sends each of outbound, then closes the thread's database connection"""
+        try:
+            return [self.send(o) for o in outbound]
+        finally:
+            connection.close()
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def send_spooled(workers=None, batch_size=None, max_batches=None):
+    """
+    Sends due messages until there are none left (or max_batches are done).
+    Returns counts: {'sent', 'retrying', 'failed'}
+    """
+    workers = workers or MAIL_WORKERS
+    batch_size = batch_size or MAIL_BATCH_SIZE
+    counts = {'sent': 0, 'retrying': 0, 'failed': 0}
+    sender = _Sender()
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    batches = 0
+    try:
+        while not max_batches or batches < max_batches:
+            outbound = claim_messages(batch_size)
+            if not outbound:
+                break
+            if executor:
+                statuses = chain.from_iterable(executor.map(
+                    sender.send_all, [outbound[i::workers] for i in range(workers)]))
+            else:
+                statuses = map(sender.send, outbound)
+            for status in statuses:
+                counts['retrying' if status == 'queued' else status] += 1
+            batches += 1
+    finally:
+        if executor:
+            executor.shutdown()
+        sender.close()
+    return counts
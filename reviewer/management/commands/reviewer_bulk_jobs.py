@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reviewer.bulk_jobs import run_bulk_jobs
+
+
+class Command(BaseCommand):
+
+    help = ('Does bulk notes/messages queued from the admin (see reviewer.bulk_jobs).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk_size',
+                            help=('How many objects to do at a time.'
+                                  ' Defaults to settings.REVIEWER_BULK_JOB_CHUNK_SIZE'),
+                            type=int)
+        parser.add_argument('--loop',
+                            help=('Keep checking for queued jobs every LOOP seconds, rather than once'),
+                            type=int)
+
+    def handle(self, *args, **options):
+        while True:
+            for result in run_bulk_jobs(chunk_size=options.get('chunk_size')):
+                print(result)
+            if not options.get('loop'):
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from reviewer.contact_limits import rebuild_contact_counts
+
+
+class Command(BaseCommand):
+
+    help = ('Reseeds the redis counters for reviewer contact limits from ReviewLog'
+            ' (e.g. after redis was flushed).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user_id',
+                            help='only rebuild these users (comma-separated ids)',
+                            type=str)
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options.get('user_id'):
+            user_ids = [int(u) for u in options['user_id'].split(',')]
+        print('rebuilt contact counts for {} reviewers'.format(rebuild_contact_counts(user_ids)))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reviewer.mail_spool import send_spooled
+
+
+class Command(BaseCommand):
+
+    help = ('Sends messages queued by the reviewer admin (see reviewer.mail_spool).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            help=('How many messages to send at the same time.'
+                                  ' Defaults to settings.REVIEWER_MAIL_WORKERS'),
+                            type=int)
+        parser.add_argument('--batch_size',
+                            help=('How many queued messages to take at a time.'
+                                  ' Defaults to settings.REVIEWER_MAIL_BATCH_SIZE'),
+                            type=int)
+        parser.add_argument('--loop',
+                            help=('Keep sending queued messages every LOOP seconds, rather than once'),
+                            type=int)
+
+    def handle(self, *args, **options):
+        while True:
+            print(send_spooled(workers=options.get('workers'),
+                               batch_size=options.get('batch_size')))
+            if not options.get('loop'):
+                break
+            time.sleep(options['loop'])
@@ -1,4 +1,3 @@
-import datetime
 import json
 import random
 
@@ -12,8 +11,12 @@ from django.http import HttpResponse
 from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.urls import reverse, NoReverseMatch
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
+from reviewer.bulk_jobs import BULK_JOBS, pending_total, queue_bulk_job
+from reviewer.contact_limits import CONTACT_LOG_TYPES, contact_counts, record_contacts
+from reviewer.mail_spool import MAIL_SPOOL, spool_messages
 from reviewer.models import ReviewGroup, ReviewLog
 
 class MessageSendingAdminMixin:
@@ -33,6 +36,8 @@ class MessageSendingAdminMixin:
     * obj2orgslug: If there is a different way to derive the organization (slug) then use this
       - For particular admin interfaces you might, e.g. want to hardcode the organization
     * message_template: Customize the email content that goes out from the message and the object
+    * message_bulk_context: Look up things message_template needs for all the objects at once
+      (e.g. anything that needs a remote call per object)
     """
     send_a_message_placeholder = 'Send a message'
     # something to track the organization, to send options for visibility
@@ -92,7 +97,14 @@ class MessageSendingAdminMixin:
         """
         return self.model.objects.filter(pk=obj_id).first()
 
-    def message_template(self, message, obj, user=None):
+    def message_bulk_context(self, objects):
+        """
+        Called once before message_template() is called for each of objects.
+        Whatever this returns is passed to message_template() as bulk_context.
+        """
+        return None
+
+    def message_template(self, message, obj, user=None, bulk_context=None):
         message_txt = render_to_string(
             'reviewer/message_to_member.html',
             {'header': getattr(settings, 'EMAIL_HEADER', ''),
@@ -113,17 +125,23 @@ class MessageSendingAdminMixin:
         """
         1. create EmailMessage objects using template_func as an adapter/transformer to objects
         2. save message to object (in reviewlog or contactmessage thingie
-        3. send the messages
+        3. send the messages -- or with REVIEWER_MAIL_SPOOL, queue them for
+           reviewer.mail_spool to send, so the admin request doesn't wait on the mail server
         It will not check access control
         """
         bulktypes = {'message': 'bulkmsg', 'note': 'bulknote'}
         messages = []
         review_logs = []
         if log_type in ('message', 'bulkmsg'):
+            bulk_context = self.message_bulk_context(objects)
+            message_dicts = []
             for obj in objects:
-                message_dict = self.message_template(message, obj, user)
+                message_dict = self.message_template(message, obj, user, bulk_context=bulk_context)
+                message_dicts.append(message_dict)
                 messages.append(create_message(**message_dict))
-            if actually_send:
+            if actually_send and MAIL_SPOOL:
+                spool_messages(message_dicts)
+            elif actually_send:
                 connection = get_mail_connection()
                 if hasattr(connection, 'open'):
                     connection.open()
@@ -147,6 +165,8 @@ class MessageSendingAdminMixin:
                                              message=message))
             if review_logs:
                 ReviewLog.objects.bulk_create(review_logs)
+                if log_type in CONTACT_LOG_TYPES:
+                    record_contacts(user.id, len(review_logs))
         return (messages, review_logs)
 
     def obj2org(self, obj):
@@ -209,6 +229,9 @@ class MessageSendingAdminMixin:
             no_continue_message = 'Contact a site administrator about getting permission to {}.'.format(action)
         count = queryset.count()
         max_apply = getattr(settings, "BULK_NOTEMESSAGE_MAX", 200)
+        if BULK_JOBS and request.user.is_staff and not perms_needed:
+            # done in the background, so the request can't time out
+            max_apply = getattr(settings, "BULK_NOTEMESSAGE_STAFF_MAX", 2000)
 
         organization_slug = request.POST.get('organization')
         if not organization_slug:
@@ -220,11 +243,11 @@ class MessageSendingAdminMixin:
                 organization_slug = orgslugs[0]
 
         if log_type in ('message', 'bulkmsg'):
-            howmany = ReviewLog.objects.filter(reviewer=request.user,
-                                               log_type__in=('message', 'bulkmsg'))
-            curtime = datetime.datetime.now()
-            weekcount = howmany.filter(created_at__gte=curtime-datetime.timedelta(days=7)).count()
-            daycount = howmany.filter(created_at__gte=curtime-datetime.timedelta(days=1)).count()
+            daycount, weekcount = contact_counts(request.user)
+            # messages in jobs that haven't been sent yet count too
+            pending = pending_total(request.user, CONTACT_LOG_TYPES)
+            daycount += pending
+            weekcount += pending
             max_daycount = getattr(settings, 'BULK_NOTEMESSAGE_DAY_MAX', 200)
             max_weekcount = getattr(settings, 'BULK_NOTEMESSAGE_WEEK_MAX', 200)
             if (daycount + count) > max_daycount:
@@ -240,6 +263,15 @@ class MessageSendingAdminMixin:
                 visibility = request.POST.get('visibility')
                 if visibility is None:
                     visibility = ReviewGroup.user_visibility(organization_slug, request.user)
+                if BULK_JOBS:
+                    job = queue_bulk_job(modeladmin, queryset, message,
+                                         log_type=log_type,
+                                         visibility=visibility,
+                                         user=request.user)
+                    modeladmin.message_user(request, format_html(
+                        '{} to {} queued. <a href="{}">Progress</a>',
+                        verb, job.total, reverse('reviewer_bulk_job', args=[job.id])))
+                    return None
                 modeladmin.deploy_messages(message, list(queryset),
                                            log_type=log_type,
                                            visibility=visibility,
@@ -292,8 +324,8 @@ def create_message(to=None, subject=None, message_text=None, message_html='',
                                          **extra_args)
     if message_html:
         mailmessage.attach_alternative(message_html, "text/html")
-    # This is inefficient. Use a petitions/queues.py EmailProcessor to send even
-    # transactional messages faster
+    # This is inefficient. Queue with reviewer.mail_spool.spool_messages() to send
+    # even transactional messages faster
     if actually_send:
         mailmessage.send(fail_silently=True)
     return mailmessage
@@ -227,3 +227,77 @@ class ReviewLog(models.Model):
             ('bulk_note_add', 'bulk note adding'),
             )
 
+
+class OutboundMessage(models.Model):
+    """
+    An email waiting to be sent (or that was) by reviewer.mail_spool.
+    `message` is json of create_message() arguments.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    status = models.CharField(max_length=8, default='queued', db_index=True,
+                              choices=(('queued', 'Queued'),
+                                       ('sending', 'Sending'),
+                                       ('sent', 'Sent'),
+                                       ('failed', 'Failed')))
+    message = models.TextField()
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=datetime.datetime.now)
+    # set by the worker that is sending it
+    claim = models.CharField(max_length=32, null=True, blank=True, db_index=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = (('status', 'next_attempt_at'),)
+
+    def __str__(self):
+        return '{} {}'.format(self.id, self.status)
+
+
+class BulkContentJob(models.Model):
+    """
+    A bulk note/message from MessageSendingAdminMixin.bulk_content_action,
+    done in chunks by reviewer.bulk_jobs rather than in the admin request.
+    """
+    # the model of the admin that queued it (its ModelAdmin renders the messages)
+    content_type = models.ForeignKey(ContentType)
+    object_ids = models.TextField(help_text="json list of pks")
+    user = models.ForeignKey(User)
+    message = models.TextField()
+    log_type = models.CharField(max_length=8)
+    visibility_level = models.IntegerField(null=True, blank=True)
+
+    status = models.CharField(max_length=8, default='queued', db_index=True,
+                              choices=(('queued', 'Queued'),
+                                       ('running', 'Running'),
+                                       ('done', 'Done'),
+                                       ('failed', 'Failed')))
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} {} {}/{}'.format(self.id, self.status, self.processed, self.total)
+
+    def progress(self):
+        """What the reviewer_bulk_job endpoint reports"""
+        seconds = None
+        if self.started_at:
+            seconds = ((self.finished_at or datetime.datetime.now())
+                       - self.started_at).total_seconds()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'percent': (round(100.0 * (self.processed + self.failed) / self.total, 1)
+                        if self.total else 100.0),
+            'per_second': (round(self.processed / seconds, 2) if seconds else None),
+            'error': self.error,
+        }
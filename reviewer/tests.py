@@ -0,0 +1,158 @@
+import datetime
+
+from django.core import mail
+from django.test import Client, TestCase
+from django.urls import reverse
+
+
+class MailSpoolTestCase(TestCase):
+
+    def spool(self, count):
+        from reviewer.mail_spool import spool_messages
+        spool_messages([{'to': 'host{}@example.com'.format(i),
+                         'subject': 'About your event',
+                         'message_text': 'Hello',
+                         'from_line': 'Reviewer <reviewer@example.com>'}
+                        for i in range(count)])
+
+    def test_send_spooled(self):
+        from reviewer.mail_spool import send_spooled
+        from reviewer.models import OutboundMessage
+        self.spool(3)
+        self.assertEqual(len(mail.outbox), 0)
+        counts = send_spooled(workers=1, batch_size=2)
+        self.assertEqual(counts, {'sent': 3, 'retrying': 0, 'failed': 0})
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         ['host0@example.com', 'host1@example.com', 'host2@example.com'])
+        self.assertEqual(OutboundMessage.objects.filter(status='sent').count(), 3)
+        # nothing left to send
+        self.assertEqual(send_spooled(workers=1)['sent'], 0)
+
+    def test_retry_with_backoff(self):
+        from unittest import mock
+        from reviewer import mail_spool
+        from reviewer.models import OutboundMessage
+        self.spool(1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=ConnectionError('refused')):
+            counts = mail_spool.send_spooled(workers=1)
+        self.assertEqual(counts, {'sent': 0, 'retrying': 1, 'failed': 0})
+        outbound = OutboundMessage.objects.get()
+        self.assertEqual((outbound.status, outbound.attempts), ('queued', 1))
+        self.assertIn('refused', outbound.last_error)
+        self.assertGreater(outbound.next_attempt_at, datetime.datetime.now())
+        # not due yet
+        self.assertEqual(mail_spool.send_spooled(workers=1)['sent'], 0)
+
+        OutboundMessage.objects.update(next_attempt_at=datetime.datetime.now(),
+                                       attempts=mail_spool.MAIL_MAX_ATTEMPTS - 1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=ConnectionError('refused')):
+            counts = mail_spool.send_spooled(workers=1)
+        self.assertEqual(counts['failed'], 1)
+        self.assertEqual(OutboundMessage.objects.get().status, 'failed')
+
+
+class BulkContentJobTestCase(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group, User
+        from event_store.models import Organization
+        self.user = User.objects.create(username='reviewer', first_name='Re', last_name='Viewer',
+                                        email='reviewer@example.com')
+        self.orgs = [Organization.objects.create(title='Org{}'.format(i), slug='org{}'.format(i),
+                                                 osdi_source_id='org{}'.format(i),
+                                                 group=Group.objects.create(name='org{}'.format(i)))
+                     for i in range(5)]
+
+    def test_job_runs_in_chunks(self):
+        from unittest import mock
+        from django.contrib import admin
+        from event_store.models import Organization
+        from reviewer.bulk_jobs import queue_bulk_job, run_bulk_jobs
+        from reviewer.message_sending import MessageSendingAdminMixin
+        from reviewer.models import OutboundMessage, ReviewLog
+
+        class OrgAdmin(MessageSendingAdminMixin, admin.ModelAdmin):
+            def obj2org(self, obj):
+                return obj
+
+            def message_template(self, message, obj, user=None, bulk_context=None):
+                return {'to': '{}@example.com'.format(obj.slug), 'subject': 'hi',
+                        'message_text': message, 'from_line': user.email}
+
+        orgadmin = OrgAdmin(Organization, admin.site)
+        job = queue_bulk_job(orgadmin, Organization.objects.all(), 'Hello',
+                             log_type='message', visibility=1, user=self.user)
+        self.assertEqual((job.status, job.total), ('queued', 5))
+        with mock.patch.dict(admin.site._registry, {Organization: orgadmin}):
+            results = run_bulk_jobs(chunk_size=2)
+        self.assertEqual(len(results), 1)
+        self.assertEqual({k: results[0][k] for k in ('status', 'processed', 'failed', 'percent')},
+                         {'status': 'done', 'processed': 5, 'failed': 0, 'percent': 100.0})
+        self.assertEqual(OutboundMessage.objects.count(), 5)
+        # the last chunk (of one) is still a bulk message
+        self.assertEqual(set(ReviewLog.objects.values_list('log_type', flat=True)), {'bulkmsg'})
+        # nothing left to do
+        self.assertEqual(run_bulk_jobs(), [])
+
+    def test_job_status_endpoint(self):
+        from django.contrib.auth.models import User
+        from event_store.models import Organization
+        from reviewer.bulk_jobs import queue_bulk_job
+
+        class FakeAdmin:
+            model = Organization
+
+        job = queue_bulk_job(FakeAdmin(), Organization.objects.all(), 'A note',
+                             log_type='note', visibility=1, user=self.user)
+        c = Client()
+        c.force_login(self.user)
+        response = c.get(reverse('reviewer_bulk_job', args=[job.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'queued')
+        c.force_login(User.objects.create(username='other'))
+        self.assertEqual(c.get(reverse('reviewer_bulk_job', args=[job.id])).status_code, 403)
+
+
+class ContactLimitsTestCase(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group, User
+        from django_redis import get_redis_connection
+        from event_store.models import Organization
+        get_redis_connection('default').flushdb()
+        self.user = User.objects.create(username='reviewer')
+        self.org = Organization.objects.create(title='Org', slug='org', osdi_source_id='org',
+                                               group=Group.objects.create(name='org'))
+
+    def log(self, count, hours_ago, log_type='bulkmsg'):
+        from django.contrib.contenttypes.models import ContentType
+        from reviewer.models import ReviewLog
+        ReviewLog.objects.bulk_create([
+            ReviewLog(content_type=ContentType.objects.get_for_model(self.org),
+                      object_id=self.org.id, organization=self.org, reviewer=self.user,
+                      log_type=log_type, visibility_level=1, message='hi')
+            for i in range(count)])
+        newest = list(ReviewLog.objects.order_by('-id').values_list('id', flat=True)[:count])
+        ReviewLog.objects.filter(id__in=newest).update(
+            created_at=datetime.datetime.now() - datetime.timedelta(hours=hours_ago))
+
+    def test_counts_recorded_and_rebuilt(self):
+        from django_redis import get_redis_connection
+        from reviewer.contact_limits import contact_counts, rebuild_contact_counts, record_contacts
+        now = datetime.datetime.now()
+        for count, hours_ago in ((3, 0), (2, 30), (4, 200)):
+            self.log(count, hours_ago)
+            record_contacts(self.user.id, count, when=now - datetime.timedelta(hours=hours_ago))
+        self.log(5, 1, log_type='bulknote')
+        self.assertEqual(rebuild_contact_counts(), 1)
+        record_contacts(self.user.id, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(contact_counts(self.user), (4, 6))
+
+        # flushed: counted from ReviewLog, and reseeded
+        get_redis_connection('default').flushdb()
+        self.assertEqual(contact_counts(self.user), (3, 5))
+        with self.assertNumQueries(0):
+            self.assertEqual(contact_counts(self.user), (3, 5))
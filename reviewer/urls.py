@@ -6,6 +6,8 @@ urlpatterns = [
         name='reviewer_current'),
     url(r'^history/(?P<organization>[-.\w]+)/?$', views.get_review_history,
         name='reviewer_history'),
+    url(r'^job/(?P<job_id>\d+)/?$', views.bulk_job_status,
+        name='reviewer_bulk_job'),
     url(r'^focus/(?P<organization>[-.\w]+)/(?P<content_type>\w+)/(?P<pk>\w+)/?$', views.mark_focus,
         name='reviewer_visit'),
     url(r'^(?P<organization>[-.\w]+)/(?P<content_type>\w+)/(?P<pk>\w+)/?$', views.save_review,
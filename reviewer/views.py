@@ -12,7 +12,7 @@ from django.utils import timezone
 
 from django_redis import get_redis_connection
 
-from reviewer.models import Review, ReviewLog, ReviewGroup
+from reviewer.models import BulkContentJob, Review, ReviewLog, ReviewGroup
 
 """
   This api tries to keep things super-fast using redis datastructures
@@ -335,3 +335,12 @@ def delete_review(request, organization, content_type, pk, id):
             ReviewLog.objects.filter(id=id, organization__slug=organization).delete()
             return HttpResponse("deleted")
     return HttpResponse("nope")
+
+
+def bulk_job_status(request, job_id):
+    """Progress of a bulk note/message job, for the user who queued it"""
+    job = get_object_or_404(BulkContentJob, pk=job_id)
+    if not request.user.is_authenticated or (
+            job.user_id != request.user.id and not request.user.is_superuser):
+        return HttpResponseForbidden('nope')
+    return JsonResponse(job.progress())